@@ -0,0 +1,223 @@
+# benchmark of single-diode MPP solvers on the Kalkbult weather year
+#
+# Runs the calcparams_cec -> maximum power point path of
+# pvlib_spec_sheet_module.py over poa_data_2020 with every solver method,
+# records wall time, peak traced memory, NaNs and the deviation from the
+# explicit Lambert W solution, and writes the results as JSON. A stored
+# result can be passed as a baseline to flag slower or less accurate solvers.
+#
+#     python benchmark_sdm.py --out sdm_benchmark.json
+#     python benchmark_sdm.py --baseline sdm_benchmark.json  # exit 1 on regressions
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pvlib
+import scipy
+from pvlib.location import Location
+
+import pvlib_array_dc as ad
+from sam_database import open_database
+from solar_cache import get_solarposition
+from weather_store import load_dataset
+
+METHODS = ('newton', 'brentq', 'chandrupatla', 'lambertw', 'array_dc')
+REFERENCE = 'lambertw'  # explicit solution the other methods are compared to
+MODULE = 'Jinko_Solar_Co___Ltd_JKM290P_72'
+DATASET = 'poa_data_2020_io'
+MIN_POWER = 1.  # [W] MPPs below this (night, dawn) are left out of the deviations
+TIME_TOLERANCE = 0.25  # relative slow-down against a baseline counted as a regression
+DEVIATION_TOLERANCE = 1e-6  # increase of a max relative deviation counted as a regression
+
+location = Location(latitude=-30.09318567206943, longitude=24.13940478600872,
+                    tz='Africa/Johannesburg', altitude=1400, name='Kalkbult')
+surface_tilt = 45
+surface_azimuth = 0
+
+
+def kalkbult_inputs(dataset=DATASET):
+    """
+    Effective irradiance and cell temperature of the spec-sheet pipeline.
+
+    :param dataset: weather_store dataset (or the CSV it replaces) with ``poa_direct``, ``poa_diffuse``,
+        ``poa_global``, ``temp_air`` and ``wind_speed``
+    :return: ``(effective_irradiance, temp_cell)`` series
+    """
+    poa = load_dataset(dataset, columns=['poa_direct', 'poa_diffuse', 'poa_global',
+                                         'temp_air', 'wind_speed'])
+    solar_pos = get_solarposition(location, poa.index)
+    aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, solar_pos.apparent_zenith,
+                               solar_pos.azimuth)
+    effective_irradiance = poa['poa_direct'] * pvlib.iam.ashrae(aoi) + poa['poa_diffuse']
+    temp_cell = pvlib.temperature.faiman(poa['poa_global'], poa['temp_air'], poa['wind_speed'])
+    return effective_irradiance.fillna(0.), temp_cell
+
+
+def solve_mpp(method, effective_irradiance, temp_cell, params):
+    """
+    ``calcparams_cec`` and the maximum power point with one solver.
+
+    :param method: ``max_power_point`` method, ``'lambertw'`` for
+        ``singlediode`` or ``'array_dc'`` for :func:`pvlib_array_dc.module_mpp`
+        (which floors the irradiance like the rest of that module)
+    :param params: :func:`pvlib_array_dc.cec_params`
+    :return: dict of ``i_mp``, ``v_mp`` and ``p_mp`` arrays
+    """
+    Ee = np.asarray(effective_irradiance, dtype=float)
+    Tcell = np.asarray(temp_cell, dtype=float)
+    if method == 'array_dc':
+        Imp, Vmp, Pmp = ad.module_mpp(ad.calcparams(Ee, Tcell, params))
+        return {'i_mp': Imp, 'v_mp': Vmp, 'p_mp': Pmp}
+    sdm = pvlib.pvsystem.calcparams_cec(Ee, Tcell, **params)
+    if method == 'lambertw':
+        out = pvlib.pvsystem.singlediode(*sdm, method='lambertw')
+    else:
+        out = pvlib.pvsystem.max_power_point(*sdm, method=method)
+    return {k: np.asarray(out[k], dtype=float) for k in ('i_mp', 'v_mp', 'p_mp')}
+
+
+def _deviation(out, ref):
+    """Max and mean relative deviations where the reference produces power."""
+    ok = np.isfinite(ref['p_mp']) & (ref['p_mp'] > MIN_POWER)
+    dev = {}
+    for k in ('p_mp', 'v_mp', 'i_mp'):
+        rel = np.abs(out[k][ok] / ref[k][ok] - 1.)
+        rel = np.where(np.isfinite(rel), rel, np.inf)  # a NaN where the reference has power
+        dev[k] = {'max': float(rel.max(initial=0.)),
+                  'mean': float(rel.mean()) if rel.size else 0.}
+    return dev
+
+
+def run_method(method, effective_irradiance, temp_cell, params, repeat=3):
+    """
+    Time one solver, then trace its memory in a separate run.
+
+    :return: ``(stats, out)``, ``out`` is None if the solver raised
+    """
+    stats = {'method': method}
+    try:
+        # night steps give NaNs in some solvers, they are counted instead of warned about
+        with np.errstate(divide='ignore', invalid='ignore'):
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                out = solve_mpp(method, effective_irradiance, temp_cell, params)
+                seconds.append(time.perf_counter() - start)
+            tracemalloc.start()
+            try:
+                solve_mpp(method, effective_irradiance, temp_cell, params)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    except Exception as exc:  # record e.g. a solver missing from this scipy
+        stats['error'] = '%s: %s' % (type(exc).__name__, exc)
+        return stats, None
+    p_mp = out['p_mp']
+    day = np.asarray(effective_irradiance) > 0
+    stats.update(
+        seconds=min(seconds), seconds_all=seconds, peak_mib=peak / 2. ** 20,
+        nan=int(np.isnan(p_mp).sum()), nan_day=int(np.isnan(p_mp[day]).sum()),
+        negative=int((p_mp < 0).sum()), energy_kwh=float(np.nansum(p_mp)) / 1000.)
+    return stats, out
+
+
+def run_benchmark(methods=METHODS, module=MODULE, dataset=DATASET, repeat=3,
+                  reference=REFERENCE):
+    """
+    Run every solver over a weather year.
+
+    :return: JSON serializable dict with ``meta``, per method ``results``
+        (including ``deviation`` from ``reference``) and the ``pairwise`` max
+        relative ``p_mp`` deviation between methods
+    """
+    effective_irradiance, temp_cell = kalkbult_inputs(dataset)
+    params = ad.cec_params(open_database('CECMod')[module])
+    results, outs = {}, {}
+    for method in methods:
+        results[method], out = run_method(method, effective_irradiance, temp_cell, params,
+                                          repeat)
+        if out is not None:
+            outs[method] = out
+    if reference in outs:
+        for method, out in outs.items():
+            results[method]['deviation'] = _deviation(out, outs[reference])
+    pairwise = {a: {b: _deviation(outs[a], outs[b])['p_mp']['max'] for b in outs}
+                for a in outs}
+    meta = {
+        'created': pd.Timestamp.now(tz='UTC').isoformat(), 'dataset': dataset,
+        'timesteps': len(effective_irradiance), 'module': module, 'repeat': repeat,
+        'reference': reference, 'min_power': MIN_POWER,
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'numpy': np.__version__, 'scipy': scipy.__version__, 'pvlib': pvlib.__version__,
+    }
+    return {'meta': meta, 'results': results, 'pairwise': pairwise}
+
+
+def compare(result, baseline, time_tol=TIME_TOLERANCE, dev_tol=DEVIATION_TOLERANCE):
+    """
+    Regressions of a benchmark result against a baseline result.
+
+    :return: list of messages, empty if nothing got slower, less accurate,
+        produced more NaNs or stopped working
+    """
+    problems = []
+    for method, base in baseline['results'].items():
+        new = result['results'].get(method)
+        if new is None or 'error' in base:
+            continue
+        if 'error' in new:
+            problems.append('%s: fails with %s' % (method, new['error']))
+            continue
+        if new['seconds'] > base['seconds'] * (1. + time_tol):
+            problems.append('%s: %.3f s, baseline %.3f s'
+                            % (method, new['seconds'], base['seconds']))
+        if new['nan_day'] > base['nan_day']:
+            problems.append('%s: %d NaNs in daylight, baseline %d'
+                            % (method, new['nan_day'], base['nan_day']))
+        for k, dev in new.get('deviation', {}).items():
+            old = base.get('deviation', {}).get(k)
+            if old is not None and dev['max'] > old['max'] + dev_tol:
+                problems.append('%s: max %s deviation %.2e, baseline %.2e'
+                                % (method, k, dev['max'], old['max']))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark single-diode MPP solvers.')
+    parser.add_argument('--methods', nargs='+', default=list(METHODS))
+    parser.add_argument('--module', default=MODULE, help='CECMod entry')
+    parser.add_argument('--dataset', default=DATASET, help='weather_store dataset')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per method')
+    parser.add_argument('--out', help='write the result to this JSON file')
+    parser.add_argument('--baseline', help='JSON result to compare against')
+    parser.add_argument('--time-tol', type=float, default=TIME_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.methods, args.module, args.dataset, args.repeat)
+    for method, stats in result['results'].items():
+        if 'error' in stats:
+            print('%-13s %s' % (method, stats['error']))
+        else:
+            print('%-13s %8.4f s %8.1f MiB %5d NaN  max dP %.1e'
+                  % (method, stats['seconds'], stats['peak_mib'], stats['nan'],
+                     stats.get('deviation', {}).get('p_mp', {}).get('max', np.nan)))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(result, json.load(f), args.time_tol)
+        for problem in problems:
+            print('REGRESSION ' + problem)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# lifetime degradation Monte Carlo of m modules along n strings
+#
+# Every module of a plant degrades at its own rate: the photocurrent (Isc)
+# and the series resistance change linearly, the shunt resistance decays
+# by a fixed fraction per year. The rates of each module are drawn from
+# normal distributions (clipped at 0) on top of a random initial spread of
+# the photocurrent, and the plant is evaluated year by year at reference
+# conditions. A sample is one plant over its lifetime; samples are
+# independent cases for the process pool of pvmismatch_sweep and come back
+# as a few numbers per year, so thousands of them fit in memory.
+#
+# The plant curves come from the vectorized cell model of pvmismatch_batch
+# with the parameters of every module and year at once, (years, modules,
+# parameters), solved in batches of at most MAX_CELLS module-years so the
+# memory of a worker does not grow with the plant or the horizon. The
+# mismatch loss is the difference between the sum of the module Pmp's and the
+# plant Pmp, both taken on the same curves so that a plant of equal modules
+# has no mismatch.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from pvmismatch import pvconstants, pvmodule
+
+import pvmismatch_batch as pb
+from pvmismatch_sweep import run_sweep
+
+YEARS = 25
+# per-module degradation rates [1/year], (mean, standard deviation)
+RATES = {
+    'Isc0_T0': (0.005, 0.0025),  # photocurrent loss, linear
+    'Rs': (0.01, 0.005),  # series resistance increase, linear
+    'Rsh': (0.02, 0.01),  # shunt resistance loss, compound
+}
+ISC_TOLERANCE = 0.01  # relative standard deviation of the initial photocurrent
+MAX_CELLS = 4096  # module-years solved per batch, bounds memory per worker
+NPTS = 51  # points per Isc level of the series current grid, within 1e-4 of the full grid
+CELL_POS = {'STD72': pvmodule.STD72, 'STD96': pvmodule.STD96}
+
+DegradationMC = namedtuple('DegradationMC', [
+    'samples',  # long frame, one row per sample and year
+    'summary',  # frame per year with the mean, P50 and P90 of the plant Pmp and mismatch
+])
+
+
+def module_params(base, rates, years, isc_spread=None):
+    """
+    Cell parameters of every module in every year.
+
+    :param base: parameters of an undegraded cell, in :data:`~pvmismatch_batch.CELL_PARAMS` order
+    :param rates: degradation rate of every module [1/year] by parameter name,
+        each of shape (N,)
+    :param years: years since installation, shape (Y,)
+    :param isc_spread: initial relative photocurrent of every module, shape (N,)
+    :return: shape (Y, N, len(CELL_PARAMS))
+    """
+    years = np.asarray(years, dtype=float)[:, None]
+    nmods = len(next(iter(rates.values())))
+    params = np.tile(np.asarray(base, dtype=float), (years.size, nmods, 1))
+    isc = pb.CELL_PARAMS.index('Isc0_T0')
+    if isc_spread is not None:
+        params[..., isc] *= isc_spread
+    for name, rate in rates.items():
+        i = pb.CELL_PARAMS.index(name)
+        if name == 'Rsh':
+            params[..., i] *= (1. - rate) ** years
+        elif name == 'Rs':
+            params[..., i] *= 1. + rate * years
+        else:
+            params[..., i] *= np.maximum(1. - rate * years, 0.)
+    return params
+
+
+def plant_pmp(params, numberStrs, numberMods, pvmod, suns=1., Tcell=298.15, pvconst=pb.PVCONST,
+              npts=None):
+    """
+    Pmp of a plant of equal strings whose modules each have their own cells.
+
+    :param params: cell parameters of every module, string by string,
+        shape (T, numberStrs * numberMods, len(CELL_PARAMS)); all cells of a
+        module are alike
+    :param pvmod: pvmismatch ``PVmodule`` with the cell layout and bypass diodes
+    :param suns: irradiance [suns]
+    :param Tcell: cell temperature [K]
+    :param npts: points per Isc level of the series current grid, defaults
+        to ``pvconst.npts``; cell curves always use ``pvconst.npts``
+    :return: ``(Pmp, Pmp_modules)``, the plant Pmp and the sum of the Pmp of
+        its modules on their own, each of shape (T,); both are the exact
+        maxima of curves on the same current grid
+    """
+    sizes = [len(idx) for idx in pb._module_substrings(pvmod)]
+    sub_vbypass, mod_vbypass = pb._module_bypass(pvmod)
+    Icell, Vcell = pb.calc_cells(params, suns, Tcell, pvconst)
+    grid_pvconst = pvconst if npts is None else pvconstants.PVconstants(npts)
+    Igrid = pb.current_grid(pb.cell_isc(params, suns, Tcell, pvconst), grid_pvconst)
+    Vcells = pb.interp_rows(Igrid[:, None, :], Icell[..., ::-1], Vcell[..., ::-1])
+    Vmod = np.zeros_like(Vcells)
+    for n, vbypass in zip(sizes, sub_vbypass):
+        Vmod += np.maximum(n * Vcells, vbypass)
+    Vmod = np.maximum(Vmod, mod_vbypass)
+    Vstr = Vmod.reshape(len(params), numberStrs, numberMods, -1).sum(axis=2)
+    weights = np.ones(numberStrs)
+    Isys, Vsys = pb.parallel_curves(Igrid, Vstr, weights, pvconst)
+    Isys, Vsys = pb.refine_mpp(Igrid, Vstr, weights, Isys, Vsys)
+    return pb.curve_pmp(Isys, Vsys), pb.curve_pmp(Igrid[:, None, :], Vmod).sum(axis=1)
+
+
+def run_sample(sample, seed=0, numberStrs=30, numberMods=21, years=YEARS, rates=None,
+               isc_tolerance=ISC_TOLERANCE, cell_pos='STD72', suns=1., Tcell=298.15, npts=NPTS):
+    """
+    Plant Pmp over the lifetime of one random plant.
+
+    :param sample: number of the sample, with ``seed`` it seeds the random
+        generator, so any sample can be reproduced on its own
+    :param years: horizon [years], the plant is evaluated at the start of
+        every year and at the end
+    :param rates: ``{parameter: (mean, std)}`` of the degradation rates,
+        :data:`RATES` if None
+    :param isc_tolerance: relative standard deviation of the initial photocurrent
+    :param cell_pos: module cell layout, a key of :data:`CELL_POS`
+    :param npts: points per Isc level of the series current grid, see :func:`plant_pmp`
+    :return: dict with the plant ``Pmp``, the sum of the module Pmp's
+        ``Pmp_modules`` and the ``mismatch`` loss [%], each of shape (years + 1,),
+        and the ``Pmp_nominal`` of the undegraded plant
+    """
+    rng = np.random.default_rng([seed, sample])
+    rates = RATES if rates is None else rates
+    pvmod = pvmodule.PVmodule(cell_pos=CELL_POS[cell_pos])
+    base = pb.cell_params(pvmod.pvcells[0])
+    nmods = numberStrs * numberMods
+    module_rates = {name: np.maximum(rng.normal(mean, std, nmods), 0.)
+                    for name, (mean, std) in rates.items()}
+    isc_spread = 1. + isc_tolerance * rng.standard_normal(nmods)
+    params = module_params(base, module_rates, np.arange(years + 1), isc_spread)
+    step = max(MAX_CELLS // nmods, 1)
+    Pmp, Pmp_modules = np.concatenate(
+        [plant_pmp(params[i:i + step], numberStrs, numberMods, pvmod, suns, Tcell, npts=npts)
+         for i in range(0, len(params), step)], axis=1)
+    _, Pmp_nominal = plant_pmp(np.reshape(base, (1, 1, -1)), 1, 1, pvmod, suns, Tcell,
+                               npts=npts)
+    return {'Pmp': Pmp, 'Pmp_modules': Pmp_modules,
+            'mismatch': (1. - Pmp / Pmp_modules) * 100.,
+            'Pmp_nominal': float(Pmp_nominal[0]) * nmods}
+
+
+def run_degradation_mc(samples=1000, seed=0, max_workers=None, chunksize=8, **kwargs):
+    """
+    Lifetime Monte Carlo of a plant of degrading modules on a process pool.
+
+    Scripts calling this must guard it with ``if __name__ == '__main__':``,
+    see :func:`~pvmismatch_sweep.run_sweep`.
+
+    For Example::
+
+        mc = run_degradation_mc(samples=2000, numberStrs=30, numberMods=21, years=30)
+        mc.summary[['P50', 'P90']].plot()  # plant Pmp relative to nominal
+
+    :param samples: number of random plants
+    :param seed: seed of the samples
+    :param max_workers: number of processes, all cores if None; 1 runs serially
+    :param chunksize: number of samples sent to a worker at once
+    :param kwargs: passed on to :func:`run_sample`
+    :return: :class:`DegradationMC`; ``summary`` has the ``mean``, ``P50``
+        and ``P90`` (exceeded by 90 % of the samples) of the plant Pmp
+        relative to the undegraded plant and the ``mismatch_P50`` and
+        ``mismatch_P90`` [%] (exceeded by 10 % of the samples) per year
+    """
+    cases = [dict(kwargs, sample=i, seed=seed) for i in range(samples)]
+    sweep = run_sweep(cases, func=run_sample, max_workers=max_workers, chunksize=chunksize)
+    Pmp = np.stack(sweep['Pmp'].to_numpy())
+    nyears = Pmp.shape[1]
+    performance = Pmp / sweep['Pmp_nominal'].to_numpy()[:, None]
+    mismatch = np.stack(sweep['mismatch'].to_numpy())
+    samples_frame = pd.DataFrame({
+        'sample': np.repeat(sweep['sample'].to_numpy(), nyears),
+        'year': np.tile(np.arange(nyears), len(sweep)),
+        'Pmp': Pmp.ravel(),
+        'Pmp_modules': np.stack(sweep['Pmp_modules'].to_numpy()).ravel(),
+        'performance': performance.ravel(),
+        'mismatch': mismatch.ravel(),
+    })
+    summary = pd.DataFrame({
+        'mean': performance.mean(axis=0),
+        'P50': np.quantile(performance, 0.5, axis=0),
+        'P90': np.quantile(performance, 0.1, axis=0),
+        'mismatch_P50': np.quantile(mismatch, 0.5, axis=0),
+        'mismatch_P90': np.quantile(mismatch, 0.9, axis=0),
+    }, index=pd.RangeIndex(nyears, name='year'))
+    return DegradationMC(samples=samples_frame, summary=summary)
+
+
+if __name__ == '__main__':
+    mc = run_degradation_mc(samples=1000, numberStrs=30, numberMods=21, years=30)
+    print(mc.summary)
@@ -14,7 +14,14 @@ from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
 
+from modelchain_stream import clearsky_chunks, run_model_chunked
+from degradation_mc import run_degradation_mc
 from pvgis_iotools import poa_data_2020
+from pvlib_mismatch import run_coupled_from_modelchain
+from pvmismatch_batch import run_mismatch_from_poa
+from pvmismatch_bins import estimate_energy_from_poa
+from sam_database import open_database
+from weather_store import load_dataset, read_dataset
 
 # --- Build System
 
@@ -22,9 +29,9 @@ from pvgis_iotools import poa_data_2020
 location = Location(latitude=-30.09318567206943, longitude=24.13940478600872, tz='Africa/Johannesburg',
                     altitude=1400, name='Kalkbult')
 
-# extract sandia modules and CEC inverters databases
-sandia_modules = pvlib.pvsystem.retrieve_sam('SandiaMod')
-cec_inverters = pvlib.pvsystem.retrieve_sam('CECInverter')
+# open the indexed sandia modules and CEC inverters databases
+sandia_modules = open_database('SandiaMod')
+cec_inverters = open_database('CECInverter')
 
 # select particular module and inverter (create instance)
 module = sandia_modules['Canadian_Solar_CS5P_220M___2009_']
@@ -42,26 +49,25 @@ system = PVSystem(surface_tilt=45, surface_azimuth=0,
 # create the model chain
 modelchain = ModelChain(system, location)
 
-'''
-# create time series for irradiance data for clear sky model
-times = pd.date_range(start='2021-07-01', end='2021-07-07', freq='1min', tz=location.tz)
-
-# create clear sky model
-clear_sky = location.get_clearsky(times)
+# 1-minute clear sky run, streamed through the model chain a week at a time and
+# written to a dataset as it goes (a full year, e.g. end='2022-01-01', is ~525k
+# rows); transient=True smooths the cell temperature over the last 20 minutes
+clear_sky = clearsky_chunks(location, start='2021-07-01', end='2021-07-08', freq='1min')
+minute_summary = run_model_chunked(modelchain, clear_sky, out='kalkbult_clearsky_1min',
+                                   transient=True)
+print(minute_summary)  # energy and minutes at the inverter's AC limit (clipping)
 # plot
-clear_sky.plot(figsize=(16,9))
-'''
+read_dataset('kalkbult_clearsky_1min', columns=['ac']).plot(figsize=(16,9))
+plt.show()
 
 '''
 # TMY data extraction from Europa PVGIS - more accurate than above
 # https://re.jrc.ec.europa.eu/pvg_tools/en/#TMY
-tmy = pd.read_csv('pvlib_kalkbult.csv', index_col=0)
-tmy.index = pd.to_datetime(tmy.index)
+tmy = load_dataset('pvlib_kalkbult')
 '''
 
 # Another option is to do POA iot data extraction
-poa_data_2020 = pd.read_csv('poa_data_2020_io.csv', index_col=0)
-poa_data_2020.index = pd.to_datetime(poa_data_2020.index)
+poa_data_2020 = load_dataset('poa_data_2020_io')
 
 # combine time series data with model chain
 modelchain.run_model_from_poa(poa_data_2020)  # comment out _from_poa if not using poa
@@ -73,6 +79,39 @@ plt.show()
 modelchain.results.ac.resample('ME').sum().plot(figsize=(16,8))
 plt.show()
 
+# mismatch-aware DC output of a 30x21 pvmismatch system for every hour, solved as one batch
+pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21)
+mismatch_dc = run_mismatch_from_poa(pvsys, poa_data_2020, temp_cell=modelchain.results.cell_temperature)
+mismatch_dc.p_mp.plot(figsize=(16,8))
+plt.title('DC Power 30x21 System (pvmismatch)')
+plt.show()
+
+# annual DC energy of the same system from ~150 (irradiance, temperature) bins
+# instead of every hour, with a bound of the deviation from the hourly run
+estimate = estimate_energy_from_poa(pvsys, poa_data_2020,
+                                    temp_cell=modelchain.results.cell_temperature)
+print('bins: %.0f +- %.0f kWh, hourly: %.0f kWh' % (estimate.energy_kwh, estimate.error_kwh,
+                                                   mismatch_dc.p_mp.sum() / 1000.))
+
+# the same system driven by the model chain's effective irradiance and cell
+# temperature; night hours are skipped and hours close to the last solved one
+# reuse its solution
+coupled_dc = run_coupled_from_modelchain(pvsys, modelchain)
+print('solved %d of %d hours' % (coupled_dc.solved.sum(), len(coupled_dc)))
+coupled_dc.p_mp.plot(figsize=(16,8))
+plt.title('DC Power 30x21 System (pvlib -> pvmismatch)')
+plt.show()
+
+# linear degradation of the 30x21 system over 25 years, every module with its
+# own Isc, Rs and Rsh rates; a few samples serially here, thousands on all
+# cores with `python degradation_mc.py` (the process pool needs the
+# if __name__ == '__main__' guard)
+lifetime = run_degradation_mc(samples=20, numberStrs=30, numberMods=21, years=25, max_workers=1)
+lifetime.summary[['P50', 'P90']].plot(figsize=(16,8))
+plt.ylabel('Pmp / undegraded Pmp')
+plt.show()
+print(lifetime.summary[['mismatch_P50', 'mismatch_P90']].iloc[[0, 10, 25]])
+
 
 # ended end of ep.11 - satisfied with learning
 # https://www.youtube.com/watch?v=9wDhl6jyKmk&list=PLK7k_QaEmaHsPk_mwzneTE2VTNCpYBiky&index=5
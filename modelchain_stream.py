@@ -0,0 +1,191 @@
+# streaming ModelChain runs over long, high resolution weather
+#
+# A year at 1-minute resolution is about 525k rows; run in one go, ModelChain
+# keeps every intermediate pvlib frame (solar position, irradiance, AOI,
+# DC, ...) of all of them in memory. run_model_chunked feeds the chain
+# fixed-size time chunks instead, writes the results of each chunk to a
+# weather_store dataset as it goes, and keeps a running summary of energy and
+# inverter clipping.
+#
+# State across chunk boundaries: the last WARMUP of each chunk's input is run
+# again in front of the next chunk and its results dropped, so models that
+# look back in time (the transient cell temperature of Prilliman et al.)
+# see the same history as in a single run.
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from solar_cache import get_clearsky
+from weather_store import DatasetWriter, iter_dataset
+
+CHUNKSIZE = 7 * 24 * 60  # rows per chunk, a week of minutes
+WARMUP = pd.Timedelta('20min')  # history of the transient cell temperature model
+UNIT_MASS = 11.1  # [kg/m^2] module mass for the transient model, pvlib's default
+CLIP_TOL = 1e-6  # relative distance from the AC limit counted as clipped
+
+
+def clearsky_chunks(location, start, end, freq='1min', chunksize=CHUNKSIZE, model='ineichen',
+                    temp_air=20., wind_speed=0., cache=None):
+    """
+    Clear sky weather in chunks.
+
+    :param location: pvlib ``Location``
+    :param start: first timestamp, in the location's timezone if naive
+    :param end: end of the period (exclusive)
+    :param temp_air: constant air temperature [C]
+    :param wind_speed: constant wind speed [m/s]
+    :param cache: :class:`~solar_cache.SolarCache` of the whole period, shared
+        cache by default; False to run ``location.get_clearsky`` one chunk at
+        a time instead
+    :return: generator of frames with ``ghi``, ``dni``, ``dhi``, ``temp_air``
+        and ``wind_speed``
+    """
+    times = pd.date_range(start, end, freq=freq, tz=location.tz, inclusive='left')
+    clear = None if cache is False else get_clearsky(location, times, model, cache)
+    for i in range(0, len(times), chunksize):
+        if clear is None:
+            weather = location.get_clearsky(times[i:i + chunksize], model=model)
+        else:
+            weather = clear.iloc[i:i + chunksize].copy()
+        weather['temp_air'] = temp_air
+        weather['wind_speed'] = wind_speed
+        yield weather
+
+
+def _chunks(weather, chunksize):
+    """Frames of a weather frame, a weather_store dataset path or an iterable of frames."""
+    if isinstance(weather, str):
+        return iter_dataset(weather, chunksize)
+    if isinstance(weather, pd.DataFrame):
+        return (weather.iloc[i:i + chunksize] for i in range(0, len(weather), chunksize))
+    return iter(weather)
+
+
+def _arrays(value):
+    """Per-array results of a ModelChain as a tuple."""
+    return value if isinstance(value, tuple) else (value,)
+
+
+def ac_limit(system):
+    """
+    AC power limit of a system's inverter [W], None if the inverter model is
+    not known.
+    """
+    params = system.inverter_parameters
+    if 'Paco' in params:  # sandia
+        return float(params['Paco'])
+    if 'pdc0' in params:  # pvwatts
+        return float(params.get('eta_inv_nom', 0.96) * params['pdc0'])
+    return None
+
+
+def _transient(modelchain, data, unit_mass):
+    """Run the DC and AC models again with the Prilliman transient cell temperature."""
+    results = modelchain.results
+    wind_speed = data['wind_speed'] if 'wind_speed' in data else pd.Series(0., index=data.index)
+    frames = tuple(
+        pd.DataFrame({'effective_irradiance': ee,
+                      'cell_temperature': pvlib.temperature.prilliman(tc, wind_speed, unit_mass)})
+        for ee, tc in zip(_arrays(results.effective_irradiance),
+                          _arrays(results.cell_temperature)))
+    modelchain.run_model_from_effective_irradiance(frames if len(frames) > 1 else frames[0])
+
+
+def results_frame(results):
+    """
+    Flat frame of the results kept per time step: ``ac``, ``p_dc``,
+    ``v_dc`` (for single diode and SAPM DC models), ``cell_temperature`` and
+    ``effective_irradiance``, per-array columns get an ``_<array>`` suffix.
+    """
+    out = {'ac': results.ac}
+    dcs = _arrays(results.dc)
+    for i, (dc, tc, ee) in enumerate(zip(dcs, _arrays(results.cell_temperature),
+                                         _arrays(results.effective_irradiance))):
+        sfx = '' if len(dcs) == 1 else '_%d' % i
+        if isinstance(dc, pd.DataFrame):
+            out['p_dc' + sfx], out['v_dc' + sfx] = dc['p_mp'], dc['v_mp']
+        else:
+            out['p_dc' + sfx] = dc
+        out['cell_temperature' + sfx] = tc
+        out['effective_irradiance' + sfx] = ee
+    return pd.DataFrame(out).astype('float64')
+
+
+def _step_hours(index, default):
+    if len(index) < 2:
+        return default
+    return pd.Series(index).diff().median() / pd.Timedelta('1h')
+
+
+def run_model_chunked(modelchain, weather, out=None, chunksize=CHUNKSIZE, method='run_model',
+                      transient=False, unit_mass=UNIT_MASS, warmup=WARMUP, meta=None):
+    """
+    Run a ModelChain chunk by chunk and write the results incrementally.
+
+    For Example::
+
+        weather = clearsky_chunks(location, '2021-01-01', '2022-01-01', freq='1min')
+        summary = run_model_chunked(modelchain, weather, out='kalkbult_1min')
+        ac = read_dataset('kalkbult_1min', columns=['ac'])['ac']
+
+    :param modelchain: pvlib ``ModelChain``, its results are those of the last chunk
+    :param weather: weather frame, weather_store dataset path or iterable of
+        frames in time order (e.g. :func:`clearsky_chunks` or
+        ``pvgis_reader.iter_pvgis``)
+    :param out: weather_store dataset for :func:`results_frame` of every time
+        step, nothing is written if None
+    :param chunksize: rows per chunk of a frame or dataset (an iterable is
+        used with its own chunks)
+    :param method: ``'run_model'``, ``'run_model_from_poa'`` or
+        ``'run_model_from_effective_irradiance'``
+    :param transient: replace the steady state cell temperature of the
+        chain's temperature model with ``pvlib.temperature.prilliman``
+    :param unit_mass: module mass per area for the transient model [kg/m^2]
+    :param warmup: input of the previous chunk run again in front of a chunk
+    :param meta: JSON serializable metadata stored with ``out``, next to the summary
+    :return: summary dict with the number of ``steps``, ``hours``,
+        ``energy_dc_kwh``, ``energy_ac_kwh``, the ``ac_limit`` [W] and the
+        ``clipped_steps`` and ``clipped_hours`` at it
+    """
+    run = getattr(modelchain, method)
+    limit = ac_limit(modelchain.system)
+    summary = {'steps': 0, 'hours': 0., 'energy_dc_kwh': 0., 'energy_ac_kwh': 0.,
+               'ac_limit': limit, 'clipped_steps': 0, 'clipped_hours': 0.,
+               'start': None, 'end': None}
+    writer = None if out is None else DatasetWriter(out, meta)
+    tail = None
+    step = np.nan
+    try:
+        for chunk in _chunks(weather, chunksize):
+            if not len(chunk):
+                continue
+            data = chunk if tail is None else pd.concat([tail, chunk])
+            run(data)
+            if transient:
+                _transient(modelchain, data, unit_mass)
+            results = results_frame(modelchain.results).iloc[len(data) - len(chunk):]
+            if writer is not None:
+                writer.append(results)
+            step = _step_hours(data.index, step)
+            p_dc = results.filter(regex='^p_dc').sum(axis=1)
+            summary['steps'] += len(results)
+            summary['hours'] += len(results) * step
+            summary['energy_dc_kwh'] += float(np.nansum(p_dc)) * step / 1000.
+            summary['energy_ac_kwh'] += float(np.nansum(results['ac'])) * step / 1000.
+            if limit is not None:
+                clipped = int((results['ac'] >= limit * (1. - CLIP_TOL)).sum())
+                summary['clipped_steps'] += clipped
+                summary['clipped_hours'] += clipped * step
+            if summary['start'] is None:
+                summary['start'] = results.index[0].isoformat()
+            summary['end'] = results.index[-1].isoformat()
+            tail = data[data.index > data.index[-1] - warmup]
+        if writer is not None:
+            writer.meta = dict(summary, meta=meta)
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    return summary
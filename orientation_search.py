@@ -0,0 +1,154 @@
+# tilt/azimuth orientation search
+#
+# The sun and the sky do not depend on the orientation of the modules: solar
+# position (from solar_cache), extraterrestrial irradiance, airmass and (if the
+# weather only has GHI) the DNI/DHI decomposition are computed once and kept
+# for the daylight timesteps only. Transposition, angle of incidence and
+# incidence angle modifier losses are then evaluated for a whole grid of
+# (tilt, azimuth) at once, pvlib broadcasting the orientations, shape (N, 1),
+# against the timesteps, shape (T,). Orientations are evaluated in chunks so
+# the (N, T) intermediates stay small for fine grids.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from solar_cache import get_solarposition
+
+TILTS = np.arange(0., 91., 1.)  # [deg]
+AZIMUTHS = np.arange(0., 360., 5.)  # [deg] pvlib convention, 0 north, 180 south
+ALBEDO = 0.25
+CHUNKSIZE = 256  # orientations per chunk
+
+SkyConditions = namedtuple('SkyConditions', [
+    'zenith',          # apparent solar zenith [deg]
+    'azimuth',         # solar azimuth [deg]
+    'ghi', 'dni', 'dhi',  # [W/m^2]
+    'dni_extra',       # extraterrestrial irradiance [W/m^2]
+    'airmass',         # relative airmass
+    'temp_air',        # [C], None if not in the weather
+    'wind_speed',      # [m/s]
+    'step_hours',      # duration of a timestep [h]
+])
+
+OrientationSearch = namedtuple('OrientationSearch', [
+    'poa',          # plane of array insolation [kWh/m^2], frame of tilt x azimuth
+    'effective',    # insolation after AOI/IAM losses [kWh/m^2]
+    'dc',           # specific DC yield [kWh/kWp] with cell temperature, None without gamma_pdc
+    'optimum',      # series with the surface_tilt, surface_azimuth and yields of the best orientation
+])
+
+
+def sky_conditions(location, weather):
+    """
+    Everything of a weather series that is shared by all orientations.
+
+    :param location: pvlib ``Location``
+    :param weather: frame with ``ghi`` and optionally ``dni``, ``dhi``,
+        ``temp_air`` and ``wind_speed``, e.g. the TMY of pvgis_processing.py;
+        DNI and DHI are decomposed from GHI with Erbs if missing
+    :return: :class:`SkyConditions` of the daylight timesteps
+    """
+    times = weather.index
+    solpos = get_solarposition(location, times)
+    zenith = solpos['apparent_zenith'].to_numpy()
+    day = zenith < 90.
+    ghi = weather['ghi'].to_numpy(dtype=float)
+    if 'dni' in weather and 'dhi' in weather:
+        dni = weather['dni'].to_numpy(dtype=float)
+        dhi = weather['dhi'].to_numpy(dtype=float)
+    else:
+        erbs = pvlib.irradiance.erbs(ghi, solpos['zenith'].to_numpy(), times.dayofyear)
+        dni, dhi = erbs['dni'], erbs['dhi']
+    dni_extra = pvlib.irradiance.get_extra_radiation(times).to_numpy()
+    step = pd.Series(times).diff().median() / pd.Timedelta('1h') if len(times) > 1 else 1.
+    optional = {name: weather[name].to_numpy(dtype=float)[day] if name in weather else None
+                for name in ('temp_air', 'wind_speed')}
+    return SkyConditions(
+        zenith=zenith[day], azimuth=solpos['azimuth'].to_numpy()[day],
+        ghi=ghi[day], dni=np.asarray(dni)[day], dhi=np.asarray(dhi)[day],
+        dni_extra=dni_extra[day],
+        airmass=pvlib.atmosphere.get_relative_airmass(zenith[day]),
+        step_hours=step, **optional)
+
+
+def orientation_yield(sky, surface_tilt, surface_azimuth, model='perez', albedo=ALBEDO,
+                      iam_model='ashrae', gamma_pdc=None, chunksize=CHUNKSIZE):
+    """
+    Annual yields of a list of orientations.
+
+    :param sky: :class:`SkyConditions`
+    :param surface_tilt: tilts [deg], shape (N,)
+    :param surface_azimuth: azimuths [deg], shape (N,)
+    :param model: sky diffuse model of ``pvlib.irradiance.get_sky_diffuse``
+    :param iam_model: ``pvlib.iam`` model of the direct beam, the diffuse
+        modifiers are its ``marion_diffuse`` integrals
+    :param gamma_pdc: temperature coefficient of power [1/K] for the DC
+        yield, with the Faiman cell temperature; needs ``temp_air``
+    :return: dict of ``poa``, ``effective`` [kWh/m^2] and, with ``gamma_pdc``,
+        ``dc`` [kWh/kWp], arrays of shape (N,)
+    """
+    surface_tilt = np.asarray(surface_tilt, dtype=float)
+    surface_azimuth = np.asarray(surface_azimuth, dtype=float)
+    iam_direct = getattr(pvlib.iam, iam_model)
+    tilts, tilt_index = np.unique(surface_tilt, return_inverse=True)
+    iam_diffuse = pvlib.iam.marion_diffuse(iam_model, tilts)
+    dc = gamma_pdc is not None
+    if dc and sky.temp_air is None:
+        raise ValueError('the DC yield needs temp_air in the weather')
+    wind_speed = 1. if sky.wind_speed is None else sky.wind_speed
+    out = {name: np.empty(surface_tilt.shape) for name in ('poa', 'effective', 'dc')[:2 + dc]}
+    for i in range(0, surface_tilt.size, chunksize):
+        part = slice(i, i + chunksize)
+        tilt = surface_tilt[part, None]
+        azimuth = surface_azimuth[part, None]
+        aoi = pvlib.irradiance.aoi(tilt, azimuth, sky.zenith, sky.azimuth)
+        sky_diffuse = pvlib.irradiance.get_sky_diffuse(
+            tilt, azimuth, sky.zenith, sky.azimuth, sky.dni, sky.ghi, sky.dhi,
+            dni_extra=sky.dni_extra, airmass=sky.airmass, model=model)
+        ground_diffuse = pvlib.irradiance.get_ground_diffuse(tilt, sky.ghi, albedo)
+        irrad = pvlib.irradiance.poa_components(aoi, sky.dni, sky_diffuse, ground_diffuse)
+        k = tilt_index[part]
+        effective = (irrad['poa_direct'] * iam_direct(aoi)
+                     + irrad['poa_sky_diffuse'] * iam_diffuse['sky'][k, None]
+                     + irrad['poa_ground_diffuse'] * iam_diffuse['ground'][k, None])
+        out['poa'][part] = irrad['poa_global'].sum(axis=1)
+        out['effective'][part] = effective.sum(axis=1)
+        if dc:
+            temp_cell = pvlib.temperature.faiman(irrad['poa_global'], sky.temp_air, wind_speed)
+            out['dc'][part] = (effective * (1. + gamma_pdc * (temp_cell - 25.))).sum(axis=1)
+    return {name: values * sky.step_hours / 1000. for name, values in out.items()}
+
+
+def search_orientation(location, weather, tilts=TILTS, azimuths=AZIMUTHS, model='perez',
+                       albedo=ALBEDO, iam_model='ashrae', gamma_pdc=None, chunksize=CHUNKSIZE):
+    """
+    Yield surfaces of a (tilt, azimuth) grid and its best orientation.
+
+    For Example, with the TMY of pvgis_processing.py::
+
+        search = search_orientation(location, read_dataset('pvlib_kalkbult'), gamma_pdc=-0.0047)
+        search.dc.plot()  # one line per azimuth
+        surface_tilt, surface_azimuth = search.optimum[['surface_tilt', 'surface_azimuth']]
+
+    :param tilts: tilts of the grid [deg]
+    :param azimuths: azimuths of the grid [deg]
+    :return: :class:`OrientationSearch`, the optimum is the best DC yield
+        with ``gamma_pdc``, otherwise the best effective insolation
+    """
+    sky = sky_conditions(location, weather)
+    tilt, azimuth = np.meshgrid(np.asarray(tilts, dtype=float),
+                                np.asarray(azimuths, dtype=float), indexing='ij')
+    yields = orientation_yield(sky, tilt.ravel(), azimuth.ravel(), model, albedo, iam_model,
+                               gamma_pdc, chunksize)
+    surfaces = {name: pd.DataFrame(values.reshape(tilt.shape),
+                                   index=pd.Index(tilts, name='surface_tilt'),
+                                   columns=pd.Index(azimuths, name='surface_azimuth'))
+                for name, values in yields.items()}
+    best = np.argmax(yields['dc' if 'dc' in yields else 'effective'])
+    optimum = pd.Series(dict({'surface_tilt': tilt.flat[best], 'surface_azimuth': azimuth.flat[best]},
+                             **{name: values[best] for name, values in yields.items()}))
+    return OrientationSearch(poa=surfaces['poa'], effective=surfaces['effective'],
+                             dc=surfaces.get('dc'), optimum=optimum)
@@ -0,0 +1,198 @@
+# concurrent bulk retrieval of PVGIS hourly data
+#
+# Fetches a table of (site, orientation, year range) requests with asyncio:
+# a semaphore bounds the number of requests in flight, a rate limiter spaces
+# their start times, and failed or throttled requests are retried with
+# exponential backoff. HTTP calls go through one pooled requests.Session on a
+# thread pool, and every response is parsed with pvlib and written to the
+# PVGIS cache as soon as it arrives, so an interrupted run resumes where it
+# stopped.
+
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pvlib
+import requests
+
+from pvgis_cache import PVGIS_CACHE, request_key, request_params
+
+RETRY_STATUS = (429, 500, 502, 503, 504)  # throttled or transient server errors
+REQUEST_ARGS = frozenset(request_params(0, 0))  # table columns that are request parameters
+
+
+def query_params(params):
+    """
+    PVGIS ``seriescalc`` query of complete request parameters.
+
+    Same mapping as ``pvlib.iotools.get_pvgis_hourly``.
+
+    :param params: :func:`pvgis_cache.request_params`
+    """
+    query = {'lat': params['latitude'], 'lon': params['longitude'],
+             'outputformat': params['outputformat'], 'angle': params['surface_tilt'],
+             'aspect': params['surface_azimuth'] - 180,
+             'pvcalculation': int(params['pvcalculation']),
+             'pvtechchoice': params['pvtechchoice'], 'mountingplace': params['mountingplace'],
+             'trackingtype': params['trackingtype'], 'components': int(params['components']),
+             'usehorizon': int(params['usehorizon']),
+             'optimalangles': int(params['optimalangles']),
+             'optimalinclination': int(params['optimal_surface_tilt']), 'loss': params['loss']}
+    if params['userhorizon'] is not None:
+        query['userhorizon'] = ','.join(str(x) for x in params['userhorizon'])
+    for name, key in (('raddatabase', 'raddatabase'), ('start', 'startyear'),
+                      ('end', 'endyear'), ('peakpower', 'peakpower')):
+        if params[name] is not None:
+            query[key] = params[name]
+    return query
+
+
+class RateLimiter(object):
+    """
+    Space the start of requests at least ``1 / rate`` seconds apart.
+
+    :param rate: max requests per second, unlimited if None
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 0. if not rate else 1. / rate
+        self._next = 0.
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Retry(Exception):
+    """Transient failure, retry after ``delay`` seconds if given."""
+
+    def __init__(self, message, delay=None):
+        super(_Retry, self).__init__(message)
+        self.delay = delay
+
+
+def _get(session, url, query, timeout):
+    """Blocking GET of one request, raising :class:`_Retry` on transient failures."""
+    try:
+        res = session.get(url + 'seriescalc', params=query, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout) as exc:
+        raise _Retry(str(exc))
+    if res.status_code in RETRY_STATUS:
+        retry_after = res.headers.get('Retry-After')
+        raise _Retry('HTTP %d' % res.status_code,
+                     float(retry_after) if retry_after and retry_after.isdigit() else None)
+    if not res.ok:
+        # PVGIS explains bad requests in a JSON message, like get_pvgis_hourly
+        try:
+            message = res.json()['message']
+        except (ValueError, KeyError):
+            res.raise_for_status()
+        raise requests.HTTPError(message)
+    return res.text
+
+
+def _store(cache, key, params, text):
+    data, meta = pvlib.iotools.read_pvgis_hourly(
+        io.StringIO(text), pvgis_format=params['outputformat'],
+        map_variables=params['map_variables'])
+    cache.save(key, data, meta, params)
+    return data, meta
+
+
+async def fetch_bulk(table, cache=None, concurrency=8, rate=None, retries=4, backoff=1.,
+                     timeout=60, refresh=False, on_result=None):
+    """
+    Fetch every request of a table into the PVGIS cache concurrently.
+
+    :param table: frame with one request per row; columns named like
+        ``get_pvgis_hourly`` arguments (``latitude``, ``longitude``, ``start``,
+        ``end``, ``surface_tilt``, ``surface_azimuth``, ``raddatabase``, ...)
+        are request parameters, other columns (e.g. ``site``) are labels
+        copied to the result
+    :param cache: :class:`pvgis_cache.PVGISCache`, shared cache by default
+    :param concurrency: max number of requests in flight and pooled connections
+    :param rate: max requests started per second, unlimited if None
+    :param retries: retries of a request after transient failures
+    :param backoff: first retry delay [s], doubled on every retry
+    :param timeout: timeout of each HTTP request [s]
+    :param refresh: download requests that are already cached
+    :param on_result: optional ``on_result(row, data, meta)`` called as each
+        request is fetched, e.g. to process results while others are in flight
+    :return: frame with the table's columns plus ``key``, ``status``
+        (``'cached'``, ``'fetched'`` or ``'error'``), ``attempts``, ``seconds``
+        and ``error``
+    """
+    cache = PVGIS_CACHE if cache is None else cache
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def fetch(row):
+        row = dict(row)
+        kwargs = {k: v for k, v in row.items() if k in REQUEST_ARGS}
+        params = request_params(**kwargs)
+        key = request_key(params)
+        result = dict(row, key=key, status='cached', attempts=0, seconds=0., error=None)
+        if key in cache and not refresh:
+            return result
+        started = time.monotonic()
+        async with semaphore:
+            for attempt in range(retries + 1):
+                result['attempts'] = attempt + 1
+                await limiter.wait()
+                try:
+                    text = await loop.run_in_executor(
+                        executor, _get, session, params['url'], query_params(params), timeout)
+                    data, meta = await loop.run_in_executor(
+                        executor, _store, cache, key, params, text)
+                except _Retry as exc:
+                    result['error'] = str(exc)
+                    if attempt < retries:
+                        await asyncio.sleep(exc.delay or backoff * 2 ** attempt)
+                        continue
+                except Exception as exc:
+                    result['error'] = '%s: %s' % (type(exc).__name__, exc)
+                else:
+                    result.update(status='fetched', error=None)
+                    if on_result is not None:
+                        on_result(row, data, meta)
+                    break
+                result['status'] = 'error'
+                break
+        result['seconds'] = time.monotonic() - started
+        return result
+
+    try:
+        results = await asyncio.gather(*(fetch(row) for row in table.to_dict('records')))
+    finally:
+        executor.shutdown(wait=True)
+        session.close()
+    return pd.DataFrame(results, index=table.index)
+
+
+def bulk_get_pvgis_hourly(table, **kwargs):
+    """
+    Blocking :func:`fetch_bulk`, e.g. from a script.
+
+    For Example::
+
+        sites = pd.DataFrame({'site': ['kalkbult', 'kalkbult'],
+                              'latitude': -30.09, 'longitude': 24.14,
+                              'surface_tilt': [30, 45], 'surface_azimuth': 180,
+                              'start': 2015, 'end': 2020, 'raddatabase': 'PVGIS-SARAH3'})
+        status = bulk_get_pvgis_hourly(sites, concurrency=4, rate=2)
+        poa, meta = PVGIS_CACHE.load(status.key[0])
+    """
+    return asyncio.run(fetch_bulk(table, **kwargs))
@@ -0,0 +1,166 @@
+# on-disk cache of PVGIS downloads
+#
+# Responses of pvlib.iotools.get_pvgis_hourly are stored under a key made from
+# all request parameters (location, years, radiation database, orientation,
+# horizon, components, endpoint, ...). Each entry is a weather_store dataset
+# whose metadata holds the request parameters, the PVGIS metadata and a hash
+# of the data, so a study is only downloaded once and can be re-run offline.
+#
+# Set PVGIS_OFFLINE=1 to fail on cache misses instead of downloading, and
+# PVGIS_CACHE_DIR to move the cache.
+
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from weather_store import WeatherStore, _index_values
+
+CACHE_DIR = os.environ.get(
+    'PVGIS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pvgis_cache'))
+OFFLINE = os.environ.get('PVGIS_OFFLINE', '') not in ('', '0')
+URL = 'https://re.jrc.ec.europa.eu/api/v5_3/'
+
+# parameters that do not change the response
+IGNORED_PARAMS = ('timeout',)
+
+
+class PVGISCacheMiss(LookupError):
+    """Request not in the cache while offline."""
+
+
+def request_params(latitude, longitude, **kwargs):
+    """
+    Complete ``get_pvgis_hourly`` parameters, defaults filled in.
+
+    :return: dict of every parameter that changes the response
+    """
+    kwargs.setdefault('url', URL)
+    bound = inspect.signature(pvlib.iotools.get_pvgis_hourly).bind(latitude, longitude, **kwargs)
+    bound.apply_defaults()
+    params = {k: v.item() if isinstance(v, np.generic) else v  # e.g. values from a frame row
+              for k, v in bound.arguments.items() if k not in IGNORED_PARAMS}
+    for k in ('start', 'end'):
+        value = params[k]
+        if isinstance(value, float) and value.is_integer():
+            params[k] = int(value)  # a year from a numeric frame column, e.g. 2020.0
+        elif value is not None and not isinstance(value, int):
+            params[k] = pd.to_datetime(value).year  # PVGIS only uses the year
+    if params['userhorizon'] is not None:
+        params['userhorizon'] = [float(h) for h in params['userhorizon']]
+    return params
+
+
+def request_key(params):
+    """Hash of canonical request parameters."""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _data_hash(data):
+    h = hashlib.sha256()
+    h.update(_index_values(data.index).tobytes())
+    for name in data.columns:
+        h.update(str(name).encode())
+        h.update(np.ascontiguousarray(data[name].to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+class PVGISCache(object):
+    """
+    Directory of cached PVGIS hourly responses.
+
+    :param cache_dir: directory of the cache entries
+    :param offline: raise :class:`PVGISCacheMiss` instead of downloading
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, offline=OFFLINE):
+        self.cache_dir = cache_dir
+        self.store = WeatherStore(cache_dir)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return self.store.path(key)
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def save(self, key, data, meta, params):
+        """
+        Store a response, a concurrent reader never sees a partial entry.
+
+        :param key: :func:`request_key` of ``params``
+        :param data: frame with a UTC ``DatetimeIndex``
+        :param meta: PVGIS metadata
+        :param params: :func:`request_params` of the request
+        """
+        self.store.write(key, data, {'key': key, 'params': params, 'meta': meta,
+                                     'sha256': _data_hash(data), 'fetched': time.time()})
+
+    def load(self, key, columns=None):
+        """
+        Read a cached response.
+
+        :param columns: names of the columns to read, all if None
+        :return: ``(data, meta)`` like ``get_pvgis_hourly``
+        """
+        return self.store.read(key, columns), self.store.meta(key)['meta']
+
+    def entries(self):
+        """Request parameters of every cached response, one row per entry."""
+        rows = []
+        for key in self.store.names():
+            info = self.store.info(key)
+            entry = info['meta']
+            rows.append(dict(entry['params'], key=key, nrows=info['nrows'],
+                             fetched=pd.Timestamp(entry['fetched'], unit='s')))
+        return pd.DataFrame(rows)
+
+    def get_pvgis_hourly(self, latitude, longitude, refresh=False, **kwargs):
+        """
+        ``pvlib.iotools.get_pvgis_hourly`` with the response cached on disk.
+
+        :param refresh: download again even if the request is cached
+        :param kwargs: ``get_pvgis_hourly`` arguments
+        :return: ``(data, meta)``
+        :raises PVGISCacheMiss: if the request is not cached and the cache is offline
+        """
+        params = request_params(latitude, longitude, **kwargs)
+        key = request_key(params)
+        if key in self and not refresh:
+            self.hits += 1
+            return self.load(key)
+        if self.offline:
+            raise PVGISCacheMiss('PVGIS request not cached and offline: %r' % params)
+        self.misses += 1
+        data, meta = pvlib.iotools.get_pvgis_hourly(
+            timeout=kwargs.get('timeout', 30), **params)
+        self.save(key, data, meta, params)
+        return data, meta
+
+
+PVGIS_CACHE = PVGISCache()  # shared default cache
+
+
+def get_pvgis_hourly(latitude, longitude, cache=None, refresh=False, **kwargs):
+    """
+    Cached ``pvlib.iotools.get_pvgis_hourly``.
+
+    For Example::
+
+        poa, meta = get_pvgis_hourly(-30.09, 24.14, start=2020, end=2020,
+                                     raddatabase='PVGIS-SARAH3', surface_tilt=45)
+
+    :param cache: :class:`PVGISCache`, shared module-level cache by default
+    :param refresh: download again even if the request is cached
+    :return: ``(data, meta)``
+    """
+    cache = PVGIS_CACHE if cache is None else cache
+    return cache.get_pvgis_hourly(latitude, longitude, refresh=refresh, **kwargs)
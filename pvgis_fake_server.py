@@ -0,0 +1,163 @@
+# local stand-in for the PVGIS API
+#
+# Serves synthetic but well formed "seriescalc" JSON responses, so the PVGIS
+# fetch layer can be exercised without network access. Irradiance follows the
+# sun position of the requested site, temperature and wind are smooth daily
+# and yearly cycles, all deterministic in the request parameters.
+#
+#     python pvgis_fake_server.py 8080
+#     get_pvgis_hourly(..., url='http://127.0.0.1:8080/')
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+
+def seriescalc(query):
+    """
+    PVGIS ``seriescalc`` JSON response for a query dict.
+
+    :raises ValueError: for parameters the stand-in does not support
+    """
+    lat, lon = float(query['lat']), float(query['lon'])
+    if query.get('outputformat', 'json') != 'json':
+        raise ValueError('only outputformat=json is supported')
+    start = int(query.get('startyear', 2020))
+    end = int(query.get('endyear', start))
+    if end < start:
+        raise ValueError('endyear must not be before startyear')
+    tilt, azimuth = float(query.get('angle', 0)), float(query.get('aspect', 0))
+    times = pd.date_range('%d-01-01 00:10' % start, '%d-12-31 23:10' % end, freq='h', tz='UTC')
+    solpos = pvlib.solarposition.ephemeris(times, lat, lon)
+    elevation = solpos['elevation'].to_numpy()
+    # PVGIS aspect is 0 = south, pvlib azimuth is 180 = south
+    aoi = pvlib.irradiance.aoi(tilt, azimuth + 180., solpos['zenith'], solpos['azimuth']).to_numpy()
+    sin_elev = np.clip(np.sin(np.radians(elevation)), 0., None)
+    dni = 900. * sin_elev ** 0.3 * (sin_elev > 0)
+    dhi = 100. * sin_elev
+    doy = times.dayofyear.to_numpy()
+    hour = (times.hour + lon / 15.).to_numpy()
+    hourly = pd.DataFrame({
+        'time': times.strftime('%Y%m%d:%H%M'),
+        'Gb(i)': np.round(dni * np.clip(np.cos(np.radians(aoi)), 0., None), 2),
+        'Gd(i)': np.round(dhi * (1. + np.cos(np.radians(tilt))) / 2., 2),
+        'Gr(i)': np.round(0.2 * (dni * sin_elev + dhi) * (1. - np.cos(np.radians(tilt))) / 2., 2),
+        'H_sun': np.round(np.clip(elevation, 0., None), 2),
+        'T2m': np.round(18. - 8. * np.cos(2. * np.pi * (doy - 15) / 365.)
+                        - 6. * np.cos(2. * np.pi * (hour - 3.) / 24.), 2),
+        'WS10m': np.round(3. + 1.5 * np.sin(2. * np.pi * hour / 24.), 2),
+        'Int': 0,
+    })
+    if query.get('components', '1') in ('0', 'False', 'false'):
+        hourly['G(i)'] = hourly.pop('Gb(i)') + hourly.pop('Gd(i)') + hourly.pop('Gr(i)')
+    return {
+        'inputs': {
+            'location': {'latitude': lat, 'longitude': lon, 'elevation': 0.0},
+            'meteo_data': {'radiation_db': query.get('raddatabase', 'PVGIS-SARAH3'),
+                           'meteo_db': 'ERA5', 'year_min': start, 'year_max': end,
+                           'use_horizon': query.get('usehorizon', '1') == '1',
+                           'horizon_db': None},
+            'mounting_system': {'fixed': {'slope': {'value': tilt, 'optimal': False},
+                                          'azimuth': {'value': azimuth, 'optimal': False},
+                                          'type': 'free-standing'}},
+        },
+        'outputs': {'hourly': hourly.to_dict('records')},
+        'meta': {'inputs': {'location': {'description': 'Selected location'}},
+                 'outputs': {'hourly': {'type': 'time series', 'timestamp': 'hourly averages'}}},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        with server.lock:
+            server.requests.append((url.path, url.query))
+        if server.delay:
+            time.sleep(server.delay)
+        if not url.path.endswith('/seriescalc'):
+            self._reply(404, {'message': 'unknown endpoint %s' % url.path, 'status': 404})
+            return
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            body = seriescalc(query)
+        except (KeyError, ValueError) as exc:
+            self._reply(400, {'message': str(exc), 'status': 400})
+        else:
+            self._reply(200, body)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # keep test output quiet
+
+
+class FakePVGISServer(object):
+    """
+    PVGIS stand-in running in a background thread.
+
+    For Example::
+
+        with FakePVGISServer() as server:
+            data, meta = get_pvgis_hourly(-30.09, 24.14, start=2020, end=2020, url=server.url)
+            assert len(server.requests) == 1
+
+    :param host: interface to listen on
+    :param port: port to listen on, any free port if 0
+    :param delay: seconds to wait before answering each request, to mimic latency
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.requests = []
+        self.httpd.lock = threading.Lock()
+        self.httpd.delay = delay
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base url to pass to the PVGIS functions."""
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    @property
+    def requests(self):
+        """(path, query string) of every request served."""
+        return self.httpd.requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    server = FakePVGISServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('serving fake PVGIS on %s' % server.url)
+    server.httpd.serve_forever()
@@ -1,7 +1,10 @@
 import pandas as pd
-import pvlib
 
-poa_data_2020, meta = pvlib.iotools.get_pvgis_hourly(
+from pvgis_cache import get_pvgis_hourly
+from weather_store import write_dataset
+
+# Cached on disk by request parameters, only the first run downloads (PVGIS_OFFLINE=1 never does)
+poa_data_2020, meta = get_pvgis_hourly(
     latitude=-30.09318567206943, longitude=24.13940478600872,
     start=2020, end=2020,
     raddatabase='PVGIS-SARAH3', components=True,
@@ -23,4 +26,6 @@ poa_data_2020 = poa_data_2020[keep_cols]
 
 print(poa_data_2020)
 
-poa_data_2020.to_csv('poa_data_2020_io.csv')
\ No newline at end of file
+# Memory-mapped dataset, read back with weather_store.load_dataset('poa_data_2020_io'),
+# which also converts a poa_data_2020_io.csv written by earlier versions
+write_dataset('poa_data_2020_io', poa_data_2020)
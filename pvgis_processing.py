@@ -1,17 +1,29 @@
 import pandas as pd
 from matplotlib import pyplot as plt
+from pvlib.location import Location
 
-tmy = pd.read_csv('pvgis_kalkbult.csv', skiprows=17, nrows=8760,
-                  usecols=['time(UTC)', 'T2m', 'G(h)', 'Gb(n)', 'Gd(h)', 'WS10m'],
-                  index_col=0)
+from orientation_search import search_orientation
+from pvgis_reader import read_pvgis
+from weather_store import write_dataset
 
-# tmy.index = pd.to_datetime(tmy.index, format='%Y%m%d: %H%M')
-tmy.index = pd.date_range(start='2021-01-01 00:00', end='2021-12-31 23:00', freq='h')
-
-tmy.columns = ['temp_air', 'ghi', 'dni', 'dhi', 'wind_speed']
+# Layout (TMY/hourly CSV, JSON or EPW), timestamps and pvlib column names come from the file itself
+tmy, tmy_meta = read_pvgis('pvgis_kalkbult.csv', coerce_year=2021,
+                           columns=['temp_air', 'ghi', 'dni', 'dhi', 'wind_speed'])
 print(tmy)
 
 tmy.plot(figsize=(16,8))
 plt.show()
 
-tmy.to_csv('pvlib_kalkbult.csv')
\ No newline at end of file
+write_dataset('pvlib_kalkbult', tmy)
+
+# annual yield of every (tilt, azimuth) on a 1 x 5 degree grid, solar position
+# and sky computed once for the TMY; surface_tilt=45, surface_azimuth=0 in
+# initial_system.py and pvlib_spec_sheet_module.py can be compared with the optimum
+location = Location(latitude=-30.09318567206943, longitude=24.13940478600872, tz='Africa/Johannesburg',
+                    altitude=1400, name='Kalkbult')
+search = search_orientation(location, tmy, gamma_pdc=-0.0047)
+print(search.optimum)
+print(search.dc.loc[45, 0])  # kWh/kWp of the current orientation
+search.dc[[0, 45, 90, 315]].plot(figsize=(16,8))  # yield over tilt for a few azimuths
+plt.ylabel('DC yield [kWh/kWp]')
+plt.show()
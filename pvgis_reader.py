@@ -0,0 +1,236 @@
+# streaming reader for PVGIS exports
+#
+# Detects the layout of a PVGIS download (hourly series or TMY as CSV or JSON,
+# or an EPW file), reads its metadata header and yields the data in
+# fixed-size chunks with a UTC index, pvlib column names and float64/int64
+# dtypes. CSV and EPW files are read line by line, so multi-decade exports are
+# processed in bounded memory; JSON has to be decoded as a whole and is only
+# chunked afterwards.
+
+import io
+import itertools
+import json
+import re
+
+import pandas as pd
+import pvlib
+
+CHUNKSIZE = 8760  # rows per chunk, one (non-leap) year of hours
+TIME_FORMAT = '%Y%m%d:%H%M'
+DATA_LINE = re.compile(r'\d{8}:\d{4},')  # PVGIS CSV data lines start with a timestamp
+
+# PVGIS names to pvlib names, TMY files also have infrared irradiance
+VARIABLE_MAP = dict(pvlib.iotools.pvgis.VARIABLE_MAP, **{'IR(h)': 'ghi_infrared'})
+INT_COLUMNS = ('Int',)  # PVGIS flag of reconstructed (interpolated) values
+
+# EPW data columns, same names as pvlib.iotools.read_epw
+EPW_COLUMNS = [
+    'year', 'month', 'day', 'hour', 'minute', 'data_source_unct',
+    'temp_air', 'temp_dew', 'relative_humidity', 'atmospheric_pressure', 'etr', 'etrn',
+    'ghi_infrared', 'ghi', 'dni', 'dhi', 'global_hor_illum', 'direct_normal_illum',
+    'diffuse_horizontal_illum', 'zenith_luminance', 'wind_direction', 'wind_speed',
+    'total_sky_cover', 'opaque_sky_cover', 'visibility', 'ceiling_height',
+    'present_weather_observation', 'present_weather_codes', 'precipitable_water',
+    'aerosol_optical_depth', 'snow_depth', 'days_since_last_snowfall', 'albedo',
+    'liquid_precipitation_depth', 'liquid_precipitation_quantity']
+EPW_HEADER_LINES = 8
+EPW_LOCATION = ['loc', 'city', 'state-prov', 'country', 'data_type', 'WMO_code',
+                'latitude', 'longitude', 'TZ', 'altitude']
+
+
+def detect_format(path):
+    """
+    Layout of a PVGIS export.
+
+    :return: ``'hourly_csv'``, ``'tmy_csv'``, ``'json'`` or ``'epw'``
+    :raises ValueError: for files that are none of these
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                return 'json'
+            if line.startswith('LOCATION,'):
+                return 'epw'
+            if line.startswith('time,'):
+                return 'hourly_csv'
+            if line.startswith('time(UTC),'):
+                return 'tmy_csv'
+            if DATA_LINE.match(line):
+                break  # data before any column header
+    raise ValueError('%s is not a PVGIS CSV, JSON or EPW export' % path)
+
+
+def _value(text):
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _csv_header(f):
+    """Metadata lines up to and including the column header of a PVGIS CSV."""
+    meta = {'inputs': {}}
+    for line in f:
+        line = line.strip()
+        if line.startswith('time'):
+            return meta, line.split(',')
+        if line == 'month,year':
+            meta['months_selected'] = [
+                {'month': int(m), 'year': int(y)}
+                for m, y in (next(f).strip().split(',') for _ in range(12))]
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            meta['inputs'][key.strip()] = _value(value)
+    raise ValueError('no data section found, the file has probably been edited')
+
+
+def _csv_data_lines(f):
+    """Data lines of a PVGIS CSV, ending at the blank line before the legend."""
+    for line in f:
+        if not DATA_LINE.match(line):
+            return
+        yield line
+
+
+def _csv_footer(f):
+    descriptions = {}
+    for line in f:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            descriptions[key.strip()] = value.strip()
+    return descriptions
+
+
+def _frame(data, time_col, map_variables, coerce_year, columns):
+    """Typed frame with a UTC index from a chunk of raw PVGIS records."""
+    times = data.pop(time_col).astype(str)
+    if coerce_year is not None:
+        times = str(coerce_year) + times.str[4:]
+    data.index = pd.DatetimeIndex(pd.to_datetime(times, format=TIME_FORMAT, utc=True),
+                                  name='time')
+    data = data.astype({name: 'int64' if name in INT_COLUMNS else 'float64' for name in data})
+    if map_variables:
+        data = data.rename(columns=VARIABLE_MAP)
+    return data if columns is None else data[columns]
+
+
+def _chunks(lines, chunksize):
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_csv(f, chunksize, map_variables, coerce_year, columns):
+    _, names = _csv_header(f)
+    for chunk in _chunks(_csv_data_lines(f), chunksize):
+        data = pd.read_csv(io.StringIO(''.join(chunk)), header=None, names=names,
+                           dtype={names[0]: str})
+        yield _frame(data, names[0], map_variables, coerce_year, columns)
+
+
+def _json_records(src):
+    outputs = src['outputs']
+    return outputs['hourly'] if 'hourly' in outputs else outputs['tmy_hourly']
+
+
+def _iter_json(f, chunksize, map_variables, coerce_year, columns):
+    records = _json_records(json.load(f))
+    for start in range(0, len(records), chunksize):
+        data = pd.DataFrame(records[start:start + chunksize])
+        time_col = 'time' if 'time' in data else 'time(UTC)'
+        yield _frame(data, time_col, map_variables, coerce_year, columns)
+
+
+def _epw_location(f):
+    meta = dict(zip(EPW_LOCATION, f.readline().rstrip('\n').split(',')))
+    for key in ('latitude', 'longitude', 'TZ', 'altitude'):
+        meta[key] = float(meta[key])
+    return meta
+
+
+def _iter_epw(f, chunksize, map_variables, coerce_year, columns):
+    tz_offset = pd.Timedelta(hours=_epw_location(f)['TZ'])
+    for _ in range(EPW_HEADER_LINES - 1):
+        f.readline()
+    for chunk in _chunks(f, chunksize):
+        data = pd.read_csv(io.StringIO(''.join(chunk)), header=None, names=EPW_COLUMNS)
+        if coerce_year is not None:
+            data['year'] = coerce_year
+        # EPW hours are 1-24 in local standard time, pvlib starts them at 0
+        local = pd.to_datetime(pd.DataFrame({
+            'year': data['year'], 'month': data['month'], 'day': data['day'],
+            'hour': data['hour'] - 1}))
+        data.index = pd.DatetimeIndex(local - tz_offset, name='time').tz_localize('UTC')
+        data = data.drop(columns=EPW_COLUMNS[:6]).astype('float64')
+        yield data if columns is None else data[columns]
+
+
+_READERS = {'hourly_csv': _iter_csv, 'tmy_csv': _iter_csv, 'json': _iter_json,
+            'epw': _iter_epw}
+
+
+def iter_pvgis(path, chunksize=CHUNKSIZE, map_variables=True, coerce_year=None,
+               columns=None):
+    """
+    Read a PVGIS export in chunks.
+
+    For Example::
+
+        for chunk in iter_pvgis('pvgis_kalkbult.csv', columns=['ghi', 'temp_air']):
+            daily = chunk.resample('D').mean()
+
+    :param path: PVGIS hourly or TMY export as CSV or JSON, or an EPW file
+    :param chunksize: number of rows per chunk
+    :param map_variables: rename PVGIS columns to pvlib names (EPW columns
+        always have pvlib names)
+    :param coerce_year: put every timestamp in this year, e.g. for a TMY
+    :param columns: columns to keep (after renaming), all if None
+    :return: generator of frames indexed by UTC time
+    """
+    reader = _READERS[detect_format(path)]
+    with open(path, encoding='utf-8-sig') as f:
+        for chunk in reader(f, chunksize, map_variables, coerce_year, columns):
+            yield chunk
+
+
+def read_pvgis_meta(path):
+    """
+    Metadata of a PVGIS export, without reading its data.
+
+    :return: dict with ``'format'``, the header ``'inputs'`` (and
+        ``'months_selected'`` of a TMY) or the EPW location
+    """
+    fmt = detect_format(path)
+    with open(path, encoding='utf-8-sig') as f:
+        if fmt == 'epw':
+            return {'format': fmt, 'inputs': _epw_location(f)}
+        if fmt == 'json':
+            src = json.load(f)
+            meta = {'format': fmt, 'inputs': src['inputs'], 'descriptions': src.get('meta')}
+            if 'months_selected' in src['outputs']:
+                meta['months_selected'] = src['outputs']['months_selected']
+            return meta
+        meta, _ = _csv_header(f)
+        for _ in _csv_data_lines(f):
+            pass
+        meta['descriptions'] = _csv_footer(f)
+        meta['format'] = fmt
+        return meta
+
+
+def read_pvgis(path, **kwargs):
+    """
+    Read a whole PVGIS export.
+
+    :param kwargs: passed on to :func:`iter_pvgis`
+    :return: ``(data, meta)``
+    """
+    data = pd.concat(list(iter_pvgis(path, **kwargs)))
+    return data, read_pvgis_meta(path)
@@ -0,0 +1,326 @@
+# per-module single-diode DC model of a string array
+#
+# Solves pvlib's CEC single-diode model for every (timestep, string, module)
+# at once, so every module can have its own irradiance, temperature and
+# degraded parameters, instead of solving one module and scaling it with
+# PVSystem.scale_voltage_current_power.
+#
+# Modules in a string carry the same current: string voltages are sums of
+# module voltages on a common current grid, with a bypass diode clamping each
+# module at -VBYPASS. Strings in parallel share the voltage and are combined
+# with the current summation of pvmismatch_batch. All solvers are explicit
+# Newton iterations in the diode voltage, like pvlib's Bishop (1988) form.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pvlib
+from pvmismatch import pvconstants
+
+import pvmismatch_batch as pb
+
+CEC_PARAMS = ('alpha_sc', 'a_ref', 'I_L_ref', 'I_o_ref', 'R_sh_ref', 'R_s', 'Adjust')
+
+VBYPASS = 0.5  # forward voltage of the bypass diode across each module [V]
+MIN_IRRADIANCE = 1e-3  # floor on effective irradiance [W/m^2], like pb.MIN_SUNS
+NPTS = 41  # points of the string current and array voltage grids
+NREFINE = pb.NREFINE  # points of each refined current window around a string MPP
+REFINE_STEPS = 2  # number of refinements of a string MPP
+CHUNK_ELEMENTS = 2 ** 18  # max (timesteps x modules x npts) solved per batch, cache sized
+NEWTON_TOL = 1e-9  # convergence of the Newton iterations [V]
+NEWTON_MAXITER = 50
+
+DiodeParams = namedtuple('DiodeParams', ['IL', 'I0', 'Rs', 'Rsh', 'nNsVth'])
+
+ArrayDC = namedtuple('ArrayDC', [
+    'mod_Imp', 'mod_Vmp', 'mod_Pmp',  # (T, S, M) MPP of each module on its own
+    'str_Imp', 'str_Vmp', 'str_Pmp',  # (T, S) MPP of each string
+    'Imp', 'Vmp', 'Pmp',              # (T,) MPP of the strings in parallel
+])
+
+
+def cec_params(module, **overrides):
+    """
+    CEC parameters of a SAM module entry, with per-module arrays.
+
+    For Example, 20 modules with 0.5 %/year lower photocurrent::
+
+        params = cec_params(mod, I_L_ref=mod['I_L_ref'] * (1 - 0.005 * age))
+
+    :param module: ``retrieve_sam('CECMod')`` column or ``dict``
+    :param overrides: parameters to replace, scalars or arrays broadcast to
+        (strings, modules) or (timesteps, strings, modules)
+    :return: dict of :data:`CEC_PARAMS`
+    """
+    params = {p: float(module.get(p, 0.)) for p in CEC_PARAMS}  # like calcparams_cec's Adjust
+    params.update(overrides)
+    return params
+
+
+def calcparams(Ee, Tcell, params):
+    """
+    ``calcparams_cec`` of every module, irradiance floored at :data:`MIN_IRRADIANCE`.
+
+    :param Ee: effective irradiance [W/m^2]
+    :param Tcell: cell temperature [C]
+    :param params: :func:`cec_params`
+    :return: :class:`DiodeParams` of the broadcast shape
+    """
+    Ee = np.maximum(np.asarray(Ee, dtype=float), MIN_IRRADIANCE)
+    IL, I0, Rs, Rsh, nNsVth = pvlib.pvsystem.calcparams_cec(Ee, Tcell, **params)
+    return DiodeParams(*np.broadcast_arrays(IL, I0, Rs, Rsh, nNsVth))
+
+
+def _diode_current(Vd, IL, I0, Rsh, nNsVth):
+    """Terminal current at diode voltage ``Vd`` and its derivative."""
+    e = I0 * np.exp(Vd / nNsVth)
+    return IL - e + I0 - Vd / Rsh, -e / nNsVth - 1. / Rsh
+
+
+def diode_voltage(I, p):
+    """
+    Diode voltage ``V + I * Rs`` at terminal current ``I``.
+
+    The diode current is concave and decreasing in the diode voltage, so
+    Newton's method converges monotonically from the smaller of the roots
+    without the shunt and without the diode, which are both right of the
+    root. Converged elements are dropped from the iterations.
+
+    :param I: terminal current [A], broadcast against ``p``
+    :param p: :class:`DiodeParams`
+    """
+    shape = np.broadcast_shapes(np.shape(I), p.IL.shape)
+    I, IL, I0, Rsh, nNsVth = (np.broadcast_to(x, shape).ravel()
+                              for x in (I, p.IL, p.I0, p.Rsh, p.nNsVth))
+    dI = IL - I
+    Vd = np.minimum(dI * Rsh, nNsVth * np.log1p(np.maximum(dI, 0.) / I0))
+    # f(Vd) = a - I0 exp(Vd / nNsVth) - Vd / Rsh = 0
+    a, g, c = dI + I0, 1. / Rsh, 1. / nNsVth
+    active = None
+    x = Vd
+    for _ in range(NEWTON_MAXITER):
+        e = I0 * np.exp(x * c)
+        step = (a - e - x * g) / (-e * c - g)
+        x = x - step
+        todo = np.abs(step) >= NEWTON_TOL
+        if active is None:
+            Vd = x
+        else:
+            Vd[active] = x
+        if not todo.any():
+            break
+        if todo.mean() < 0.5:  # drop converged elements once it pays off
+            active = np.flatnonzero(todo) if active is None else active[todo]
+            x, a, I0, g, c = (y[todo] for y in (x, a, I0, g, c))
+    return Vd.reshape(shape)
+
+
+def v_from_i(I, p, Vbypass=VBYPASS):
+    """
+    Module voltage at current ``I``, clamped by its bypass diode.
+
+    :param I: current [A], broadcast against ``p``
+    :param p: :class:`DiodeParams`
+    :param Vbypass: bypass diode forward voltage [V]
+    """
+    return np.maximum(diode_voltage(I, p) - I * p.Rs, -Vbypass)
+
+
+def module_mpp(p):
+    """
+    Maximum power point of every module.
+
+    Newton's method on dP/dVd, the power as a function of the diode voltage
+    ``Vd`` with ``I = IL - I0 (exp(Vd / nNsVth) - 1) - Vd / Rsh`` and
+    ``V = Vd - I Rs``, kept between short and open circuit.
+
+    :param p: :class:`DiodeParams`
+    :return: ``(Imp, Vmp, Pmp)``
+    """
+    Vdoc = diode_voltage(0., p)
+    Vdsc = p.IL * p.Rs / (1. + p.Rs / p.Rsh)  # I * Rs at short circuit, ignoring the diode
+    Vd = 0.9 * Vdoc
+    for _ in range(NEWTON_MAXITER):
+        I, dI = _diode_current(Vd, p.IL, p.I0, p.Rsh, p.nNsVth)
+        V = Vd - I * p.Rs
+        dV = 1. - p.Rs * dI
+        d2I = (dI + 1. / p.Rsh) / p.nNsVth
+        dP = I * dV + V * dI
+        d2P = 2. * dI * dV + d2I * (V - I * p.Rs)
+        step = dP / d2P
+        Vd = np.clip(Vd - step, Vdsc, Vdoc)
+        if np.all(np.abs(step) < NEWTON_TOL):
+            break
+    I, _ = _diode_current(Vd, p.IL, p.I0, p.Rsh, p.nNsVth)
+    V = Vd - I * p.Rs
+    return I, V, I * V
+
+
+def _string_voltage(I, p, Vbypass):
+    """Voltages of strings at currents ``I`` (..., G), modules along the last axis of ``p``."""
+    p = DiodeParams(*(x[..., None] for x in p))
+    return v_from_i(I[..., None, :], p, Vbypass[..., None]).sum(axis=-2)
+
+
+def string_mpp(Igrid, Vstr, p, Vbypass=VBYPASS, nrefine=NREFINE, steps=REFINE_STEPS):
+    """
+    Maximum power point of every string from its curve on a current grid.
+
+    The grid MPP is refined ``steps`` times on ``nrefine`` currents between
+    its neighbours, which also finds MPPs at the kinks of bypassed modules.
+
+    :param Igrid: currents, shape (T, G)
+    :param Vstr: string voltages on ``Igrid``, shape (T, S, G)
+    :param p: :class:`DiodeParams` of the modules, shape (T, S, M)
+    :param Vbypass: bypass diode forward voltage, broadcast to (T, S, M)
+    :return: ``(Imp, Vmp, Pmp, I, V)``, the MPP of shape (T, S) and the
+        string curves with the refined points merged in, increasing ``I`` of
+        shape (T, S, G + steps * nrefine)
+    """
+    Vbypass = np.broadcast_to(Vbypass, p.IL.shape)
+    I = np.broadcast_to(Igrid[:, None, :], Vstr.shape)
+    V = Vstr
+    curve_I, curve_V = [I], [V]
+    for _ in range(steps):
+        n = I.shape[-1]
+        mpp = np.clip(np.argmax(I * V, axis=-1), 1, n - 2)[..., None]
+        Ilo = np.take_along_axis(I, mpp - 1, axis=-1)
+        Ihi = np.take_along_axis(I, mpp + 1, axis=-1)
+        I = Ilo + (Ihi - Ilo) * np.linspace(0., 1., nrefine)
+        V = _string_voltage(I, p, Vbypass)
+        curve_I.append(I)
+        curve_V.append(V)
+    mpp = np.argmax(I * V, axis=-1)[..., None]
+    Imp = np.take_along_axis(I, mpp, axis=-1)[..., 0]
+    Vmp = np.take_along_axis(V, mpp, axis=-1)[..., 0]
+    I, V = np.concatenate(curve_I, axis=-1), np.concatenate(curve_V, axis=-1)
+    order = np.argsort(I, axis=-1, kind='stable')
+    I, V = np.take_along_axis(I, order, axis=-1), np.take_along_axis(V, order, axis=-1)
+    return Imp, Vmp, Imp * Vmp, I, V
+
+
+def parallel_mpp(I, V, npts=NPTS, nrefine=NREFINE):
+    """
+    Maximum power point of strings in parallel, on a common voltage.
+
+    Like ``pvmismatch_batch.parallel_curves`` and ``refine_mpp``, but every
+    string has its own current samples.
+
+    :param I: string currents, increasing, shape (T, S, G)
+    :param V: string voltages at ``I``, shape (T, S, G)
+    :return: ``(Imp, Vmp, Pmp)``, each of shape (T,)
+    """
+    Ir, Vr = I[..., ::-1], V[..., ::-1]  # voltage increasing
+
+    def current(Vsys):
+        return pb.interp_rows(Vsys[:, None, :], Vr, Ir).sum(axis=1)
+
+    fwd, _ = pb.unit_points(pvconstants.PVconstants(npts))
+    Vsys = V[..., 0].max(axis=-1)[:, None] * fwd
+    Isys = current(Vsys)
+    mpp = np.clip(np.argmax(Isys * Vsys, axis=-1), 1, npts - 2)[:, None]
+    Vlo = np.take_along_axis(Vsys, mpp - 1, axis=-1)
+    Vhi = np.take_along_axis(Vsys, mpp + 1, axis=-1)
+    Vfine = Vlo + (Vhi - Vlo) * np.linspace(0., 1., nrefine)
+    return pb.mpp_rows(current(Vfine), Vfine)
+
+
+def solve_strings(p, Vbypass=VBYPASS, npts=NPTS):
+    """
+    Solve modules, strings and the parallel strings for a batch of timesteps.
+
+    :param p: :class:`DiodeParams`, shape (T, S, M) for S strings of M modules
+    :param Vbypass: bypass diode forward voltage, broadcast to (T, S, M)
+    :param npts: points of the string current and array voltage grids
+    :return: :class:`ArrayDC`
+    """
+    Vbypass = np.broadcast_to(Vbypass, p.IL.shape)
+    mod_Imp, mod_Vmp, mod_Pmp = module_mpp(p)
+    # common current grid of all strings, from 0 to above the highest Isc
+    Isc = p.IL.max(axis=(1, 2))
+    Igrid = Isc[:, None] * np.linspace(0., 1., npts)
+    Vstr = _string_voltage(np.broadcast_to(Igrid[:, None, :], p.IL.shape[:2] + (npts,)),
+                           p, Vbypass)
+    str_Imp, str_Vmp, str_Pmp, I, V = string_mpp(Igrid, Vstr, p, Vbypass)
+    if I.shape[1] == 1:  # nothing in parallel
+        Imp, Vmp, Pmp = str_Imp[:, 0], str_Vmp[:, 0], str_Pmp[:, 0]
+    else:
+        Imp, Vmp, Pmp = parallel_mpp(I, V, npts)
+    return ArrayDC(mod_Imp, mod_Vmp, mod_Pmp, str_Imp, str_Vmp, str_Pmp, Imp, Vmp, Pmp)
+
+
+def run_array_dc(Ee, Tcell, params, Vbypass=VBYPASS, npts=NPTS):
+    """
+    DC output of every module, string and the whole array for a time series.
+
+    For Example, 10 strings of 20 modules with hotter modules in the middle::
+
+        Ee = effective_irradiance.to_numpy()[:, None, None]
+        Tcell = temp_cell.to_numpy()[:, None, None] + np.linspace(0, 3, 20)
+        dc = run_array_dc(Ee, Tcell, cec_params(mod), npts=41)
+
+    Timesteps without any irradiance are not solved and return 0. Time is
+    solved in chunks of at most :data:`CHUNK_ELEMENTS` grid points.
+
+    :param Ee: effective irradiance [W/m^2], broadcast to (T, S, M)
+    :param Tcell: cell temperature [C], broadcast to (T, S, M)
+    :param params: :func:`cec_params`, values broadcast to (T, S, M)
+    :param Vbypass: bypass diode forward voltage, broadcast to (T, S, M)
+    :param npts: points of the string current and array voltage grids
+    :return: :class:`ArrayDC`
+    """
+    Ee = np.nan_to_num(np.asarray(Ee, dtype=float))
+    Tcell = np.asarray(Tcell, dtype=float)
+    values = [np.asarray(v, dtype=float) for v in params.values()]
+    shape = np.broadcast_shapes(Ee.shape, Tcell.shape, np.shape(Vbypass),
+                                *(v.shape for v in values))
+    if len(shape) != 3:
+        raise ValueError('inputs must broadcast to (timesteps, strings, modules), got %r'
+                         % (shape,))
+    T, S, M = shape
+    Ee, Tcell, Vbypass = (np.broadcast_to(x, shape) for x in (Ee, Tcell, Vbypass))
+    values = [np.broadcast_to(v, shape) for v in values]
+    out = ArrayDC(*(np.zeros(s) for s in [shape] * 3 + [(T, S)] * 3 + [(T,)] * 3))
+    day = np.flatnonzero(Ee.max(axis=(1, 2)) > MIN_IRRADIANCE)
+    chunksize = max(1, CHUNK_ELEMENTS // (S * M * npts))
+    for start in range(0, day.size, chunksize):
+        rows = day[start:start + chunksize]
+        p = calcparams(Ee[rows], Tcell[rows], dict(zip(params, (v[rows] for v in values))))
+        sol = solve_strings(p, Vbypass[rows], npts)
+        for dst, src in zip(out, sol):
+            dst[rows] = src
+    return out
+
+
+def run_array_dc_from_poa(poa, module, numberStrs=1, numberMods=1, temp_cell=None,
+                          effective_irradiance=None, **overrides):
+    """
+    Hourly DC output of a string array from a POA irradiance frame.
+
+    :param poa: frame with ``poa_global`` [W/m^2] (and ``temp_air``,
+        ``wind_speed`` if ``temp_cell`` is not given), e.g. ``poa_data_2020``
+    :param module: ``retrieve_sam('CECMod')`` column
+    :param numberStrs: number of strings in parallel
+    :param numberMods: number of modules per string
+    :param temp_cell: cell temperature [C], a series or broadcast to (T, S, M);
+        defaults to the Faiman model
+    :param effective_irradiance: [W/m^2], series or broadcast to (T, S, M);
+        defaults to ``poa_global``
+    :param overrides: per-module :func:`cec_params` overrides, e.g. degraded ``R_sh_ref``
+    :return: frame with ``i_mp``, ``v_mp`` and ``p_mp`` of the array on the
+        index of ``poa``, like ``modelchain.results.dc``, and the :class:`ArrayDC`
+    """
+    if temp_cell is None:
+        temp_cell = pvlib.temperature.faiman(poa['poa_global'], poa['temp_air'], poa['wind_speed'])
+    if effective_irradiance is None:
+        effective_irradiance = poa['poa_global']
+
+    def grid(x):
+        x = np.asarray(x, dtype=float)
+        return x[:, None, None] if x.ndim == 1 else x
+
+    shape = (len(poa), numberStrs, numberMods)
+    dc = run_array_dc(np.broadcast_to(grid(effective_irradiance), shape), grid(temp_cell),
+                      cec_params(module, **overrides))
+    return pd.DataFrame({'i_mp': dc.Imp, 'v_mp': dc.Vmp, 'p_mp': dc.Pmp}, index=poa.index), dc
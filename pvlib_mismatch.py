@@ -0,0 +1,114 @@
+# pvlib -> pvmismatch coupling
+#
+# Turns what the pvlib side computes for every timestep, the effective
+# irradiance and cell temperature of a ModelChain or of the spec-sheet
+# pipeline, into pvmismatch system states: irradiance in suns (W/m^2 / 1000)
+# and temperature in K, on top of any shading pattern set up with
+# pvsys.setSuns. Night and sub-threshold steps are not solved. A step whose
+# irradiance and temperature are within a tolerance of the last solved step
+# reuses that solution, with currents and power scaled by the irradiance
+# ratio, instead of being solved again. The remaining steps are solved as
+# one batch with pvmismatch_batch.
+
+import numpy as np
+import pandas as pd
+from pvmismatch import pvsystem
+
+from pvmismatch_batch import PVCONST, SystemLayout, layout_from_pvsystem, run_mismatch
+
+E0 = 1000.  # [W/m^2] irradiance of 1 sun
+MIN_IRRADIANCE = 1.  # [W/m^2] steps below this are night and produce 0 W
+SUNS_TOL = 0.005  # relative irradiance change that still reuses the last solution
+TEMP_TOL = 0.5  # [K] temperature change that still reuses the last solution
+
+
+def to_pvmismatch(effective_irradiance, temp_cell):
+    """
+    pvlib irradiance [W/m^2] and cell temperature [C] in pvmismatch units.
+
+    :return: ``(suns, temps)`` arrays, irradiance [suns] and temperature [K]
+    """
+    suns = np.asarray(effective_irradiance, dtype=float) / E0
+    temps = np.asarray(temp_cell, dtype=float) + 273.15
+    return suns, np.broadcast_to(temps, suns.shape)
+
+
+def reuse_map(suns, temps, min_suns=MIN_IRRADIANCE / E0, suns_tol=SUNS_TOL, temp_tol=TEMP_TOL):
+    """
+    Which solution every timestep uses.
+
+    A timestep is solved unless its irradiance is within ``suns_tol``
+    (relative) and its temperature within ``temp_tol`` of the last solved
+    timestep. Comparing against the last solved timestep, not the previous
+    one, keeps slow drifts from piling up.
+
+    :param suns: irradiance [suns], shape (T,)
+    :param temps: temperature [K], shape (T,)
+    :param min_suns: timesteps below this irradiance (and NaN) are night
+    :return: index of the solved timestep whose solution each timestep uses,
+        -1 for night, shape (T,)
+    """
+    suns = np.asarray(suns, dtype=float)
+    temps = np.asarray(temps, dtype=float)
+    source = np.full(suns.shape, -1, dtype=np.int64)
+    last = -1
+    for t in np.flatnonzero(np.nan_to_num(suns) >= min_suns):
+        if (last < 0 or abs(suns[t] - suns[last]) > suns_tol * suns[last]
+                or not abs(temps[t] - temps[last]) <= temp_tol):
+            last = t
+        source[t] = last
+    return source
+
+
+def run_coupled(pvsys, effective_irradiance, temp_cell, min_irradiance=MIN_IRRADIANCE,
+                suns_tol=SUNS_TOL, temp_tol=TEMP_TOL, chunksize=744, pvconst=PVCONST, npts=None):
+    """
+    Mismatch-aware DC output of a pvmismatch system for pvlib conditions.
+
+    For Example, after ``modelchain.run_model(weather)``::
+
+        dc = run_coupled(pvsys, modelchain.results.effective_irradiance,
+                         modelchain.results.cell_temperature)
+
+    :param pvsys: a pvmismatch ``PVsystem`` or a :class:`~pvmismatch_batch.SystemLayout`;
+        ``None`` for the default 30x21 system
+    :param effective_irradiance: irradiance reaching the cells [W/m^2], series
+    :param temp_cell: cell temperature [C], series or scalar
+    :param min_irradiance: steps below this are not solved and produce 0 W
+    :param suns_tol: relative irradiance change that reuses the last solution,
+        0 solves every daylight step
+    :param temp_tol: temperature change [K] that reuses the last solution
+    :param chunksize: number of solved timesteps per batch, bounds memory use
+    :param npts: solve with adaptive grids, see :func:`~pvmismatch_batch.solve_layout`
+    :return: frame with ``i_mp``, ``v_mp`` and ``p_mp`` like
+        ``modelchain.results.dc``, and ``solved``, True for the timesteps
+        that were solved, on the index of ``effective_irradiance``
+    """
+    if pvsys is None:
+        pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21)
+    layout = pvsys if isinstance(pvsys, SystemLayout) else layout_from_pvsystem(pvsys)
+    suns, temps = to_pvmismatch(effective_irradiance, temp_cell)
+    source = reuse_map(suns, temps, min_irradiance / E0, suns_tol, temp_tol)
+    solved = np.unique(source[source >= 0])
+    Imp, Vmp, Pmp = np.zeros((3,) + suns.shape)
+    Imp[solved], Vmp[solved], Pmp[solved] = run_mismatch(
+        layout, suns[solved], temps[solved], min_suns=0., chunksize=chunksize, pvconst=pvconst,
+        npts=npts)
+    day = np.flatnonzero(source >= 0)
+    ratio = suns[day] / suns[source[day]]
+    Imp[day], Vmp[day], Pmp[day] = (Imp[source[day]] * ratio, Vmp[source[day]],
+                                    Pmp[source[day]] * ratio)
+    index = getattr(effective_irradiance, 'index', None)
+    return pd.DataFrame({'i_mp': Imp, 'v_mp': Vmp, 'p_mp': Pmp,
+                         'solved': np.isin(np.arange(suns.size), solved)}, index=index)
+
+
+def run_coupled_from_modelchain(pvsys, modelchain, **kwargs):
+    """
+    :func:`run_coupled` on the effective irradiance and cell temperature of
+    a ModelChain run (single array).
+
+    :param kwargs: passed on to :func:`run_coupled`
+    """
+    results = modelchain.results
+    return run_coupled(pvsys, results.effective_irradiance, results.cell_temperature, **kwargs)
@@ -5,11 +5,16 @@
 # Import
 import pvlib
 from pvlib.location import Location
-from pvlib.pvsystem import PVSystem
 import pandas as pd
 from scipy.signal import freqs
 import matplotlib.pyplot as plt
 
+from pvlib_array_dc import run_array_dc_from_poa
+from sam_database import open_database
+from sdm_fit import fit_specs
+from solar_cache import get_solarposition
+from weather_store import load_dataset
+
 # Define module
 celltype = 'polySi'
 p_max = 290
@@ -33,15 +38,15 @@ surface_azimuth=0
 start = '2020-01-01 12:00'
 end = '2020-01-07 12:00'
 
-poa_data_2020 = pd.read_csv('poa_data_2020_io.csv', index_col=0)
+poa_data_2020 = load_dataset('poa_data_2020_io')
 poa_data_2020.index = pd.date_range(start='2020-01-01',
                                     periods=len(poa_data_2020.index),
                                     freq='h')
 poa_data = poa_data_2020[start:end]
 # print(poa_data_2020.head())
 
-# solar position throughout time [start:end]
-solar_pos = location.get_solarposition(times=pd.date_range(start=start, end=end, freq='h'))
+# solar position throughout time [start:end], cached on disk across runs
+solar_pos = get_solarposition(location, pd.date_range(start=start, end=end, freq='h'))
 
 # angle of incidence
 aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, solar_pos.apparent_zenith, solar_pos.azimuth)
@@ -56,18 +61,41 @@ effective_irradiance = poa_data['poa_direct'] * iam + poa_data['poa_diffuse']
 temp_cell = pvlib.temperature.faiman(poa_data['poa_global'], poa_data['temp_air'], poa_data['wind_speed'])
 
 
+# --- Single diode model fitted to the spec sheet
+
+# fit_cec_sam fails on this sheet with 6parsolve "sanity check failed (-33):
+# abs((P - Pmp) / Pmp) > 0.015"; sdm_fit fits the same CEC parameters without
+# the SAM library, falls back to other fits if one fails and caches the result
+# by spec sheet, so a whole portfolio can be passed as one frame
+specs = pd.DataFrame({
+    'v_mp': [v_mp], 'i_mp': [i_mp], 'v_oc': [v_oc], 'i_sc': [i_sc],
+    'alpha_sc': [temp_coeff_isc], 'beta_voc': [temp_coeff_voc],
+    'gamma_pmp': [temp_coeff_pmax * 100],  # [%/K]
+    'cells_in_series': [cells_in_series], 'temp_ref': [temp_ref]}, index=['JKM290P-72'])
+mod = fit_specs(specs).iloc[0]
+# print(mod)   # 'method' is the fit that succeeded
+
 # --- CEC module database
 
-# load the CEC module database (bundled with pvlib)
-cec = pvlib.pvsystem.retrieve_sam('CECMod')
+# open the indexed CEC module database (built from pvlib's copy on first use)
+cec = open_database('CECMod')
 
-# find the exact key for your module (print a few candidates to confirm)
-candidates = [k for k in cec.columns
-              if 'JINKO' in k.upper() and '290' in k and 'P' in k and '72' in k]
-# print(candidates)   # e.g. ['Jinko_Solar_JKM290P_72']
+# find your module from the spec sheet, best match first
+candidates = cec.search(name='JKM290P-72', manufacturer='Jinko', power=p_max,
+                        cells=cells_in_series, technology=celltype)
+# print(candidates)   # e.g. Jinko_Solar_Co___Ltd_JKM290P_72
 
-# pick the match from the printed list
-mod = cec[candidates[0]]
+# the best match, to compare with the fitted parameters
+db_mod = cec[candidates.index[0]]
+
+# STC maximum power point of the fitted and the database parameters
+stc = pd.DataFrame({
+    name: pvlib.pvsystem.max_power_point(*pvlib.pvsystem.calcparams_cec(
+        1000., temp_ref, params['alpha_sc'], params['a_ref'], params['I_L_ref'],
+        params['I_o_ref'], params['R_sh_ref'], params['R_s'], params.get('Adjust', 0)),
+        method='newton')
+    for name, params in (('fitted', mod), ('database', db_mod))}).astype(float)
+print(stc)
 
 # pull inputs
 IL, I0, Rs, Rsh, nNsVth = pvlib.pvsystem.calcparams_cec(
@@ -82,52 +110,25 @@ IL, I0, Rs, Rsh, nNsVth = pvlib.pvsystem.calcparams_cec(
     Adjust=mod.get('Adjust', 0)  # some entries may omit Adjust; default 0
 )
 
-'''
-# commented out because of error 6parsolve simulation error 
-# : Could not solve, sanity check failed (-33): abs((P - Pmp) / Pmp) > 0.015
-
-# single diode models for giving more values for IV curves
-I_L_ref, I_o_ref, R_s, R_sh_ref, a_ref, Adjust = pvlib.ivtools.sdm.fit_cec_sam(
-    celltype=celltype,
-    v_mp=v_mp,
-    i_mp=i_mp,
-    v_oc=v_oc,
-    i_sc=i_sc,
-    alpha_sc=temp_coeff_isc,
-    beta_voc=temp_coeff_voc,
-    gamma_pmp=temp_coeff_pmax,
-    cells_in_series=cells_in_series,
-    temp_ref=temp_ref
-)
-
-cec_params = pvlib.pvsystem.calcparams_cec(effective_irradiance,
-                                           temp_cell,
-                                           temp_coeff_isc,
-                                           I_L_ref,
-                                           I_o_ref,
-                                           R_sh_ref,
-                                           R_s,
-                                           Adjust
-)
-'''
-
+# solver of the MPP, compare the others with benchmark_sdm.py
 mpp = pvlib.pvsystem.max_power_point(IL, I0, Rs, Rsh, nNsVth, method='newton')  # DC result 1 module
 print(mpp)
 mpp.plot(figsize=(16,8))
 plt.title('DC Power 1 Module')
 plt.show()
 
-# Now that we have created the module, we can create the system
-system = PVSystem(modules_per_string=5, strings_per_inverter=1)
-
-# DC results when scaled
-dc_scaled = system.scale_voltage_current_power(mpp)
+# Now that we have created the module, we can create the system: one string of
+# 5 modules solved module by module, so each module can get its own irradiance,
+# temperature or degraded parameters (e.g. R_sh_ref=mod['R_sh_ref'] * [1, 1, 0.5, 1, 1])
+dc_scaled, dc_modules = run_array_dc_from_poa(poa_data, mod, numberStrs=1, numberMods=5,
+                                              temp_cell=temp_cell,
+                                              effective_irradiance=effective_irradiance)
 dc_scaled.plot(figsize=(16,8))
 plt.title('DC Power 5 Modules')
 plt.show()
 
 # Define inverter from database
-cec_inverters = pvlib.pvsystem.retrieve_sam('CECInverter')
+cec_inverters = open_database('CECInverter')
 inverter = cec_inverters['ABB__PVI_3_0_OUTD_S_US_208V']
 
 # AC results for 1 module
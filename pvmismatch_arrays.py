@@ -0,0 +1,391 @@
+# array-backed (structure-of-arrays) pvmismatch system
+#
+# Keeps irradiance, temperature and the cell type of a whole system in
+# contiguous numpy arrays indexed by (string, module, cell) instead of one
+# PVcell/PVmodule/PVstring object (each with its own IV arrays) per position.
+# A cell type is a row of a small table of cell parameters, so a cell costs
+# two floats and an index. Strings and modules are lightweight views into
+# these arrays, and the system is solved with the batched engine of
+# pvmismatch_batch after reducing the arrays to their distinct cells,
+# substrings, modules and strings. The reduction is kept between solves and
+# only the strings a change touched are reduced again, in chunks of at most
+# MAX_CELLS cells so memory does not grow with the system.
+
+import numpy as np
+from pvmismatch import PVcell, pvmodule
+
+import pvmismatch_batch as pb
+
+MAX_CELLS = 2 ** 20  # cells reduced at once, bounds the memory of a solve
+
+
+def _unique_rows(keys):
+    """
+    Distinct rows of a 2-D array and the row index of every input row.
+
+    Same as ``np.unique(keys, axis=0, return_inverse=True)``, but each column
+    is factorized on its own and the codes are combined into one integer key,
+    which is much faster than sorting whole rows.
+    """
+    codes, ncodes = np.zeros(keys.shape[0], dtype=np.int64), 1
+    for col in keys.T:
+        uniq, inverse = np.unique(col, return_inverse=True)
+        if uniq.size == 1:
+            continue  # constant column
+        if ncodes * uniq.size >= 2 ** 62:
+            _, codes = np.unique(codes, return_inverse=True)  # re-compress before overflow
+            ncodes = codes.max() + 1
+        codes = codes * uniq.size + inverse.reshape(-1)
+        ncodes *= uniq.size
+    _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    return keys[first], inverse.reshape(-1)
+
+
+def _type_ids(types, rows):
+    """
+    Ids of the rows of a 2-D array in a dict of type key -> id, new rows are added.
+
+    :return: id of every row, shape (len(rows),)
+    """
+    return np.array([types.setdefault(key, len(types)) for key in map(tuple, rows.tolist())],
+                    dtype=np.int64)
+
+
+def _renumber(types, used):
+    """
+    Keep the used entries of a dict of type key -> id, ids in insertion order.
+
+    :param used: sorted ids to keep
+    :return: ``(keys, ids)``, the kept keys in the order of their new ids and
+        the new id of every old id (-1 if dropped)
+    """
+    keys = list(types)
+    ids = np.full(len(keys), -1, dtype=np.int64)
+    ids[used] = np.arange(len(used))
+    return [keys[i] for i in used], ids
+
+
+def _count_matrix(rows, ncols):
+    """(nrows, ncols) counts of the column ids in each row of ``rows``, ignoring -1."""
+    counts = np.zeros((rows.shape[0], ncols))
+    row_ids = np.repeat(np.arange(rows.shape[0]), rows.shape[1])
+    keep = rows.reshape(-1) >= 0
+    np.add.at(counts, (row_ids[keep], rows.reshape(-1)[keep]), 1)
+    return counts
+
+
+class ArrayPVsystem(object):
+    """
+    PV system stored as arrays of shape (numberStrs, numberMods, numberCells).
+
+    All modules share one cell layout ``cell_pos``. The parameters of a cell
+    are the row :attr:`cell_types` of :attr:`cell_table`. Cell states can be
+    changed with :meth:`setSuns`, :meth:`setTemps` and :meth:`setCellParams`,
+    which re-solve the strings they touch, or by writing to :attr:`Ee`,
+    :attr:`Tcell` and :attr:`cell_types` directly and then calling
+    :meth:`calcSystem` with the changed strings.
+
+    :param numberStrs: number of strings in parallel
+    :param numberMods: number of modules in series per string
+    :param cell_pos: cell layout of every module, e.g. ``pvmodule.STD72``
+    :param Vbypass: bypass diode voltage of every substring, or a sequence
+        with one voltage (or ``None`` for no diode) per substring
+    :param pvcell: ``PVcell`` whose parameters all cells start with
+    :param pvconst: pvmismatch constants
+    """
+
+    def __init__(self, numberStrs=10, numberMods=10, cell_pos=pvmodule.STD96,
+                 Vbypass=pvmodule.VBYPASS, pvcell=None, pvconst=pb.PVCONST):
+        self.pvconst = pvconst
+        self.numberStrs = numberStrs
+        self.numberMods = numberMods
+        self.cell_pos = cell_pos
+        # cell indices of each substring, padded with -1 to the longest substring
+        substrs = pb._module_substrings(self)
+        nsub = len(substrs)
+        self._substrs = np.full((nsub, max(len(idx) for idx in substrs)), -1)
+        for j, idx in enumerate(substrs):
+            self._substrs[j, :len(idx)] = idx
+        self.numberCells = sum(len(idx) for idx in substrs)
+        if np.ndim(Vbypass) == 0:
+            Vbypass = [Vbypass] * nsub
+        self.Vbypass = np.array([pb.NO_BYPASS if vb is None else float(vb) for vb in Vbypass])
+        if self.Vbypass.size != nsub:
+            raise ValueError('Vbypass needs one voltage per substring (%d)' % nsub)
+        shape = (numberStrs, numberMods, self.numberCells)
+        pvc = pvcell if pvcell is not None else PVcell(pvconst=pvconst)
+        self.cell_table = np.array([pb.cell_params(pvc)])  # parameter rows, (K, len(CELL_PARAMS))
+        self.cell_types = np.zeros(shape, dtype=np.int32)  # row of cell_table of every cell
+        self.Ee = np.full(shape, float(pvc.Ee))
+        self.Tcell = np.full(shape, float(pvc.Tcell))
+        # distinct (cell type, Ee, Tcell), substrings, modules and strings, type key -> id
+        self._cells, self._subs, self._mods, self._strs = {}, {}, {}, {}
+        self._str_types = np.zeros(numberStrs, dtype=np.int64)  # string type of every string
+        self.Imp = self.Vmp = self.Pmp = self.Isys = self.Vsys = self.Psys = None
+        self.calcSystem()
+
+    @classmethod
+    def from_pvsystem(cls, pvsys):
+        """
+        Array copy of a ``PVsystem`` with equal strings of modules with the same cell layout.
+
+        :param pvsys: a pvmismatch ``PVsystem``
+        :return: :class:`ArrayPVsystem`
+        """
+        pvmod = pvsys.pvstrs[0].pvmods[0]
+        if pvmod.Vbypass_config == pvmodule.MODULE_BYPASS:
+            raise NotImplementedError('module bypass diodes are not supported')
+        if len(set(len(pvstr.pvmods) for pvstr in pvsys.pvstrs)) > 1:
+            raise ValueError('all strings must have the same number of modules')
+        sub_vbypass, _ = pb._module_bypass(pvmod)
+        arrsys = cls(len(pvsys.pvstrs), len(pvsys.pvstrs[0].pvmods), pvmod.cell_pos,
+                     [None if vb == pb.NO_BYPASS else vb for vb in sub_vbypass],
+                     pvmod.pvcells[0], pvsys.pvconst)
+        table = {row: i for i, row in enumerate(map(tuple, arrsys.cell_table.tolist()))}
+        mod_memo = {}
+        for s, pvstr in enumerate(pvsys.pvstrs):
+            for m, pvmod in enumerate(pvstr.pvmods):
+                if id(pvmod) not in mod_memo:
+                    if pvmod.cell_pos != arrsys.cell_pos:
+                        raise ValueError('all modules must have the same cell layout')
+                    mod_memo[id(pvmod)] = (
+                        [table.setdefault(pb.cell_params(pvc), len(table)) for pvc in pvmod.pvcells],
+                        pvmod.Ee.reshape(-1), pvmod.Tcell.reshape(-1))
+                arrsys.cell_types[s, m], arrsys.Ee[s, m], arrsys.Tcell[s, m] = mod_memo[id(pvmod)]
+        arrsys.cell_table = np.array(list(table))
+        arrsys.calcSystem()
+        return arrsys
+
+    # --- views
+
+    @property
+    def pvstrs(self):
+        """Views of the strings."""
+        return [StringView(self, s) for s in range(self.numberStrs)]
+
+    def __getitem__(self, s):
+        return StringView(self, s)
+
+    def __len__(self):
+        return self.numberStrs
+
+    # --- cell states
+
+    def setSuns(self, Ee, strs=slice(None), mods=slice(None), cells=slice(None)):
+        """
+        Set irradiance [suns] of the selected cells and re-solve the system.
+
+        For Example::
+
+            arrsys.setSuns(0.2, strs=0, mods=[0, 1, 2], cells=[11, 12, 35, 36, 59, 60])
+
+        :param Ee: irradiance, broadcastable to the selection
+        :param strs: string indices
+        :param mods: module indices within the strings
+        :param cells: cell indices within the modules
+        """
+        idx = self._index(strs, mods, cells)
+        self.Ee[np.ix_(*idx)] = Ee
+        self.calcSystem(idx[0])
+
+    def setTemps(self, Tc, strs=slice(None), mods=slice(None), cells=slice(None)):
+        """Set temperature [K] of the selected cells and re-solve the system."""
+        idx = self._index(strs, mods, cells)
+        self.Tcell[np.ix_(*idx)] = Tc
+        self.calcSystem(idx[0])
+
+    def setCellParams(self, strs=slice(None), mods=slice(None), cells=slice(None), **params):
+        """
+        Set cell parameters, e.g. ``Rsh=5.``, of the selected cells and re-solve the system.
+
+        Each distinct (old cell type, new values) of the selection becomes one
+        row of :attr:`cell_table`; values are broadcast to the selection.
+        """
+        idx = self._index(strs, mods, cells)
+        old = self.cell_types[np.ix_(*idx)]
+        names = list(params)
+        keys = np.stack([old.reshape(-1).astype(float)]
+                        + [np.broadcast_to(np.asarray(params[name], dtype=float), old.shape).reshape(-1)
+                           for name in names], axis=1)
+        combos, inverse = _unique_rows(keys)
+        rows = self.cell_table[combos[:, 0].astype(int)]
+        for j, name in enumerate(names):
+            rows[:, pb.CELL_PARAMS.index(name)] = combos[:, j + 1]
+        table = {row: i for i, row in enumerate(map(tuple, self.cell_table.tolist()))}
+        new = _type_ids(table, rows)
+        self.cell_table = np.array(list(table))
+        self.cell_types[np.ix_(*idx)] = new[inverse].reshape(old.shape)
+        self.calcSystem(idx[0])
+        self._compactTable()
+
+    def _compactTable(self):
+        """Drop the rows of :attr:`cell_table` no cell uses any more."""
+        used = np.unique(np.array([key[0] for key in self._cells], dtype=int))
+        if len(used) == len(self.cell_table):
+            return
+        ids = np.full(len(self.cell_table), -1, dtype=np.int32)
+        ids[used] = np.arange(len(used))
+        self.cell_table = self.cell_table[used]
+        self.cell_types = ids[self.cell_types]
+        self._cells = {(float(ids[int(key[0])]),) + key[1:]: i for key, i in self._cells.items()}
+
+    def _index(self, strs, mods, cells):
+        shape = self.Ee.shape
+        return [np.arange(n)[sel].reshape(-1) for n, sel in zip(shape, (strs, mods, cells))]
+
+    # --- solution
+
+    def _reduce(self, strs):
+        """
+        Distinct cells, substrings, modules and strings of the given strings.
+
+        The strings are reduced in chunks of at most :data:`MAX_CELLS` cells
+        and their types merged into the ones of the other strings.
+
+        :param strs: string indices
+        """
+        S, M, C = self.Ee.shape
+        nsub, cps = self._substrs.shape
+        step = max(MAX_CELLS // (M * C), 1)
+        for i in range(0, len(strs), step):
+            part = strs[i:i + step]
+            n = len(part)
+            states = np.stack((self.cell_types[part].reshape(-1), self.Ee[part].reshape(-1),
+                               self.Tcell[part].reshape(-1)), axis=1)
+            cells, inverse = _unique_rows(states)
+            cell_ids = _type_ids(self._cells, cells)[inverse].reshape(n * M, C)
+            # a substring is its (sorted) cell types and its bypass diode
+            sub_cells = np.where(self._substrs < 0, -1, cell_ids[:, self._substrs])
+            sub_cells = np.sort(sub_cells, axis=-1)  # (n*M, nsub, cps)
+            vbypass = np.broadcast_to(self.Vbypass[:, None], (n * M, nsub, 1))
+            subs, inverse = _unique_rows(
+                np.concatenate((sub_cells, vbypass), axis=-1).reshape(-1, cps + 1))
+            sub_ids = _type_ids(self._subs, subs)[inverse].reshape(n * M, nsub)
+            # modules are sorted substring types, strings are sorted module types
+            mods, inverse = _unique_rows(np.sort(sub_ids, axis=-1))
+            mod_ids = _type_ids(self._mods, mods)[inverse].reshape(n, M)
+            strings, inverse = _unique_rows(np.sort(mod_ids, axis=-1))
+            self._str_types[part] = _type_ids(self._strs, strings)[inverse]
+        self._compact()
+
+    def _compact(self):
+        """Drop the types no string uses any more and renumber the others."""
+        str_keys, str_ids = _renumber(self._strs, np.unique(self._str_types))
+        self._str_types = str_ids[self._str_types]
+        mod_keys, mod_ids = _renumber(self._mods, np.unique([m for key in str_keys for m in key]))
+        sub_keys, sub_ids = _renumber(self._subs, np.unique([j for key in mod_keys for j in key]))
+        cell_keys, cell_ids = _renumber(
+            self._cells, np.unique([int(c) for key in sub_keys for c in key[:-1] if c >= 0]))
+        self._cells = {key: i for i, key in enumerate(cell_keys)}
+        cell_ids = np.append(cell_ids, -1)  # -1 pads stay -1
+        self._subs = {tuple(np.sort(cell_ids[np.array(key[:-1], dtype=int)]).tolist()) + key[-1:]: i
+                      for i, key in enumerate(sub_keys)}
+        self._mods = {tuple(np.sort(sub_ids[list(key)]).tolist()): i
+                      for i, key in enumerate(mod_keys)}
+        self._strs = {tuple(np.sort(mod_ids[list(key)]).tolist()): i
+                      for i, key in enumerate(str_keys)}
+
+    def layout(self):
+        """
+        Distinct cells, substrings, modules and strings of the last solve.
+
+        :return: :class:`pvmismatch_batch.SystemLayout`, which can also be used
+            with :func:`pvmismatch_batch.run_mismatch`
+        """
+        cells = np.array(list(self._cells)).reshape(-1, 3)
+        subs = np.array(list(self._subs))
+        return pb.SystemLayout(
+            cell_params=self.cell_table[cells[:, 0].astype(int)],
+            cell_suns=cells[:, 1],
+            cell_temps=cells[:, 2],
+            sub_counts=_count_matrix(subs[:, :-1].astype(int), len(cells)),
+            sub_vbypass=subs[:, -1],
+            mod_counts=_count_matrix(np.array(list(self._mods)), len(subs)),
+            mod_vbypass=np.full(len(self._mods), pb.NO_BYPASS),
+            str_counts=_count_matrix(np.array(list(self._strs)), len(self._mods)),
+            str_weights=np.bincount(self._str_types, minlength=len(self._strs)).astype(float),
+        )
+
+    def calcSystem(self, strs=None):
+        """
+        Solve the system from the current cell arrays.
+
+        :param strs: indices of the strings changed since the last solve, all
+            strings if None, e.g. after writing to the arrays directly
+        """
+        strs = np.arange(self.numberStrs) if strs is None else np.unique(strs)
+        self._reduce(strs)
+        sol = pb.solve_layout(self.layout(), pvconst=self.pvconst)
+        self.Imp, self.Vmp, self.Pmp = sol.Imp[0], sol.Vmp[0], sol.Pmp[0]
+        self.Isys, self.Vsys = sol.Isys[0], sol.Vsys[0]
+        self.Psys = self.Isys * self.Vsys
+        return self.Isys, self.Vsys, self.Psys
+
+
+class StringView(object):
+    """String ``s`` of an :class:`ArrayPVsystem`, without copying any data."""
+
+    def __init__(self, system, s):
+        self.system = system
+        self.index = s
+
+    @property
+    def Ee(self):
+        """(numberMods, numberCells) irradiance view [suns]."""
+        return self.system.Ee[self.index]
+
+    @property
+    def Tcell(self):
+        """(numberMods, numberCells) temperature view [K]."""
+        return self.system.Tcell[self.index]
+
+    @property
+    def pvmods(self):
+        """Views of the modules."""
+        return [ModuleView(self.system, self.index, m) for m in range(self.system.numberMods)]
+
+    def __getitem__(self, m):
+        return ModuleView(self.system, self.index, m)
+
+    def __len__(self):
+        return self.system.numberMods
+
+    def setSuns(self, Ee, mods=slice(None), cells=slice(None)):
+        self.system.setSuns(Ee, self.index, mods, cells)
+
+    def setTemps(self, Tc, mods=slice(None), cells=slice(None)):
+        self.system.setTemps(Tc, self.index, mods, cells)
+
+
+class ModuleView(object):
+    """Module ``m`` of string ``s`` of an :class:`ArrayPVsystem`, without copying any data."""
+
+    def __init__(self, system, s, m):
+        self.system = system
+        self.index = (s, m)
+
+    @property
+    def Ee(self):
+        """(numberCells,) irradiance view [suns]."""
+        return self.system.Ee[self.index]
+
+    @property
+    def Tcell(self):
+        """(numberCells,) temperature view [K]."""
+        return self.system.Tcell[self.index]
+
+    @property
+    def cell_types(self):
+        """(numberCells,) view of the rows of ``cell_table`` of the cells."""
+        return self.system.cell_types[self.index]
+
+    @property
+    def params(self):
+        """(numberCells, len(CELL_PARAMS)) cell parameters, a copy."""
+        return self.system.cell_table[self.system.cell_types[self.index]]
+
+    def setSuns(self, Ee, cells=slice(None)):
+        self.system.setSuns(Ee, *self.index, cells=cells)
+
+    def setTemps(self, Tc, cells=slice(None)):
+        self.system.setTemps(Tc, *self.index, cells=cells)
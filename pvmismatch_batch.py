@@ -0,0 +1,565 @@
+# batched (array-at-a-time) mismatch engine for pvmismatch systems
+#
+# Solves the same two-diode + reverse-breakdown cell model as
+# pvmismatch.pvcell.PVcell, but for every timestep and every distinct cell
+# state in one set of numpy operations instead of one setSuns/setTemps call
+# (and one full system re-solve) per timestep.
+#
+# The system is first reduced to a SystemLayout: distinct cell states, the
+# substrings, modules and strings built from them and how often each one
+# occurs. Series connections are then sums of voltages on a common current
+# grid, and parallel connections are weighted sums of currents on a common
+# voltage grid.
+
+from collections import Counter, namedtuple
+
+import numpy as np
+import pandas as pd
+import pvlib
+from pvmismatch import pvconstants, pvmodule, pvsystem
+
+PVCONST = pvconstants.PVconstants()
+
+# PVcell attributes that define a cell's IV curve (besides Ee and Tcell)
+CELL_PARAMS = ('Rs', 'Rsh', 'Isat1_T0', 'Isat2_T0', 'Isc0_T0', 'aRBD', 'bRBD',
+               'VRBD', 'nRBD', 'Eg', 'alpha_Isc')
+
+EPS = np.finfo(np.float64).eps
+MIN_SUNS = 1e-6  # floor on irradiance so that fully dark cells still have a curve
+NO_BYPASS = -np.inf  # bypass voltage of a substring or module without a diode
+MAX_LEVELS = 8  # max number of Isc levels used to build the series current grid
+NREFINE = 11  # points of the refined voltage window around the MPP in adaptive mode
+ADAPTIVE_NPTS = 41  # default number of points of the adaptive grids
+MISMATCH_TOLERANCE = 0.05  # max error of mismatch [%] with ADAPTIVE_NPTS, see adaptive_error
+PMP_TOLERANCE = 5e-4  # max relative deviation of the full grid Pmp from PVsystem.Pmp
+
+SystemLayout = namedtuple('SystemLayout', [
+    'cell_params',  # (K, len(CELL_PARAMS)) parameters of each distinct cell
+    'cell_suns',    # (K,) irradiance of each distinct cell [suns]
+    'cell_temps',   # (K,) temperature of each distinct cell [K]
+    'sub_counts',   # (nSub, K) number of cells of each type in each substring
+    'sub_vbypass',  # (nSub,) bypass diode voltage of each substring [V]
+    'mod_counts',   # (nMod, nSub) number of substrings of each type in each module
+    'mod_vbypass',  # (nMod,) voltage of a bypass diode across the whole module [V]
+    'str_counts',   # (nStr, nMod) number of modules of each type in each string
+    'str_weights',  # (nStr,) number of identical strings in parallel
+])
+
+MismatchSolution = namedtuple('MismatchSolution', ['Imp', 'Vmp', 'Pmp', 'Isys', 'Vsys'])
+
+AdaptiveError = namedtuple('AdaptiveError', [
+    'mismatch',   # (T,) absolute error of mismatch [%], i.e. of the loss against module Pmp
+    'module_eq',  # (T,) Pmp error in module equivalents (average module Pmp)
+    'Pmp',        # (T,) relative error of Pmp
+    'Vmp',        # (T,) relative error of Vmp
+    'Isys',       # (T,) max system current error relative to the system Isc
+])
+
+
+# --- Array helpers
+
+def interp_rows(x, xp, fp):
+    """
+    Row-wise linear interpolation with linear extrapolation.
+
+    Like :func:`numpy.interp` applied along the last axis of every row, but
+    without a Python loop. Leading dimensions of ``x``, ``xp`` and ``fp`` are
+    broadcast against each other.
+
+    :param x: points to evaluate, shape (..., n)
+    :param xp: sample points, increasing along the last axis, shape (..., m)
+    :param fp: sample values, shape (..., m)
+    :return: interpolated values, shape (..., n)
+    """
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    fp = np.asarray(fp, dtype=float)
+    lead = np.broadcast_shapes(x.shape[:-1], xp.shape[:-1], fp.shape[:-1])
+    n, m = x.shape[-1], xp.shape[-1]
+    x2 = np.broadcast_to(x, lead + (n,)).reshape(-1, n)
+    xp2 = np.broadcast_to(xp, lead + (m,)).reshape(-1, m)
+    fp2 = np.broadcast_to(fp, lead + (m,)).reshape(-1, m)
+
+    # rank every x against its own row of xp by sorting both together, xp
+    # first so that ties count as "xp <= x" like searchsorted(side='right')
+    order = np.argsort(np.concatenate((xp2, x2), axis=1), axis=1, kind='stable')
+    count = np.cumsum(order < m, axis=1)
+    r, c = np.nonzero(order >= m)
+    idx = np.empty(x2.shape, dtype=np.intp)
+    idx[r, order[r, c] - m] = count[r, c]
+
+    # interval [j - 1, j] for each x, clipped so the end intervals extrapolate
+    j = np.clip(idx, 1, m - 1)
+    x0 = np.take_along_axis(xp2, j - 1, axis=1)
+    x1 = np.take_along_axis(xp2, j, axis=1)
+    f0 = np.take_along_axis(fp2, j - 1, axis=1)
+    f1 = np.take_along_axis(fp2, j, axis=1)
+    dx = x1 - x0
+    slope = np.divide(f1 - f0, dx, out=np.zeros_like(dx), where=dx != 0)
+    return (f0 + slope * (x2 - x0)).reshape(lead + (n,))
+
+
+def unit_points(pvconst=PVCONST):
+    """
+    Normalized point spacings taken from pvmismatch.
+
+    :return: ``(fwd, rev)``, ``fwd`` increasing from 0 to 1 and densest near 1,
+        ``rev`` decreasing from 1 to almost 0 and densest near 1
+    """
+    fwd = np.sort(np.ravel(pvconst.pts))
+    rev = np.sort(np.ravel(pvconst.negpts))[::-1]
+    return fwd, rev
+
+
+def mpp_rows(I, V):
+    """
+    Maximum power point of every row of an IV curve.
+
+    Uses the same central-difference dP/dV interpolation as
+    ``PVsystem.calcMPP_IscVocFFeff``, vectorized along the leading axes.
+
+    :param I: currents, shape (..., n)
+    :param V: voltages, shape (..., n)
+    :return: ``(Imp, Vmp, Pmp)``, each of shape (...)
+    """
+    I, V = np.broadcast_arrays(np.asarray(I, dtype=float), np.asarray(V, dtype=float))
+    P = I * V
+    mpp = np.clip(np.argmax(P, axis=-1), 1, P.shape[-1] - 2)[..., None]
+    idx = mpp + np.arange(-1, 2)
+    P3 = np.take_along_axis(P, idx, axis=-1)
+    V3 = np.take_along_axis(V, idx, axis=-1)
+    I3 = np.take_along_axis(I, idx, axis=-1)
+    dV = np.diff(V3, axis=-1)
+    Pv = np.divide(np.diff(P3, axis=-1), dV, out=np.zeros_like(dV), where=dV != 0)
+    Vmid = (V3[..., 1:] + V3[..., :-1]) / 2.
+    Imid = (I3[..., 1:] + I3[..., :-1]) / 2.
+    dPv = Pv[..., 1] - Pv[..., 0]
+    ok = dPv != 0
+    frac = np.divide(-Pv[..., 0], dPv, out=np.zeros_like(dPv), where=ok)
+    Vmp = np.where(ok, Vmid[..., 0] + frac * (Vmid[..., 1] - Vmid[..., 0]), V3[..., 1])
+    Imp = np.where(ok, Imid[..., 0] + frac * (Imid[..., 1] - Imid[..., 0]), I3[..., 1])
+    return Imp, Vmp, Imp * Vmp
+
+
+def curve_pmp(I, V):
+    """
+    Maximum power of every row of a piecewise-linear IV curve.
+
+    Power along a segment between two samples is quadratic, so its maximum
+    is found exactly on every segment. Any point interpolated on the curve,
+    e.g. an operating point, has at most this power.
+
+    :param I: currents, shape (..., n)
+    :param V: voltages, shape (..., n)
+    :return: Pmp, shape (...)
+    """
+    I, V = np.broadcast_arrays(np.asarray(I, dtype=float), np.asarray(V, dtype=float))
+    I0, V0 = I[..., :-1], V[..., :-1]
+    dI, dV = np.diff(I, axis=-1), np.diff(V, axis=-1)
+    # P(t) = (I0 + t dI) (V0 + t dV) on t in [0, 1]
+    a = dI * dV
+    t = np.divide(-(dI * V0 + I0 * dV), 2. * a, out=np.zeros_like(a), where=a < 0)
+    t = np.clip(t, 0., 1.)
+    Pseg = (I0 + t * dI) * (V0 + t * dV)
+    return np.maximum(Pseg.max(axis=-1), (I * V).max(axis=-1))
+
+
+# --- Cells
+
+def cell_params(pvcell):
+    """Parameter tuple of a ``PVcell``, in :data:`CELL_PARAMS` order."""
+    return tuple(float(getattr(pvcell, p)) for p in CELL_PARAMS)
+
+
+def _cell_constants(params, Ee, Tcell, pvconst):
+    params = np.moveaxis(np.asarray(params, dtype=float), -1, 0)
+    Ee = np.maximum(np.asarray(Ee, dtype=float), MIN_SUNS)
+    Tcell = np.asarray(Tcell, dtype=float)
+    Rs, Rsh, Isat1_T0, Isat2_T0, Isc0_T0, aRBD, bRBD, VRBD, nRBD, Eg, alpha_Isc = \
+        np.broadcast_arrays(*params, Ee, Tcell)[:len(CELL_PARAMS)]
+    Ee, Tcell = np.broadcast_arrays(Ee, Tcell, Rs)[:2]
+    k, q, T0 = pvconst.k, pvconst.q, pvconst.T0
+    Vt = k * Tcell / q
+    Isc0 = Isc0_T0 * (1. + alpha_Isc * (Tcell - T0))
+    Isc = Ee * Isc0
+    Tstar = Tcell ** 3. / T0 ** 3.
+    inv_delta_T = 1. / T0 - 1. / Tcell
+    Isat1 = Isat1_T0 * Tstar * np.exp(Eg * q / k * inv_delta_T)
+    Isat2 = Isat2_T0 * Tstar * np.exp(Eg * q / (2. * k) * inv_delta_T)
+    # photogenerated current coefficient from the short circuit condition
+    Vdiode_sc = Isc * Rs
+    Aph = 1. + (Isat1 * np.expm1(Vdiode_sc / Vt) + Isat2 * np.expm1(Vdiode_sc / 2. / Vt)
+                + Vdiode_sc / Rsh) / Isc
+    Igen = Aph * Isc
+    C = Igen + Isat1 + Isat2
+    Voc = Vt * np.log(((-Isat2 + np.sqrt(Isat2 ** 2. + 4. * Isat1 * C)) / 2. / Isat1) ** 2.)
+    # estimated Voc at STC, as PVcell._VocSTC() for a cell created at T0
+    Vt0 = k * T0 / q
+    Vdiode_sc = Isc0_T0 * Rs
+    Aph0 = 1. + (Isat1_T0 * np.expm1(Vdiode_sc / Vt0) + Isat2_T0 * np.expm1(Vdiode_sc / 2. / Vt0)
+                 + Vdiode_sc / Rsh) / Isc0_T0
+    C0 = Aph0 * Isc0_T0 + Isat1_T0 + Isat2_T0
+    VocSTC = Vt0 * np.log(((-Isat2_T0 + np.sqrt(Isat2_T0 ** 2. + 4. * Isat1_T0 * C0))
+                           / 2. / Isat1_T0) ** 2.)
+    return dict(Rs=Rs, Rsh=Rsh, Isc0_T0=Isc0_T0, aRBD=aRBD, bRBD=bRBD, VRBD=VRBD,
+                nRBD=nRBD, Vt=Vt, Isc=Isc, Isat1=Isat1, Isat2=Isat2, Igen=Igen, Voc=Voc,
+                VocSTC=VocSTC)
+
+
+def cell_isc(params, Ee, Tcell, pvconst=PVCONST):
+    """Short circuit current of cells, broadcast over ``params``, ``Ee`` and ``Tcell``."""
+    return _cell_constants(params, Ee, Tcell, pvconst)['Isc']
+
+
+def calc_cells(params, Ee, Tcell, pvconst=PVCONST):
+    """
+    Cell IV curves for any number of cell states at once.
+
+    Vectorized equivalent of ``PVcell.calcCell``.
+
+    :param params: cell parameters, shape (..., len(CELL_PARAMS))
+    :param Ee: irradiance [suns], broadcastable to the leading shape
+    :param Tcell: cell temperature [K], broadcastable to the leading shape
+    :param pvconst: pvmismatch constants
+    :return: ``(Icell, Vcell)``, each of shape (..., npts), with ``Icell``
+        decreasing and ``Vcell`` increasing along the last axis
+    """
+    c = _cell_constants(params, Ee, Tcell, pvconst)
+    fwd, rev = unit_points(pvconst)
+    # same voltage points as PVcell.calcCell: reverse bias down to breakdown,
+    # then forward bias, then a fourth quadrant section between Voc and VocSTC
+    Voc, VocSTC = c['Voc'], c['VocSTC']
+    delta_Voc = VocSTC - Voc
+    Vff = np.where(delta_Voc == 0, 0.8 * Voc, np.where(delta_Voc < 0, VocSTC, Voc))
+    delta_Voc = np.where(delta_Voc == 0, 0.2 * Voc, np.abs(delta_Voc))
+    Vdiode = np.concatenate((c['VRBD'][..., None] * rev, Vff[..., None] * fwd,
+                             Vff[..., None] + delta_Voc[..., None] * rev[::-1]), axis=-1)
+
+    def ex(name):
+        return c[name][..., None]
+
+    Idiode1 = ex('Isat1') * np.expm1(Vdiode / ex('Vt'))
+    Idiode2 = ex('Isat2') * np.expm1(Vdiode / 2. / ex('Vt'))
+    Ishunt = Vdiode / ex('Rsh')
+    fRBD = 1. - Vdiode / ex('VRBD')
+    fRBD[fRBD == 0] = EPS  # avoid "divide by zero" exactly at breakdown
+    Vdiode_norm = Vdiode / ex('Rsh') / ex('Isc0_T0')
+    fRBD = ex('Isc0_T0') * fRBD ** (-ex('nRBD'))
+    IRBD = (ex('aRBD') * Vdiode_norm + ex('bRBD') * Vdiode_norm ** 2) * fRBD
+    Icell = ex('Igen') - Idiode1 - Idiode2 - Ishunt - IRBD
+    Vcell = Vdiode - Icell * ex('Rs')
+    return Icell, Vcell
+
+
+def current_grid(Isc, pvconst=PVCONST):
+    """
+    Common current points used to add voltages of series connected devices.
+
+    Points are densest just below each distinct short circuit current, where
+    the knees of the individual curves are.
+
+    :param Isc: short circuit currents of the cell types, shape (..., K)
+    :return: increasing currents from 0 to ``max(Isc)``, shape (..., L * npts)
+    """
+    Isc = np.asarray(Isc, dtype=float)
+    if Isc.shape[-1] > MAX_LEVELS:
+        Isc = np.moveaxis(np.quantile(Isc, np.linspace(0., 1., MAX_LEVELS), axis=-1), 0, -1)
+    fwd, _ = unit_points(pvconst)
+    grid = (Isc[..., None] * fwd).reshape(Isc.shape[:-1] + (-1,))
+    return np.sort(grid, axis=-1)
+
+
+# --- Systems
+
+def _module_substrings(pvmod):
+    """Cell indices of each substring of a module."""
+    substrs = []
+    for substr in pvmod.cell_pos:
+        idx = []
+        for col in substr:
+            for cell in col:
+                if cell['crosstie']:
+                    raise NotImplementedError('cross-tied modules are not supported')
+                idx.append(cell['idx'])
+        substrs.append(idx)
+    return substrs
+
+
+def _module_bypass(pvmod):
+    """Bypass diode voltages of each substring and of the whole module."""
+    nsub = len(pvmod.cell_pos)
+    if pvmod.Vbypass_config == pvmodule.MODULE_BYPASS:
+        return [NO_BYPASS] * nsub, float(pvmod.Vbypass[0])
+    if pvmod.Vbypass_config == pvmodule.CUSTOM_SUBSTR_BYPASS:
+        return [NO_BYPASS if vb is None else float(vb) for vb in pvmod.Vbypass], NO_BYPASS
+    return [float(pvmod.Vbypass)] * nsub, NO_BYPASS
+
+
+def _counts(keys, ncols):
+    """Dense count matrix from rows of ``(column, count)`` pairs."""
+    arr = np.zeros((len(keys), ncols))
+    for row, key in enumerate(keys):
+        for col, n in key:
+            arr[row, col] = n
+    return arr
+
+
+def layout_from_pvsystem(pvsys):
+    """
+    Reduce a ``PVsystem`` to its distinct cells, substrings, modules and strings.
+
+    Modules and cells that are shared between positions (e.g.
+    ``PVstring(pvmods=[module_std]*21)``) are only inspected once.
+
+    :param pvsys: a pvmismatch ``PVsystem``
+    :return: :class:`SystemLayout`
+    """
+    cell_types, sub_types, mod_types, str_types = {}, {}, {}, {}
+    cell_memo, mod_memo = {}, {}
+
+    def index(types, key):
+        return types.setdefault(key, len(types))
+
+    for pvstr in pvsys.pvstrs:
+        mods = []
+        for pvmod in pvstr.pvmods:
+            if id(pvmod) not in mod_memo:
+                sub_vbypass, mod_vbypass = _module_bypass(pvmod)
+                subs = []
+                for idx, vb in zip(_module_substrings(pvmod), sub_vbypass):
+                    cells = []
+                    for i in idx:
+                        pvc = pvmod.pvcells[i]
+                        if id(pvc) not in cell_memo:
+                            key = (cell_params(pvc), float(pvc.Ee), float(pvc.Tcell))
+                            cell_memo[id(pvc)] = index(cell_types, key)
+                        cells.append(cell_memo[id(pvc)])
+                    subs.append(index(sub_types, (tuple(sorted(Counter(cells).items())), vb)))
+                key = (tuple(sorted(Counter(subs).items())), mod_vbypass)
+                mod_memo[id(pvmod)] = index(mod_types, key)
+            mods.append(mod_memo[id(pvmod)])
+        key = tuple(sorted(Counter(mods).items()))
+        str_types[key] = str_types.get(key, 0) + 1
+
+    cells, subs, mods = list(cell_types), list(sub_types), list(mod_types)
+    return SystemLayout(
+        cell_params=np.array([c[0] for c in cells]).reshape(-1, len(CELL_PARAMS)),
+        cell_suns=np.array([c[1] for c in cells]),
+        cell_temps=np.array([c[2] for c in cells]),
+        sub_counts=_counts([s[0] for s in subs], len(cells)),
+        sub_vbypass=np.array([s[1] for s in subs]),
+        mod_counts=_counts([m[0] for m in mods], len(subs)),
+        mod_vbypass=np.array([m[1] for m in mods]),
+        str_counts=_counts(list(str_types), len(mods)),
+        str_weights=np.array(list(str_types.values()), dtype=float),
+    )
+
+
+def string_curves(layout, Ee=None, Tcell=None, params=None, pvconst=PVCONST, npts=None):
+    """
+    IV curves of every distinct string in a layout.
+
+    :param layout: :class:`SystemLayout`
+    :param Ee: cell irradiance [suns], shape (T, K); defaults to ``layout.cell_suns``
+    :param Tcell: cell temperature [K], shape (T, K); defaults to ``layout.cell_temps``
+    :param params: cell parameters, shape (K, P) or (T, K, P); defaults to
+        ``layout.cell_params``
+    :param npts: points per Isc level of the series current grid, defaults to
+        ``pvconst.npts``; cell curves always use ``pvconst.npts``, coarser
+        cell curves about double the Pmp error of the adaptive grids
+    :return: ``(Igrid, Vstr)``, currents of shape (T, G) and string voltages
+        of shape (T, nStr, G)
+    """
+    Ee = np.atleast_2d(layout.cell_suns if Ee is None else Ee)
+    Tcell = np.atleast_2d(layout.cell_temps if Tcell is None else Tcell)
+    params = layout.cell_params if params is None else params
+    Icell, Vcell = calc_cells(params, Ee, Tcell, pvconst)
+    grid_pvconst = pvconst if npts is None else pvconstants.PVconstants(npts)
+    Igrid = current_grid(cell_isc(params, Ee, Tcell, pvconst), grid_pvconst)
+    Vcells = interp_rows(Igrid[:, None, :], Icell[..., ::-1], Vcell[..., ::-1])
+    Vsub = np.einsum('sk,tkg->tsg', layout.sub_counts, Vcells)
+    Vsub = np.maximum(Vsub, layout.sub_vbypass[:, None])  # bypass diodes
+    Vmod = np.einsum('ms,tsg->tmg', layout.mod_counts, Vsub)
+    Vmod = np.maximum(Vmod, layout.mod_vbypass[:, None])
+    Vstr = np.einsum('nm,tmg->tng', layout.str_counts, Vmod)
+    return Igrid, Vstr
+
+
+def parallel_curves(Igrid, Vstr, weights, pvconst=PVCONST):
+    """
+    Combine parallel strings by weighted current summation.
+
+    :param Igrid: currents, shape (T, G)
+    :param Vstr: string voltages on ``Igrid``, shape (T, N, G)
+    :param weights: number of strings of each kind, shape (N,)
+    :return: ``(Isys, Vsys)``, each of shape (T, npts), ``Vsys`` increasing
+        from 0 to the highest string open circuit voltage
+    """
+    fwd, _ = unit_points(pvconst)
+    Voc = Vstr[..., 0].max(axis=-1)  # Igrid starts at 0 A
+    Vsys = Voc[:, None] * fwd
+    Istr = interp_rows(Vsys[:, None, :], Vstr[..., ::-1], Igrid[:, None, ::-1])
+    Isys = np.einsum('n,tng->tg', np.asarray(weights, dtype=float), Istr)
+    return Isys, Vsys
+
+
+def refine_mpp(Igrid, Vstr, weights, Isys, Vsys, nrefine=NREFINE):
+    """
+    Resample parallel strings on a fine voltage window around the MPP.
+
+    :param Igrid: currents, shape (T, G)
+    :param Vstr: string voltages on ``Igrid``, shape (T, N, G)
+    :param weights: number of strings of each kind, shape (N,)
+    :param Isys: system currents on a coarse grid, shape (T, n)
+    :param Vsys: increasing system voltages of the coarse grid, shape (T, n)
+    :param nrefine: number of points between the neighbours of the coarse MPP
+    :return: ``(Isys, Vsys)`` of the coarse and fine points merged, shape
+        (T, n + nrefine), ``Vsys`` increasing
+    """
+    n = Vsys.shape[-1]
+    mpp = np.clip(np.argmax(Isys * Vsys, axis=-1), 1, n - 2)[:, None]
+    Vlo = np.take_along_axis(Vsys, mpp - 1, axis=-1)
+    Vhi = np.take_along_axis(Vsys, mpp + 1, axis=-1)
+    Vfine = Vlo + (Vhi - Vlo) * np.linspace(0., 1., nrefine + 2)[1:-1]
+    Istr = interp_rows(Vfine[:, None, :], Vstr[..., ::-1], Igrid[:, None, ::-1])
+    Ifine = np.einsum('n,tng->tg', np.asarray(weights, dtype=float), Istr)
+    V = np.concatenate((Vsys, Vfine), axis=-1)
+    I = np.concatenate((Isys, Ifine), axis=-1)
+    order = np.argsort(V, axis=-1, kind='stable')
+    return np.take_along_axis(I, order, axis=-1), np.take_along_axis(V, order, axis=-1)
+
+
+def solve_layout(layout, Ee=None, Tcell=None, params=None, pvconst=PVCONST, npts=None):
+    """
+    Solve a layout for one or many cell states at once.
+
+    With ``npts`` the string and system curves are sampled adaptively: the
+    series current grid has ``npts`` points per Isc level, densest at the
+    knees, and the system voltage grid has ``npts`` points plus
+    :data:`NREFINE` points around the MPP. This shrinks the string and system
+    curves, the cell curves keep the full grid. With :data:`ADAPTIVE_NPTS`
+    mismatch stays within :data:`MISMATCH_TOLERANCE` of the full grid; use
+    :func:`adaptive_error` to check a given layout.
+
+    :param layout: :class:`SystemLayout`
+    :param Ee: cell irradiance [suns], shape (T, K); defaults to ``layout.cell_suns``
+    :param Tcell: cell temperature [K], shape (T, K); defaults to ``layout.cell_temps``
+    :param params: cell parameters, shape (K, P) or (T, K, P)
+    :param npts: number of points of the adaptive grids, full ``pvconst.npts``
+        grids without refinement if None
+    :return: :class:`MismatchSolution` with arrays of leading shape (T,)
+    """
+    Igrid, Vstr = string_curves(layout, Ee, Tcell, params, pvconst, npts)
+    if npts is None:
+        Isys, Vsys = parallel_curves(Igrid, Vstr, layout.str_weights, pvconst)
+    else:
+        Isys, Vsys = parallel_curves(Igrid, Vstr, layout.str_weights,
+                                     pvconstants.PVconstants(npts))
+        Isys, Vsys = refine_mpp(Igrid, Vstr, layout.str_weights, Isys, Vsys)
+    Imp, Vmp, Pmp = mpp_rows(Isys, Vsys)
+    return MismatchSolution(Imp, Vmp, Pmp, Isys, Vsys)
+
+
+def module_pmp(layout, Ee=None, Tcell=None, params=None, pvconst=PVCONST):
+    """
+    Sum of the Pmp of every module of a layout on its own, i.e. the system
+    Pmp without mismatch losses.
+
+    :param layout: :class:`SystemLayout`
+    :return: Pmp of all modules [W], shape (T,)
+    """
+    nmod = layout.str_counts.shape[1]
+    modules = layout._replace(str_counts=np.eye(nmod), str_weights=np.ones(nmod))
+    Igrid, Vmod = string_curves(modules, Ee, Tcell, params, pvconst)
+    Pmod = curve_pmp(Igrid[:, None, :], Vmod)
+    return Pmod @ (np.asarray(layout.str_weights, dtype=float) @ layout.str_counts)
+
+
+def adaptive_error(layout, npts=ADAPTIVE_NPTS, Ee=None, Tcell=None, params=None,
+                   pvconst=PVCONST):
+    """
+    Deviation of an adaptive solution from the full grid solution.
+
+    Mismatch is the loss of the system against the sum of its module Pmp
+    (:func:`module_pmp`) in %, so its error is the Pmp error in % of the
+    module Pmp. For Example, for a shaded ``PVsystem``::
+
+        err = adaptive_error(layout_from_pvsystem(pvsys))
+        err.mismatch.max() < MISMATCH_TOLERANCE
+
+    :param layout: :class:`SystemLayout`
+    :param npts: number of points of the adaptive grids, see :func:`solve_layout`
+    :return: :class:`AdaptiveError`, each field of shape (T,)
+    """
+    full = solve_layout(layout, Ee, Tcell, params, pvconst)
+    adaptive = solve_layout(layout, Ee, Tcell, params, pvconst, npts)
+    Pmod = module_pmp(layout, Ee, Tcell, params, pvconst)
+    nmod = np.asarray(layout.str_weights, dtype=float) @ layout.str_counts.sum(axis=1)
+    Isys = interp_rows(full.Vsys, adaptive.Vsys, adaptive.Isys)
+    return AdaptiveError(
+        mismatch=np.abs(adaptive.Pmp - full.Pmp) / Pmod * 100,
+        module_eq=np.abs(adaptive.Pmp - full.Pmp) / (Pmod / nmod),
+        Pmp=np.abs(adaptive.Pmp / full.Pmp - 1.),
+        Vmp=np.abs(adaptive.Vmp / full.Vmp - 1.),
+        Isys=np.abs(Isys - full.Isys).max(axis=-1) / full.Isys[:, 0],
+    )
+
+
+# --- Time series
+
+def run_mismatch(pvsys, suns, temps, min_suns=1e-3, chunksize=744, pvconst=PVCONST,
+                 npts=None):
+    """
+    System maximum power point for every timestep of an irradiance series.
+
+    The irradiance of each cell is ``suns`` times its irradiance in ``pvsys``,
+    so shading set up with ``pvsys.setSuns(...)`` is kept as a pattern on top
+    of the series. All cells take the temperature of ``temps``.
+
+    On the full grid, Pmp agrees with ``pvsys.Pmp`` at the same irradiance
+    within :data:`PMP_TOLERANCE` for shaded and degraded systems.
+
+    :param pvsys: a pvmismatch ``PVsystem`` or a :class:`SystemLayout`
+    :param suns: plane of array irradiance [suns], shape (T,)
+    :param temps: cell temperature [K], shape (T,)
+    :param min_suns: timesteps below this irradiance are not solved and return 0
+    :param chunksize: number of timesteps solved per batch, bounds memory use
+    :param npts: solve with adaptive grids of ``npts`` points, e.g.
+        :data:`ADAPTIVE_NPTS`, see :func:`solve_layout`
+    :return: ``(Imp, Vmp, Pmp)``, each of shape (T,)
+    """
+    layout = pvsys if isinstance(pvsys, SystemLayout) else layout_from_pvsystem(pvsys)
+    suns = np.asarray(suns, dtype=float)
+    temps = np.broadcast_to(np.asarray(temps, dtype=float), suns.shape)
+    Imp, Vmp, Pmp = np.zeros((3,) + suns.shape)
+    day = np.flatnonzero(np.nan_to_num(suns) >= min_suns)
+    for start in range(0, day.size, chunksize):
+        rows = day[start:start + chunksize]
+        Ee = suns[rows, None] * layout.cell_suns
+        Tcell = np.repeat(temps[rows, None], layout.cell_suns.size, axis=1)
+        sol = solve_layout(layout, Ee, Tcell, pvconst=pvconst, npts=npts)
+        Imp[rows], Vmp[rows], Pmp[rows] = sol.Imp, sol.Vmp, sol.Pmp
+    return Imp, Vmp, Pmp
+
+
+def run_mismatch_from_poa(pvsys, poa, temp_cell=None, **kwargs):
+    """
+    Hourly DC output of a pvmismatch system from a POA irradiance frame.
+
+    :param pvsys: a pvmismatch ``PVsystem``; ``None`` for the default 30x21 system
+    :param poa: frame with ``poa_global`` [W/m^2] (and ``temp_air``,
+        ``wind_speed`` if ``temp_cell`` is not given), e.g. ``poa_data_2020``
+    :param temp_cell: cell temperature [C], e.g. ``modelchain.results.cell_temperature``;
+        defaults to the Faiman model
+    :param kwargs: passed on to :func:`run_mismatch`
+    :return: frame with ``i_mp``, ``v_mp`` and ``p_mp`` columns on the index of
+        ``poa``, like ``modelchain.results.dc``
+    """
+    if pvsys is None:
+        pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21)
+    if temp_cell is None:
+        temp_cell = pvlib.temperature.faiman(poa['poa_global'], poa['temp_air'], poa['wind_speed'])
+    suns = poa['poa_global'].to_numpy() / 1000.
+    temps = np.asarray(temp_cell, dtype=float) + 273.15
+    Imp, Vmp, Pmp = run_mismatch(pvsys, suns, temps, **kwargs)
+    return pd.DataFrame({'i_mp': Imp, 'v_mp': Vmp, 'p_mp': Pmp}, index=poa.index)
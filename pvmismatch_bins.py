@@ -0,0 +1,132 @@
+# bin-method energy yield of pvmismatch systems
+#
+# Most hours of a year share nearly the same plane of array irradiance and
+# cell temperature with many others. The timesteps are put in a 2-D
+# (irradiance, temperature) histogram and the system is solved once per
+# populated bin, at the mean conditions of its hours, with the batched
+# engine of pvmismatch_batch. The energy is the sum of these powers weighted
+# by the hours in each bin.
+#
+# Error: at the mean conditions of a bin the first order terms of the Pmp of
+# its hours cancel, what is left is the second order term. The curvature of
+# Pmp is taken from finite differences around the mean, over half a bin
+# width, and combined with the spread of the hours in the bin into a
+# correction of the estimate. The size of the second order terms is reported
+# as the error bound, what is left after the correction is of higher order.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pvlib
+from pvmismatch import pvsystem
+
+from pvmismatch_batch import PVCONST, SystemLayout, layout_from_pvsystem, run_mismatch
+
+SUNS_STEP = 0.05  # [suns] irradiance bin width, 50 W/m^2
+TEMP_STEP = 2.  # [K] cell temperature bin width
+
+BinEstimate = namedtuple('BinEstimate', [
+    'energy_kwh',  # estimated energy, with the second order correction
+    'error_kwh',   # bound of its deviation from the full hourly run
+    'hours',       # hours above the irradiance threshold
+    'bins',        # frame of the populated bins, see bin_conditions
+])
+
+
+def bin_conditions(suns, temps, suns_step=SUNS_STEP, temp_step=TEMP_STEP, min_suns=1e-3):
+    """
+    2-D histogram of the (irradiance, temperature) conditions of a series.
+
+    :param suns: irradiance [suns], shape (T,)
+    :param temps: cell temperature [K], shape (T,)
+    :param min_suns: timesteps below this irradiance are left out (night)
+    :return: ``(bins, labels)``, a frame with one row per populated bin (the
+        ``count`` of its timesteps, the mean ``suns`` and ``temps``, their
+        variances ``suns_var``, ``temps_var`` and covariance ``cov``) and the
+        row of ``bins`` of every timestep, -1 if left out
+    """
+    suns = np.asarray(suns, dtype=float)
+    temps = np.broadcast_to(np.asarray(temps, dtype=float), suns.shape)
+    day = np.flatnonzero(np.nan_to_num(suns) >= min_suns)
+    keys = pd.DataFrame({'i': np.floor(suns[day] / suns_step).astype(np.int64),
+                         'j': np.floor(temps[day] / temp_step).astype(np.int64)})
+    codes, uniques = pd.MultiIndex.from_frame(keys).factorize()
+    data = pd.DataFrame({'bin': codes, 'suns': suns[day], 'temps': temps[day],
+                         'suns_temps': suns[day] * temps[day]})
+    grouped = data.groupby('bin')
+    bins = grouped.mean()
+    bins.insert(0, 'count', grouped.size())
+    var = grouped[['suns', 'temps']].var(ddof=0)
+    bins['suns_var'], bins['temps_var'] = var['suns'], var['temps']
+    bins['cov'] = bins.pop('suns_temps') - bins['suns'] * bins['temps']
+    bins.index = uniques
+    labels = np.full(suns.shape, -1, dtype=np.int64)
+    labels[day] = codes
+    return bins, labels
+
+
+def estimate_energy(pvsys, suns, temps, step_hours=1., suns_step=SUNS_STEP, temp_step=TEMP_STEP,
+                    min_suns=1e-3, pvconst=PVCONST, npts=None):
+    """
+    Energy yield of a system over a series, solved once per populated bin.
+
+    For Example, with the hourly run as a check::
+
+        est = estimate_energy(pvsys, suns, temps)
+        _, _, Pmp = run_mismatch(pvsys, suns, temps)
+        abs(Pmp.sum() / 1000. - est.energy_kwh) <= est.error_kwh
+
+    :param pvsys: a pvmismatch ``PVsystem`` or a :class:`~pvmismatch_batch.SystemLayout`,
+        shading set up with ``setSuns`` is kept as in :func:`~pvmismatch_batch.run_mismatch`
+    :param suns: plane of array irradiance [suns], shape (T,)
+    :param temps: cell temperature [K], shape (T,)
+    :param step_hours: duration of a timestep [h]
+    :param npts: solve with adaptive grids, see :func:`~pvmismatch_batch.solve_layout`
+    :return: :class:`BinEstimate`, its ``bins`` have the ``p_mp`` at the mean
+        conditions of each bin [W], the second order ``correction`` of its
+        energy and the ``error`` bound [W h]
+    """
+    layout = pvsys if isinstance(pvsys, SystemLayout) else layout_from_pvsystem(pvsys)
+    bins, _ = bin_conditions(suns, temps, suns_step, temp_step, min_suns)
+    s0, t0 = bins['suns'].to_numpy(), bins['temps'].to_numpy()
+    ds = np.minimum(suns_step / 2., s0 / 2.)
+    dt = temp_step / 2.
+    # the mean and the finite difference points of every bin in one batch
+    s = np.concatenate([s0, s0 + ds, s0 - ds, s0, s0, s0 + ds, s0 - ds])
+    t = np.concatenate([t0, t0, t0, t0 + dt, t0 - dt, t0 + dt, t0 - dt])
+    _, _, Pmp = run_mismatch(layout, s, t, min_suns=0., pvconst=pvconst, npts=npts)
+    P0, Ps1, Ps0, Pt1, Pt0, P11, P00 = np.split(Pmp, 7)
+    Hss = (Ps1 - 2. * P0 + Ps0) / ds ** 2
+    Htt = (Pt1 - 2. * P0 + Pt0) / dt ** 2
+    Hst = (P11 + P00 - Ps1 - Ps0 - Pt1 - Pt0 + 2. * P0) / (2. * ds * dt)
+    hours = bins['count'].to_numpy() * step_hours
+    bins['p_mp'] = P0
+    bins['correction'] = 0.5 * hours * (Hss * bins['suns_var'] + Htt * bins['temps_var']
+                                        + 2. * Hst * bins['cov'])
+    bins['error'] = 0.5 * hours * (np.abs(Hss) * bins['suns_var'] + np.abs(Htt) * bins['temps_var']
+                                   + 2. * np.abs(Hst * bins['cov']))
+    energy = (hours * P0).sum() + bins['correction'].sum()
+    return BinEstimate(energy_kwh=float(energy) / 1000.,
+                       error_kwh=float(bins['error'].sum()) / 1000.,
+                       hours=float(hours.sum()), bins=bins)
+
+
+def estimate_energy_from_poa(pvsys, poa, temp_cell=None, **kwargs):
+    """
+    Energy yield of a pvmismatch system from a POA irradiance frame, see
+    :func:`~pvmismatch_batch.run_mismatch_from_poa` for the arguments.
+
+    :param kwargs: passed on to :func:`estimate_energy`, the timestep
+        defaults to the frequency of ``poa``
+    :return: :class:`BinEstimate`
+    """
+    if pvsys is None:
+        pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21)
+    if temp_cell is None:
+        temp_cell = pvlib.temperature.faiman(poa['poa_global'], poa['temp_air'], poa['wind_speed'])
+    if 'step_hours' not in kwargs and len(poa) > 1:
+        kwargs['step_hours'] = pd.Series(poa.index).diff().median() / pd.Timedelta('1h')
+    suns = poa['poa_global'].to_numpy() / 1000.
+    temps = np.asarray(temp_cell, dtype=float) + 273.15
+    return estimate_energy(pvsys, suns, temps, **kwargs)
@@ -0,0 +1,215 @@
+# shared IV-curve cache for pvmismatch cells, modules and strings
+#
+# Memoizes cell curves by (cell parameters, Ee, Tcell), module curves by
+# (module layout, cell states) and string curves by their (unordered) module
+# curves, so every distinct curve is computed once and then reused across
+# modules, strings, systems and repeated runs. Each level is a bounded LRU
+# cache with hit/miss counters.
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import pvmismatch_batch as pb
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """
+    Bounded least-recently-used cache with hit/miss counters.
+
+    :param maxsize: max number of entries kept, the least recently used entry
+        is evicted first
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, compute):
+        """
+        Return the cached value for ``key``, calling ``compute()`` on a miss.
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            value = self._data[key] = compute()
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+class IVCurveCache(object):
+    """
+    Memoized IV curves of cells, modules and strings.
+
+    Curves are computed with the same model as :mod:`pvmismatch_batch`.
+    Module and string curves span currents from 0 A to 1.5 times their
+    highest cell short circuit current, so that they are bypassed (flat) at
+    the top and can be extrapolated when put in series with stronger modules.
+
+    :param maxcells: max number of cell curves kept
+    :param maxmods: max number of module curves kept
+    :param maxstrs: max number of string curves kept
+    :param pvconst: pvmismatch constants
+    """
+
+    def __init__(self, maxcells=4096, maxmods=1024, maxstrs=256, pvconst=pb.PVCONST):
+        self.pvconst = pvconst
+        self.cells = LRUCache(maxcells)
+        self.mods = LRUCache(maxmods)
+        self.strs = LRUCache(maxstrs)
+
+    def cache_info(self):
+        """Hit/miss counters of every level."""
+        return {'cells': self.cells.cache_info(), 'mods': self.mods.cache_info(),
+                'strs': self.strs.cache_info()}
+
+    def clear(self):
+        self.cells.clear()
+        self.mods.clear()
+        self.strs.clear()
+
+    # --- keys
+
+    @staticmethod
+    def cell_key(pvcell):
+        """(cell parameters, Ee, Tcell) of a ``PVcell``."""
+        return pb.cell_params(pvcell), float(pvcell.Ee), float(pvcell.Tcell)
+
+    @staticmethod
+    def layout_key(pvmod):
+        """Substring cell indices and bypass diode voltages of a ``PVmodule``."""
+        substrs = tuple(tuple(idx) for idx in pb._module_substrings(pvmod))
+        sub_vbypass, mod_vbypass = pb._module_bypass(pvmod)
+        return substrs, tuple(sub_vbypass), mod_vbypass
+
+    def module_key(self, pvmod, memo=None):
+        """
+        (module layout, cell states) of a ``PVmodule``.
+
+        :param memo: optional dict of already computed cell keys by ``id(pvcell)``
+        """
+        memo = {} if memo is None else memo
+        states = []
+        for pvc in pvmod.pvcells:
+            if id(pvc) not in memo:
+                memo[id(pvc)] = self.cell_key(pvc)
+            states.append(memo[id(pvc)])
+        return self.layout_key(pvmod), tuple(states)
+
+    # --- curves
+
+    def cell(self, key):
+        """
+        Cell curve ``(Icell, Vcell)`` for a :meth:`cell_key`.
+        """
+        params, Ee, Tcell = key
+        return self.cells.get(key, lambda: pb.calc_cells(params, Ee, Tcell, self.pvconst))
+
+    def _series_grid(self, Isc):
+        fwd, _ = pb.unit_points(self.pvconst)
+        Isc = np.unique(Isc)
+        grid = pb.current_grid(Isc, self.pvconst)
+        return np.concatenate((grid, Isc.max() * (1. + 0.5 * fwd[1:])))
+
+    def _calc_module(self, key):
+        (substrs, sub_vbypass, mod_vbypass), states = key
+        distinct = list(OrderedDict.fromkeys(states))
+        index = {state: i for i, state in enumerate(distinct)}
+        Isc = [pb.cell_isc(*state, pvconst=self.pvconst) for state in distinct]
+        Igrid = self._series_grid(Isc)
+        Vcells = np.array([np.interp(Igrid, *[a[::-1] for a in self.cell(state)])
+                           for state in distinct])
+        Vmod = np.zeros_like(Igrid)
+        for idx, vbypass in zip(substrs, sub_vbypass):
+            counts = np.bincount([index[states[i]] for i in idx], minlength=len(distinct))
+            Vmod += np.maximum(counts @ Vcells, vbypass)
+        return Igrid, np.maximum(Vmod, mod_vbypass)
+
+    def module(self, key):
+        """
+        Module curve ``(Imod, Vmod)`` for a :meth:`module_key`, currents increasing.
+        """
+        return self.mods.get(key, lambda: self._calc_module(key))
+
+    def string_key(self, pvstr, memo=None):
+        """Module keys of a ``PVstring``, independent of the module order."""
+        memo = {} if memo is None else memo
+        keys = []
+        for pvmod in pvstr.pvmods:
+            if id(pvmod) not in memo:
+                memo[id(pvmod)] = self.module_key(pvmod, memo)
+            keys.append(memo[id(pvmod)])
+        return tuple(sorted(keys, key=hash))
+
+    def _calc_string(self, key):
+        curves = [self.module(mod_key) for mod_key in key]
+        # module curves end at 1.5 x Isc, so the grid is made from their Isc levels
+        Igrid = self._series_grid([I[-1] / 1.5 for I, _ in curves])
+        Vstr = np.zeros_like(Igrid)
+        for I, V in curves:
+            Vstr += pb.interp_rows(Igrid, I, V)
+        return Igrid, Vstr
+
+    def string(self, key):
+        """
+        String curve ``(Istring, Vstring)`` for a :meth:`string_key`, currents increasing.
+        """
+        return self.strs.get(key, lambda: self._calc_string(key))
+
+    def solve(self, pvsys):
+        """
+        Solve a ``PVsystem`` from cached string curves.
+
+        :param pvsys: a pvmismatch ``PVsystem``
+        :return: :class:`pvmismatch_batch.MismatchSolution` of the system
+        """
+        memo = {}
+        weights = OrderedDict()
+        for pvstr in pvsys.pvstrs:
+            key = self.string_key(pvstr, memo)
+            weights[key] = weights.get(key, 0) + 1
+        curves = [self.string(key) for key in weights]
+        fwd, _ = pb.unit_points(self.pvconst)
+        Vsys = max(V[0] for _, V in curves) * fwd
+        Isys = np.zeros_like(Vsys)
+        for (I, V), n in zip(curves, weights.values()):
+            Isys += n * pb.interp_rows(Vsys, V[::-1], I[::-1])
+        Imp, Vmp, Pmp = pb.mpp_rows(Isys, Vsys)
+        return pb.MismatchSolution(Imp, Vmp, Pmp, Isys, Vsys)
+
+
+IV_CACHE = IVCurveCache()  # shared by default so repeated runs reuse curves
+
+
+def solve_pvsystem(pvsys, cache=IV_CACHE):
+    """
+    Solve a ``PVsystem`` reusing every IV curve already in ``cache``.
+
+    :param pvsys: a pvmismatch ``PVsystem``
+    :param cache: :class:`IVCurveCache`, shared module-level cache by default
+    :return: :class:`pvmismatch_batch.MismatchSolution`
+    """
+    return cache.solve(pvsys)
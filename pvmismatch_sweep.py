@@ -0,0 +1,127 @@
+# parallel parameter sweeps for pvmismatch degradation/shading studies
+#
+# Every combination of a parameter grid is an independent case, so the cases
+# are fanned out over a process pool and collected into one tidy DataFrame.
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from pvmismatch import pvcell, pvconstants, pvmodule, pvstring
+
+from pvmismatch_system import MismatchPVsystem
+
+# cells shaded by each shading type of an STD72 module
+SHADED_CELLS = {
+    'none': (),
+    'module': tuple(range(72)),  # whole module
+    'diode': tuple(range(24)),  # all cells of one bypass-diode substring
+    'bottom_row': (11, 12, 35, 36, 59, 60),  # bottom row of cells
+}
+# irradiance [suns] of the shaded cells of each shading type, as in the
+# original study: a substring shaded heavily, a row of cells in diffuse light
+SHADED_SUNS = {
+    'none': 1.,
+    'module': 0.2,
+    'diode': 0.001,
+    'bottom_row': 0.2,
+}
+
+
+def parameter_grid(**axes):
+    """
+    All combinations of the given parameter values.
+
+    For Example::
+
+        parameter_grid(numberStrs=[1, 10, 30], shading_type=['diode', 'bottom_row'])
+        # -> [{'numberStrs': 1, 'shading_type': 'diode'}, ...] (6 cases)
+
+    :return: list of keyword dicts, one per case
+    """
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in product(*(axes[k] for k in keys))]
+
+
+def run_case(numberStrs=30, numberMods=21, num_degraded=1, shading_type='none',
+             Rsh=None, shaded_suns=None, Tcell=50. + 273.15):
+    """
+    Mismatch of ``num_degraded`` degraded modules at the start of string 0.
+
+    A degraded module is an STD72 module whose cells have shunt resistance
+    ``Rsh`` (standard cells if None) and whose ``shading_type`` cells get
+    ``shaded_suns`` suns.
+
+    :param shaded_suns: irradiance of the shaded cells [suns],
+        :data:`SHADED_SUNS` of the shading type if None; a grid parameter
+        to sweep the shading level
+
+    :return: dict with the system Pmp before and after degradation, the
+        module-equivalent loss and the mismatch loss [%] on top of the
+        nominal power reduction of the degraded modules
+    """
+    pvconst = pvconstants.PVconstants()
+    cell_std = pvcell.PVcell(pvconst=pvconst)
+    cell_degraded = cell_std if Rsh is None else pvcell.PVcell(Rsh=Rsh, pvconst=pvconst)
+    module_std = pvmodule.PVmodule(cell_pos=pvmodule.STD72, pvcells=[cell_std] * 72)
+    module_degraded = pvmodule.PVmodule(cell_pos=pvmodule.STD72, pvcells=[cell_degraded] * 72)
+    module_std.setTemps(Tcell)
+    module_degraded.setTemps(Tcell)
+    shaded = SHADED_CELLS[shading_type]
+    if shaded:
+        module_degraded.setSuns(SHADED_SUNS[shading_type] if shaded_suns is None else shaded_suns,
+                                shaded)
+
+    string_std = pvstring.PVstring(pvmods=[module_std] * numberMods)
+    string_degraded = pvstring.PVstring(
+        pvmods=[module_degraded] * num_degraded + [module_std] * (numberMods - num_degraded))
+    pvsys_std = MismatchPVsystem(pvstrs=[string_std] * numberStrs)
+    pvsys_degraded = MismatchPVsystem(pvstrs=[string_degraded] + [string_std] * (numberStrs - 1))
+
+    module_power_remaining = max(module_degraded.Pmod) / max(module_std.Pmod)
+    module_equivalent_loss = ((pvsys_std.Pmp - pvsys_degraded.Pmp)
+                              / (pvsys_std.Pmp / (numberStrs * numberMods)))
+    Pnom_reduction = num_degraded * (1 - module_power_remaining)
+    mismatch = (module_equivalent_loss / Pnom_reduction - 1) * 100 if Pnom_reduction else np.nan
+    return {'Pmp_before': pvsys_std.Pmp, 'Pmp': pvsys_degraded.Pmp,
+            'module_power_remaining': module_power_remaining,
+            'module_equivalent_loss': module_equivalent_loss, 'mismatch': mismatch}
+
+
+def _run(args):
+    func, case = args
+    return func(**case)
+
+
+def run_sweep(cases, func=run_case, max_workers=None, chunksize=1):
+    """
+    Run independent cases on a process pool.
+
+    Scripts calling this must guard it with ``if __name__ == '__main__':``
+    so that worker processes do not re-run the script.
+
+    :param cases: list of keyword dicts, e.g. from :func:`parameter_grid`
+    :param func: picklable (module-level) function run with each case's keywords
+    :param max_workers: number of processes, all cores if None; 1 runs serially
+    :param chunksize: number of cases sent to a worker at once
+    :return: tidy frame with one row per case, case parameters then results
+    """
+    jobs = [(func, case) for case in cases]
+    if max_workers == 1:
+        results = list(map(_run, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_run, jobs, chunksize=chunksize))
+    return pd.concat([pd.DataFrame(cases), pd.DataFrame(results)], axis=1)
+
+
+if __name__ == '__main__':
+    # shading effect by type against the number of strings and degraded modules
+    num_strings_list = np.unique(np.logspace(0, np.log10(50), num=10, dtype=int))
+    sweep = run_sweep(parameter_grid(numberStrs=num_strings_list.tolist(), numberMods=[21],
+                                     num_degraded=[1, 5, 21], shading_type=['diode', 'bottom_row'],
+                                     Rsh=[None]))
+    print(sweep)
+    print(sweep.pivot_table(index='numberStrs', columns=['shading_type', 'num_degraded'],
+                            values='mismatch'))
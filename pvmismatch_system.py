@@ -0,0 +1,477 @@
+# PVsystem with equivalence-class compression of identical strings
+#
+# Strings whose modules and cells are in the same state are grouped into one
+# class. Each class's string curve is computed once and the parallel
+# combination adds the class current weighted by the number of strings in
+# it, so the cost scales with the number of distinct strings instead of the
+# total string count.
+#
+# String keys and per-class parallel currents are kept between solves. Only
+# strings marked dirty (by setSuns/setTemps or markDirty) and string objects
+# not seen before are re-inspected, so changing one module re-solves that
+# module, its string and the final parallel combination. The same holds for
+# topology edits (removing or bypassing a module, adding or removing a
+# string), which replace only the affected string.
+
+from collections import OrderedDict
+from copy import copy
+
+import numpy as np
+import pandas as pd
+from pvmismatch import pvstring, pvsystem
+from pvmismatch.pvmismatch_lib.pvconstants import npinterpx
+
+import pvmismatch_batch as pb
+from pvmismatch_cache import IV_CACHE
+
+
+def parallel_voltages(pvconst, Vmax, Vmin):
+    """Voltage points used by ``PVconstants.calcParallel``."""
+    Vreverse = Vmin * pvconst.negpts
+    Vforward = Vmax * pvconst.pts
+    return np.concatenate((Vreverse, Vforward), axis=0).flatten()
+
+
+def calc_parallel_weighted(pvconst, I, V, weights):
+    """
+    Parallel combination of IV curves, each counted ``weights`` times.
+
+    Same voltage points as ``PVconstants.calcParallel``, so the result equals
+    ``calcParallel`` on the expanded list of curves.
+
+    :param pvconst: pvmismatch constants
+    :param I: currents of each distinct curve [A]
+    :param V: voltages of each distinct curve, increasing [V]
+    :param weights: number of copies of each curve in parallel
+    :return: current [A] and voltage [V] of the parallel combination
+    """
+    Vtot = parallel_voltages(pvconst, max(np.max(v) for v in V), min(np.min(v) for v in V))
+    Itot = np.zeros((2 * pvconst.npts,))
+    for i, v, n in zip(I, V, weights):
+        Itot += n * npinterpx(Vtot, np.ravel(v), np.ravel(i))
+    return Itot, Vtot
+
+
+def copy_string(pvstr):
+    """
+    Copy of a ``PVstring`` with its own module objects.
+
+    Modules that appear more than once in the string stay one object. The
+    copies are shallow, pvmismatch copies cells and modules before changing
+    them.
+    """
+    new_pvmods = {}
+    for pvmod in pvstr.pvmods:
+        if id(pvmod) not in new_pvmods:
+            new_pvmods[id(pvmod)] = copy(pvmod)
+    new_pvstr = copy(pvstr)
+    new_pvstr.pvmods = [new_pvmods[id(pvmod)] for pvmod in pvstr.pvmods]
+    return new_pvstr
+
+
+class MismatchPVsystem(pvsystem.PVsystem):
+    """
+    A ``PVsystem`` that solves each class of identical strings once.
+
+    Takes the same arguments as :class:`pvmismatch.pvsystem.PVsystem`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._memo = {}  # id -> (object, key) of strings and modules seen in the last solve
+        self._mod_ids = {}  # module state key -> module number used in string keys
+        self._next_mod_id = 0
+        self._dirty = set()  # indices of strings to re-inspect on the next solve
+        self._Vtot = None  # voltage points of the last parallel combination
+        self._contrib = {}  # string class key -> class current on _Vtot
+        super(MismatchPVsystem, self).__init__(*args, **kwargs)
+
+    def markDirty(self, strs=None):
+        """
+        Force strings to be re-inspected on the next solve.
+
+        Only needed after changing cells or modules in place, e.g. with
+        ``pvsys.pvmods[0][0].setSuns(...)`` instead of ``pvsys.setSuns(...)``.
+
+        :param strs: string indices, or None for all strings
+        """
+        if strs is None:
+            self._memo.clear()
+            self._contrib.clear()
+        else:
+            strs = [int(s) for s in strs]
+            self._dirty.update(strs)
+            # modules changed in place keep their id, so forget their keys too
+            for s in strs:
+                for pvmod in self.pvstrs[s].pvmods:
+                    self._memo.pop(id(pvmod), None)
+
+    def _moduleId(self, pvmod, memo, cell_memo):
+        entry = memo.get(id(pvmod)) or self._memo.get(id(pvmod))
+        if entry is None or entry[0] is not pvmod:
+            mod_key = IV_CACHE.module_key(pvmod, cell_memo)
+            if mod_key not in self._mod_ids:
+                self._mod_ids[mod_key] = self._next_mod_id
+                self._next_mod_id += 1
+            entry = (pvmod, self._mod_ids[mod_key])
+        memo[id(pvmod)] = entry
+        return entry[1]
+
+    def stringClasses(self):
+        """
+        Group strings with identical module and cell states.
+
+        The first string of a class is solved for the whole class, the
+        strings themselves are left alone, so members that are distinct
+        objects stay distinct and can still be changed in place. Keys of
+        clean strings are reused from the last call.
+
+        :return: ordered dict of class key to list of string indices
+        """
+        classes = OrderedDict()
+        memo, cell_memo = {}, {}
+        for idx, pvstr in enumerate(self.pvstrs):
+            entry = memo.get(id(pvstr))
+            if entry is None and idx not in self._dirty:
+                entry = self._memo.get(id(pvstr))
+            if entry is None or entry[0] is not pvstr:
+                mods = [self._moduleId(pvmod, memo, cell_memo) for pvmod in pvstr.pvmods]
+                entry = (pvstr, tuple(sorted(mods)))
+            elif id(pvstr) not in memo:
+                # keep the module entries of clean strings for later copies
+                for pvmod in pvstr.pvmods:
+                    if id(pvmod) in self._memo:
+                        memo[id(pvmod)] = self._memo[id(pvmod)]
+            memo[id(pvstr)] = entry
+            classes.setdefault(entry[1], []).append(idx)
+        # forget modules that are no longer in the system
+        used = set(entry[1] for entry in memo.values() if isinstance(entry[1], int))
+        self._mod_ids = {k: v for k, v in self._mod_ids.items() if v in used}
+        self._memo = memo
+        self._dirty.clear()
+        return classes
+
+    def calcSystem(self):
+        """
+        Calculate system I-V curves from one string curve per class.
+
+        Class currents are reused from the last solve while the parallel
+        voltage points stay the same.
+
+        Returns (Isys, Vsys, Psys) : tuple of numpy.ndarray of float
+        """
+        self._classes = self.stringClasses()
+        reps = OrderedDict((key, self.pvstrs[idx[0]]) for key, idx in self._classes.items())
+        Vmax = max(pvstr.Vstring.max() for pvstr in reps.values())
+        Vmin = min(pvstr.Vstring.min() for pvstr in reps.values())
+        Vtot = parallel_voltages(self.pvconst, Vmax, Vmin)
+        if self._Vtot is None or not np.array_equal(Vtot, self._Vtot):
+            self._Vtot = Vtot
+            self._contrib = {}
+        contrib = {}
+        for key, pvstr in reps.items():
+            if key not in self._contrib:
+                self._contrib[key] = npinterpx(Vtot, np.ravel(pvstr.Vstring), np.ravel(pvstr.Istring))
+            contrib[key] = self._contrib[key]
+        self._contrib = contrib
+        Isys = np.zeros((2 * self.pvconst.npts,))
+        for key, idx in self._classes.items():
+            Isys += len(idx) * contrib[key]
+        Vsys = Vtot.copy()
+        Psys = Isys * Vsys
+        return Isys, Vsys, Psys
+
+    def calcMPP_IscVocFFeff(self):
+        # same as PVsystem.calcMPP_IscVocFFeff, but the total irradiance is
+        # summed once per string class instead of once per module
+        mpp = np.argmax(self.Psys)
+        P = self.Psys[mpp - 1:mpp + 2]
+        V = self.Vsys[mpp - 1:mpp + 2]
+        I = self.Isys[mpp - 1:mpp + 2]
+        # calculate derivative dP/dV using central difference
+        dP = np.diff(P, axis=0)
+        dV = np.diff(V, axis=0)
+        Pv = dP / dV
+        # dP/dV is central difference at midpoints,
+        Vmid = (V[1:] + V[:-1]) / 2.0
+        Imid = (I[1:] + I[:-1]) / 2.0
+        # interpolate to find Vmp
+        Vmp = (-Pv[0] * np.diff(Vmid, axis=0) / np.diff(Pv, axis=0) + Vmid[0]).item()
+        Imp = (-Pv[0] * np.diff(Imid, axis=0) / np.diff(Pv, axis=0) + Imid[0]).item()
+        # calculate max power at Pv = 0
+        Pmp = Imp * Vmp
+        # calculate Voc, current must be increasing so flipup()
+        Voc = np.interp(np.float64(0), np.flipud(self.Isys), np.flipud(self.Vsys))
+        Isc = np.interp(np.float64(0), self.Vsys, self.Isys)  # calculate Isc
+        FF = Pmp / Isc / Voc
+        totalSuns = sum(
+            len(idx) * sum(pvmod.Ee.sum() * pvmod.cellArea for pvmod in self.pvstrs[idx[0]].pvmods)
+            for idx in self._classes.values()
+        )
+        # convert cellArea from cm^2 to m^2
+        Psun = self.pvconst.E0 * totalSuns / 100 / 100
+        eff = Pmp / Psun
+        return Imp, Vmp, Pmp, Isc, Voc, FF, eff
+
+    def calcOperatingPoints(self, Vsys=None):
+        """
+        Operating point of every string and module at a system voltage.
+
+        Strings are evaluated once per class and modules once per distinct
+        module of each class, all in one row-wise interpolation per level.
+        The mismatch loss is the power a string or module gives up by not
+        running at its own maximum power point. ``Pmp`` is the maximum of
+        the same piecewise-linear curve the operating point is read from
+        (:func:`~pvmismatch_batch.curve_pmp`), so the loss is never negative.
+
+        For Example::
+
+            strings, modules = pvsys.calcOperatingPoints()
+            strings.loc[0, 'P']  # power of string 0 at the system Vmp
+            modules.loc[(0, 3), 'mismatch_loss']  # loss of module 3 in string 0
+
+        :param Vsys: system voltage [V], defaults to ``Vmp``
+        :return: ``(strings, modules)`` frames with columns ``I``, ``V``,
+            ``P``, ``Pmp`` and ``mismatch_loss``, indexed by string and by
+            (string, module)
+        """
+        Vsys = self.Vmp if Vsys is None else float(Vsys)
+        classes = list(self._classes.values())
+        reps = [self.pvstrs[idx[0]] for idx in classes]
+        # strings: current at Vsys on each class curve
+        Vstr = np.array([np.ravel(pvstr.Vstring) for pvstr in reps])
+        Istr = np.array([np.ravel(pvstr.Istring) for pvstr in reps])
+        Iop = pb.interp_rows(np.full((len(reps), 1), Vsys), Vstr, Istr)[:, 0]
+        Pmp_str = pb.curve_pmp(Istr, Vstr)
+        # modules: voltage at the string current on each distinct module curve
+        mod_rows, pvmods, nmods = {}, [], []
+        rows = []  # distinct module row of every module position of every class
+        for pvstr in reps:
+            for pvmod in pvstr.pvmods:
+                rows.append(mod_rows.setdefault(id(pvmod), len(pvmods)))
+                if rows[-1] == len(pvmods):
+                    pvmods.append(pvmod)
+            nmods.append(len(pvstr.pvmods))
+        rows = np.array(rows)
+        mod_class = np.repeat(np.arange(len(reps)), nmods)
+        Imod = np.array([np.ravel(pvmod.Imod)[::-1] for pvmod in pvmods])
+        Vmod = np.array([np.ravel(pvmod.Vmod)[::-1] for pvmod in pvmods])
+        Vop = pb.interp_rows(Iop[mod_class, None], Imod[rows], Vmod[rows])[:, 0]
+        Pmp_mod = pb.curve_pmp(Imod, Vmod)[rows]
+        # expand classes to strings and module positions
+        str_class = np.empty(self.numberStrs, dtype=int)
+        for c, idx in enumerate(classes):
+            str_class[idx] = c
+        starts = np.concatenate(([0], np.cumsum(nmods)[:-1]))
+        str_nmods = np.asarray(nmods)[str_class]
+        mod_pos = np.arange(str_nmods.sum()) - np.repeat(np.cumsum(str_nmods) - str_nmods, str_nmods)
+        mod_idx = np.repeat(starts[str_class], str_nmods) + mod_pos
+        P = Iop * Vsys
+        strings = pd.DataFrame({
+            'I': Iop[str_class], 'V': Vsys, 'P': P[str_class], 'Pmp': Pmp_str[str_class],
+            'mismatch_loss': (Pmp_str - P)[str_class],
+        }, index=pd.RangeIndex(self.numberStrs, name='string'))
+        Imods = Iop[mod_class][mod_idx]
+        Pmods = Imods * Vop[mod_idx]
+        modules = pd.DataFrame({
+            'I': Imods, 'V': Vop[mod_idx], 'P': Pmods, 'Pmp': Pmp_mod[mod_idx],
+            'mismatch_loss': Pmp_mod[mod_idx] - Pmods,
+        }, index=pd.MultiIndex.from_arrays(
+            [np.repeat(np.arange(self.numberStrs), str_nmods), mod_pos], names=['string', 'module']))
+        return strings, modules
+
+    def _setClasses(self, method, value):
+        """
+        Apply a scalar setSuns/setTemps once per string class.
+
+        Strings that were one object stay one object, every other member of
+        a class gets its own copy of the updated string and its modules.
+        """
+        new_pvstrs = {}  # id of an old string -> updated string
+        for key, idx in self.stringClasses().items():
+            pvstr = copy(self.pvstrs[idx[0]])
+            getattr(pvstr, method)(value)
+            olds = OrderedDict.fromkeys(id(self.pvstrs[i]) for i in idx)
+            for n, old in enumerate(olds):
+                new_pvstrs[old] = pvstr if n == 0 else copy_string(pvstr)
+        self.pvstrs = [new_pvstrs[id(pvstr)] for pvstr in self.pvstrs]
+
+    def setSuns(self, Ee):
+        if np.isscalar(Ee):
+            self._setClasses('setSuns', Ee)
+            self.update()
+        else:
+            self._dirty.update(int(pvstr) for pvstr in Ee)
+            super(MismatchPVsystem, self).setSuns(Ee)
+    setSuns.__doc__ = pvsystem.PVsystem.setSuns.__doc__
+
+    def setTemps(self, Tc):
+        if np.isscalar(Tc):
+            self._setClasses('setTemps', Tc)
+            self.update()
+        else:
+            self._dirty.update(int(pvstr) for pvstr in Tc)
+            super(MismatchPVsystem, self).setTemps(Tc)
+    setTemps.__doc__ = pvsystem.PVsystem.setTemps.__doc__
+
+    # --- topology edits
+
+    def _replaceModules(self, s, pvmods):
+        """Swap in a copy of string ``s`` with new modules and re-solve."""
+        pvstr = copy(self.pvstrs[s])
+        pvstr.pvmods = pvmods
+        pvstr.numberMods = len(pvmods)
+        pvstr.Istring, pvstr.Vstring, pvstr.Pstring = pvstr.calcString()
+        self.pvstrs[s] = pvstr
+        self.numberMods[s] = pvstr.numberMods
+        self._dirty.add(s)
+        self.update()
+
+    def removeModule(self, s, m):
+        """
+        Remove module ``m`` from string ``s``, e.g. a module taken out for repair.
+
+        Only string ``s`` and the parallel combination are re-solved.
+        """
+        pvmods = list(self.pvstrs[s].pvmods)
+        if len(pvmods) == 1:
+            raise ValueError('cannot remove the last module of a string, use removeString')
+        del pvmods[m]
+        self._replaceModules(s, pvmods)
+
+    def bypassModule(self, s, m):
+        """
+        Bypass module ``m`` of string ``s``, e.g. a module with a failed junction box.
+
+        The module is kept in the string as a dark module, so its bypass
+        diodes carry the string current.
+        """
+        pvmods = list(self.pvstrs[s].pvmods)
+        pvmod = copy(pvmods[m])
+        pvmod.setSuns(pb.MIN_SUNS)
+        pvmods[m] = pvmod
+        self._replaceModules(s, pvmods)
+
+    def addString(self, pvstr=None):
+        """
+        Add a string in parallel.
+
+        :param pvstr: ``PVstring`` with the same ``pvconst`` as the system,
+            defaults to a copy of the first string's modules
+        """
+        if pvstr is None:
+            pvstr = pvstring.PVstring(pvmods=list(self.pvstrs[0].pvmods))
+        elif pvstr.pvconst is not self.pvconst:
+            raise Exception('pvconst must be the same for all strings')
+        self.pvstrs.append(pvstr)
+        self.numberStrs += 1
+        self.numberMods.append(len(pvstr.pvmods))
+        self._dirty.add(self.numberStrs - 1)
+        self.update()
+
+    def removeString(self, s):
+        """Remove string ``s``, e.g. a string with a blown fuse."""
+        if self.numberStrs == 1:
+            raise ValueError('cannot remove the last string of a system')
+        del self.pvstrs[s]
+        del self.numberMods[s]
+        self.numberStrs -= 1
+        # strings after s moved down one position
+        self._dirty = set(i - (i > s) for i in self._dirty if i != s)
+        self.update()
+
+    def _cellArrayIndices(self, values, name):
+        """
+        Validate a bulk cell array once and return its set entries.
+
+        :return: string, module and cell indices and values of the entries to set
+        """
+        ncells = max(pvmod.numberCells for pvstr in set(self.pvstrs) for pvmod in pvstr.pvmods)
+        shape = (self.numberStrs, max(self.numberMods), ncells)
+        if isinstance(values, tuple):
+            # sparse: (indices, values) with indices like the output of np.nonzero
+            idx, vals = values
+            strs, mods, cells = (np.asarray(i, dtype=int).ravel() for i in idx)
+            vals = np.broadcast_to(np.asarray(vals, dtype=float), strs.shape)
+            if np.any(strs < 0) or np.any(mods < 0) or np.any(cells < 0):
+                raise IndexError('%s indices must not be negative' % name)
+        else:
+            # dense: NaN or masked entries are left unchanged
+            values = np.ma.masked_invalid(np.ma.asanyarray(values, dtype=float))
+            if values.shape != shape:
+                raise ValueError('%s must have shape (strings, modules, cells) = %r, got %r'
+                                 % (name, shape, values.shape))
+            strs, mods, cells = np.nonzero(~np.ma.getmaskarray(values))
+            vals = values.data[strs, mods, cells]
+        if not np.all(np.isfinite(vals)) or np.any(vals < 0):
+            raise ValueError('%s must be finite and not negative' % name)
+        if np.any(strs >= self.numberStrs):
+            raise IndexError('string index out of range in %s' % name)
+        if np.any(mods >= np.asarray(self.numberMods)[strs]):
+            raise IndexError('module index out of range in %s' % name)
+        return strs, mods, cells, vals
+
+    def _setCellArray(self, method, values, name):
+        """Apply a bulk cell array with one module update per distinct change."""
+        strs, mods, cells, vals = self._cellArrayIndices(values, name)
+        order = np.lexsort((cells, mods, strs))
+        strs, mods, cells, vals = strs[order], mods[order], cells[order], vals[order]
+        starts = np.flatnonzero(np.diff(strs * max(self.numberMods) + mods, prepend=-1))
+        new_pvmods = {}  # (old module, change) -> updated module, shared between positions
+        new_strs = {}  # string index -> {module index: updated module}
+        for a, b in zip(starts, np.append(starts[1:], strs.size)):
+            s, m = int(strs[a]), int(mods[a])
+            pvmod = self.pvstrs[s].pvmods[m]
+            if cells[b - 1] >= pvmod.numberCells:
+                raise IndexError('cell index out of range in %s' % name)
+            key = (id(pvmod), tuple(cells[a:b]), tuple(vals[a:b]))
+            if key not in new_pvmods:
+                new_pvmod = copy(pvmod)
+                getattr(new_pvmod, method)(vals[a:b], cells[a:b])
+                new_pvmods[key] = (pvmod, new_pvmod)
+            new_strs.setdefault(s, {})[m] = new_pvmods[key][1]
+        # strings getting the same updates on the same string object are rebuilt once
+        rebuilt = {}
+        for s, changes in new_strs.items():
+            pvstr = self.pvstrs[s]
+            key = (id(pvstr),) + tuple((m, id(pvmod)) for m, pvmod in sorted(changes.items()))
+            if key not in rebuilt:
+                new_pvstr = copy(pvstr)
+                new_pvstr.pvmods = list(pvstr.pvmods)
+                for m, pvmod in changes.items():
+                    new_pvstr.pvmods[m] = pvmod
+                new_pvstr.Istring, new_pvstr.Vstring, new_pvstr.Pstring = new_pvstr.calcString()
+                rebuilt[key] = (pvstr, new_pvstr)
+            self.pvstrs[s] = rebuilt[key][1]
+        self._dirty.update(new_strs)
+        self.update()
+
+    def setSunsArray(self, Ee):
+        """
+        Set irradiance on any number of cells in one call.
+
+        The array is validated once, every distinct module change is computed
+        once and the system is solved once.
+
+        :param Ee: irradiance [suns], either a dense array shaped
+            (strings, modules, cells) in which NaN or masked entries are left
+            unchanged, or a sparse ``(indices, values)`` tuple where
+            ``indices`` are the string, module and cell index arrays (like the
+            output of ``np.nonzero``) and ``values`` a scalar or one value per
+            index
+
+        For Example::
+
+            Ee = np.full((30, 21, 96), np.nan)
+            Ee[0, :5, [11, 12]] = 0.2  # shade 2 cells of the first 5 modules of string 0
+            pvsys.setSunsArray(Ee)
+            pvsys.setSunsArray(((strs, mods, cells), 0.2))  # same, sparse
+        """
+        self._setCellArray('setSuns', Ee, 'Ee')
+
+    def setTempsArray(self, Tc):
+        """
+        Set temperature on any number of cells in one call.
+
+        :param Tc: temperature [K], dense or sparse as in :meth:`setSunsArray`
+        """
+        self._setCellArray('setTemps', Tc, 'Tc')
@@ -13,6 +13,14 @@ from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
 
+import pvlib
+from pvlib.location import Location
+
+from pvmismatch_cache import IV_CACHE, solve_pvsystem
+from pvmismatch_system import MismatchPVsystem
+from row_shading import cell_masks, run_row_shading_from_poa, shaded_fraction
+from solar_cache import get_clearsky, get_solarposition
+
 # --- Simple system creation and IV curve plotting
 pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21)
 # plt.ion()  # commented out as interactive plotting is not supported in PyCharm Community Edition
@@ -79,16 +87,18 @@ num_degraded_modules = 21
 # if shading_type = 'bottom_row', cells near the bottom of a module shaded with diffuse light (20%)
 shading_type = 'bottom_row'
 diffuse_fraction = 0.2
-pvsys = pvsystem.PVsystem(numberStrs=numberStrs, numberMods=numberMods, pvmods=pvmodule.PVmodule(cell_pos=pvmodule.STD72))
+# identical strings are solved once per class, so only string 0 and the other 199 are computed
+pvsys = MismatchPVsystem(numberStrs=numberStrs, numberMods=numberMods, pvmods=pvmodule.PVmodule(cell_pos=pvmodule.STD72))
 pvsys.setTemps(50. + 273.15)
 before_shade = pvsys.Pmp
 
-# Apply shading
-for n in range(num_degraded_modules):
-    if shading_type == 'diode':
-        pvsys.setSuns({0: {n: [(0.001,) * 24, tuple(range(24))]}})
-    elif shading_type == 'bottom_row':
-        pvsys.setSuns({0: {n: [(diffuse_fraction,) * 6, (11, 12, 35, 36, 59, 60)]}})
+# Apply shading to the first num_degraded_modules of string 0 in one bulk call (NaN = unchanged)
+Ee = np.full((numberStrs, numberMods, 72), np.nan)
+if shading_type == 'diode':
+    Ee[np.ix_([0], range(num_degraded_modules), range(24))] = 0.001
+elif shading_type == 'bottom_row':
+    Ee[np.ix_([0], range(num_degraded_modules), (11, 12, 35, 36, 59, 60))] = diffuse_fraction
+pvsys.setSunsArray(Ee)
 
 after_shade = pvsys.Pmp
 f_shade = pvsys.plotSys()
@@ -104,6 +114,33 @@ print(f'Mismatch: {(module_equivalent_loss/num_degraded_modules)/Pnom_reduction
 print(f'{module_equivalent_loss/num_degraded_modules=}')
 
 
+# --- Row-to-row shading from the sun position instead of hand-picked cells
+# 45 degree north facing rows of one STD72 module (portrait) at 4 m pitch in
+# Kalkbult; the first 3 strings are the front row, which is never shaded
+location = Location(latitude=-30.09318567206943, longitude=24.13940478600872, tz='Africa/Johannesburg',
+                    altitude=1400, name='Kalkbult')
+times = pd.date_range('2021-01-01', '2022-01-01', freq='h', tz=location.tz, inclusive='left')
+solar_pos = get_solarposition(location, times)
+clear_sky = get_clearsky(location, times)
+poa = pvlib.irradiance.get_total_irradiance(45, 0, solar_pos['apparent_zenith'], solar_pos['azimuth'],
+                                           clear_sky['dni'], clear_sky['ghi'], clear_sky['dhi'])
+poa = poa.fillna(0.).assign(temp_air=20., wind_speed=1.)
+
+row_shade = shaded_fraction(solar_pos['apparent_zenith'], solar_pos['azimuth'], 45, 0, pitch=4.)
+masks = cell_masks(row_shade, pvmodule.STD72)  # (hours, modules along the slant, cells)
+print('\nRow-to-row shading')
+print(f'Hours with shade: {(row_shade > 0).sum()}')
+print(f'Hours the bottom_row cells are fully shaded: {(masks[:, 0, (11, 12, 35, 36, 59, 60)] == 1).all(axis=1).sum()}')
+
+pvsys_rows = pvsystem.PVsystem(numberStrs=30, numberMods=21, pvmods=pvmodule.PVmodule(cell_pos=pvmodule.STD72))
+positions = np.zeros((30, 21), dtype=int)
+positions[:3] = -1
+dc_shaded = run_row_shading_from_poa(pvsys_rows, positions, poa, solar_pos, 45, 0, pitch=4.)
+dc_unshaded = run_row_shading_from_poa(pvsys_rows, np.full((30, 21), -1), poa, solar_pos, 45, 0,
+                                       pitch=4.)
+print(f'Annual row shading loss: {1 - dc_shaded.p_mp.sum() / dc_unshaded.p_mp.sum():.4f}')
+
+
 # --- Module and cell visualization
 f_mod00 = pvsys.pvmods[0][0].plotMod()
 f_modd00_cells = pvsys.pvmods[0][0].plotCell()
@@ -189,8 +226,8 @@ for num_strings in num_strings_list:
     else:
         string_degraded = pvstring.PVstring(pvmods=modules_list)
 
-    pvsys_std = pvsystem.PVsystem(pvstrs=[string_std]*num_strings)
-    pvsys_degraded = pvsystem.PVsystem(pvstrs=[string_degraded]*num_degraded_strings + [string_std]*(num_strings - num_degraded_strings))
+    pvsys_std = MismatchPVsystem(pvstrs=[string_std]*num_strings)
+    pvsys_degraded = MismatchPVsystem(pvstrs=[string_degraded]*num_degraded_strings + [string_std]*(num_strings - num_degraded_strings))
 
     pvsys_std.setTemps(50. + 273.15)
     pvsys_degraded.setTemps(50. + 273.15)
@@ -210,12 +247,19 @@ fig, ax = plt.subplots()
 ax.plot(num_strings_list, results)
 ax.set(xlabel='Number of strings', ylabel='Mismatch [%]')
 
-# String power estimation at Vmp for degraded string (index 0)
+# Same systems from the shared IV-curve cache, each distinct module/string curve is computed once
+print(f'{float(solve_pvsystem(pvsys_std).Pmp)=}')
+print(f'{float(solve_pvsystem(pvsys_degraded).Pmp)=}')
+print(IV_CACHE.cache_info())
+
+# Operating point and mismatch loss of every string and module at the system Vmp
+strings_op, modules_op = pvsys_degraded.calcOperatingPoints()
 string_index = 0
-string_power = np.interp(pvsys_degraded.Vmp, pvsys_degraded.pvstrs[string_index].Vstring, pvsys_degraded.pvstrs[string_index].Pstring)
+string_power = strings_op.loc[string_index, 'P']
+print(modules_op.loc[string_index].head())
 
 
-# --- Simulate removal of modules by reconstructing the system
+# --- Simulate removal of modules by editing the system in place
 num_modules_per_string = 21
 num_strings = 30
 num_missing_modules = 1
@@ -227,28 +271,18 @@ module_std = pvmodule.PVmodule(cell_pos=pvmodule.STD72, pvcells=[cell_std]*72)
 
 # Full system with all modules
 full_string = pvstring.PVstring(pvmods=[module_std] * num_modules_per_string)
-pvsys_full = pvsystem.PVsystem(pvstrs=[full_string] * num_strings)
+pvsys_full = MismatchPVsystem(pvstrs=[full_string] * num_strings)
 pvsys_full.setTemps(50. + 273.15)
 
 power_per_module_std = pvsys_full.Pmp / nom_modules_total
 
-# Build degraded system with some strings missing modules
-pvstrs_degraded = []
-
-for i in range(num_strings):
-    if i < num_strings_with_missing_modules:
-        # Create strings with missing modules
-        pvstrs_degraded.append(pvstring.PVstring(
-            pvmods=[module_std] * (num_modules_per_string - num_missing_modules)
-        ))
-    else:
-        # Normal strings
-        pvstrs_degraded.append(pvstring.PVstring(
-            pvmods=[module_std] * num_modules_per_string
-        ))
-
-pvsys_degraded = pvsystem.PVsystem(pvstrs=pvstrs_degraded)
+# Remove modules from some strings of a second system, only the edited
+# strings are re-solved
+pvsys_degraded = MismatchPVsystem(pvstrs=[full_string] * num_strings)
 pvsys_degraded.setTemps(50. + 273.15)
+for i in range(num_strings_with_missing_modules):
+    for _ in range(num_missing_modules):
+        pvsys_degraded.removeModule(i, 0)
 
 # Use full array module count for consistent comparison
 power_per_module_degraded = pvsys_degraded.Pmp / nom_modules_total
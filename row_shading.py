@@ -0,0 +1,264 @@
+# row-to-row shading of fixed-tilt rows, down to the cells
+#
+# The row in front shades a band along the bottom edge of a row whenever the
+# sun is low in front of it. The height of that band is the 1-D shaded
+# fraction of Anderson & Jensen (pvlib.shading.shaded_fraction1d), a fixed
+# tilt row being a tracker rotated by its tilt around an axis perpendicular
+# to its azimuth. Along the slant a row has ``mods_high`` modules, each with
+# the cell rows of its cell_pos layout (12 for STD72 and STD96 in portrait,
+# the columns in landscape), so every cell falls in one slant band and all
+# cells of a band see the same shade. Everything is computed on arrays of
+# shape (T, bands), vectorized over time and modules.
+#
+# The masks drive the batched engine of pvmismatch_batch directly: the cells
+# of a band are one cell type of a SystemLayout whose irradiance is the
+# diffuse irradiance plus the unshaded part of the direct irradiance.
+
+import numpy as np
+import pandas as pd
+import pvlib
+from pvmismatch import pvmodule
+
+import pvmismatch_batch as pb
+
+MODULE_HEIGHT = 1.96  # [m] slant length of a module, STD72 in portrait
+PORTRAIT = 'portrait'  # cell columns along the slant, cell rows across
+LANDSCAPE = 'landscape'  # cell rows along the slant, the first column at the bottom
+
+
+def slant_positions(cell_pos=pvmodule.STD72, orientation=PORTRAIT):
+    """
+    Position of every cell along the slant of a module.
+
+    :param cell_pos: pvmismatch cell layout, e.g. ``pvmodule.STD72`` or ``pvmodule.STD96``
+    :param orientation: :data:`PORTRAIT` or :data:`LANDSCAPE`
+    :return: ``(slant, nslant)``, the slant band of every cell index counted
+        from the bottom edge of the module, shape (ncells,), and the number of
+        bands
+    """
+    cells = [(icol, irow, cell['idx'])
+             for icol, col in enumerate(col for substr in cell_pos for col in substr)
+             for irow, cell in enumerate(col)]
+    ncols = max(c[0] for c in cells) + 1
+    nrows = max(c[1] for c in cells) + 1
+    slant = np.empty(len(cells), dtype=np.int64)
+    for icol, irow, idx in cells:
+        # row 0 of a column is the top of a module in portrait
+        slant[idx] = nrows - 1 - irow if orientation == PORTRAIT else icol
+    return slant, nrows if orientation == PORTRAIT else ncols
+
+
+def shaded_fraction(solar_zenith, solar_azimuth, surface_tilt, surface_azimuth, pitch,
+                    collector_width=MODULE_HEIGHT, cross_axis_slope=0.):
+    """
+    Fraction of the slant of a fixed-tilt row shaded by the row in front.
+
+    :param solar_zenith: apparent solar zenith [deg], shape (T,)
+    :param solar_azimuth: solar azimuth [deg], shape (T,)
+    :param surface_tilt: tilt of the rows [deg]
+    :param surface_azimuth: azimuth the rows face [deg], pvlib convention
+    :param pitch: distance between rows [m]
+    :param collector_width: slant length of a row [m]
+    :param cross_axis_slope: ground slope perpendicular to the rows [deg]
+    :return: shaded fraction from the bottom edge, 0 when the sun is below
+        the horizon or behind the rows, shape (T,)
+    """
+    solar_zenith = np.asarray(solar_zenith, dtype=float)
+    solar_azimuth = np.asarray(solar_azimuth, dtype=float)
+    fraction = pvlib.shading.shaded_fraction1d(
+        solar_zenith, solar_azimuth, (surface_azimuth - 90.) % 360., surface_tilt,
+        collector_width=collector_width, pitch=pitch, cross_axis_slope=cross_axis_slope)
+    aoi = pvlib.irradiance.aoi(surface_tilt, surface_azimuth, solar_zenith, solar_azimuth)
+    lit = (solar_zenith < 90.) & (aoi < 90.)
+    return np.where(lit, np.nan_to_num(fraction), 0.)
+
+
+def band_fractions(fraction, nslant, mods_high=1):
+    """
+    Shaded fraction of every slant band of a row.
+
+    :param fraction: shaded fraction of the row from :func:`shaded_fraction`, shape (T,)
+    :param nslant: number of bands of a module, see :func:`slant_positions`
+    :param mods_high: number of modules along the slant of a row
+    :return: shape (T, mods_high * nslant), band ``k * nslant + s`` is band
+        ``s`` of the ``k``-th module from the bottom
+    """
+    height = np.asarray(fraction, dtype=float)[:, None] * (mods_high * nslant)
+    return np.clip(height - np.arange(mods_high * nslant), 0., 1.)
+
+
+def cell_masks(fraction, cell_pos=pvmodule.STD72, mods_high=1, orientation=PORTRAIT):
+    """
+    Shaded fraction of every cell of the modules of a row.
+
+    For Example, to compare with the ``'bottom_row'`` cells of pvmismatch_sweep::
+
+        masks = cell_masks(shaded_fraction(zenith, azimuth, 30, 0, pitch=4.))
+        masks[:, 0, (11, 12, 35, 36, 59, 60)]  # bottom cell row, shaded first
+
+    :param fraction: shaded fraction of the row from :func:`shaded_fraction`, shape (T,)
+    :return: shape (T, mods_high, ncells), module 0 at the bottom of the row
+    """
+    slant, nslant = slant_positions(cell_pos, orientation)
+    bands = band_fractions(fraction, nslant, mods_high)
+    return bands[:, np.arange(mods_high)[:, None] * nslant + slant]
+
+
+def shaded_layout(pvsys, positions, mods_high=1, orientation=PORTRAIT):
+    """
+    Layout of a system whose cells are grouped by slant band.
+
+    The wiring of strings is free: ``positions`` gives the place of every
+    module in the rows, e.g. strings running along the lower and upper
+    module of 2-high rows, or the unshaded front row.
+
+    :param pvsys: a pvmismatch ``PVsystem``, only its cell parameters, cell
+        layout, bypass diodes and wiring are used
+    :param positions: module position along the slant of a row (0 at the
+        bottom), -1 for modules that are never shaded, shape
+        (numberStrs, numberMods)
+    :return: ``(layout, bands)``, the :class:`~pvmismatch_batch.SystemLayout`
+        and the band of every cell type, an index into the columns of
+        :func:`band_fractions` or -1 for unshaded cells, shape (K,)
+    """
+    cell_types, sub_types, mod_types, str_types = {}, {}, {}, {}
+    mod_memo = {}
+
+    def index(types, key):
+        return types.setdefault(key, len(types))
+
+    for pvstr, str_positions in zip(pvsys.pvstrs, positions):
+        mods = []
+        for pvmod, position in zip(pvstr.pvmods, str_positions):
+            memo_key = (id(pvmod), int(position))
+            if memo_key not in mod_memo:
+                slant, nslant = slant_positions(pvmod.cell_pos, orientation)
+                sub_vbypass, mod_vbypass = pb._module_bypass(pvmod)
+                subs = []
+                for idx, vb in zip(pb._module_substrings(pvmod), sub_vbypass):
+                    cells = [index(cell_types,
+                                   (pb.cell_params(pvmod.pvcells[i]),
+                                    -1 if position < 0 else position * nslant + slant[i]))
+                             for i in idx]
+                    counts = np.bincount(cells)
+                    subs.append(index(sub_types, (
+                        tuple((c, n) for c, n in enumerate(counts) if n), vb)))
+                counts = np.bincount(subs)
+                mod_memo[memo_key] = index(mod_types, (
+                    tuple((s, n) for s, n in enumerate(counts) if n), mod_vbypass))
+            mods.append(mod_memo[memo_key])
+        counts = np.bincount(mods)
+        key = tuple((m, n) for m, n in enumerate(counts) if n)
+        str_types[key] = str_types.get(key, 0) + 1
+
+    cells, subs, mods = list(cell_types), list(sub_types), list(mod_types)
+    layout = pb.SystemLayout(
+        cell_params=np.array([c[0] for c in cells]).reshape(-1, len(pb.CELL_PARAMS)),
+        cell_suns=np.ones(len(cells)),
+        cell_temps=np.full(len(cells), 298.15),
+        sub_counts=pb._counts([s[0] for s in subs], len(cells)),
+        sub_vbypass=np.array([s[1] for s in subs]),
+        mod_counts=pb._counts([m[0] for m in mods], len(subs)),
+        mod_vbypass=np.array([m[1] for m in mods]),
+        str_counts=pb._counts(list(str_types), len(mods)),
+        str_weights=np.array(list(str_types.values()), dtype=float),
+    )
+    return layout, np.array([c[1] for c in cells])
+
+
+def run_row_shading(layout, bands, fractions, poa_direct, poa_diffuse, temps, min_suns=1e-3,
+                    chunksize=744, pvconst=pb.PVCONST, npts=None):
+    """
+    System maximum power point under row-to-row shading for every timestep.
+
+    Shaded cells keep the diffuse irradiance and lose the direct irradiance
+    on their shaded fraction.
+
+    For Example, 30 strings of 21 modules, one module high, the first 3
+    strings in the front row::
+
+        positions = np.zeros((30, 21), dtype=int)
+        positions[:3] = -1
+        layout, bands = shaded_layout(pvsys, positions)
+        fractions = band_fractions(fraction, slant_positions()[1])
+        Imp, Vmp, Pmp = run_row_shading(layout, bands, fractions, poa_direct, poa_diffuse, temps)
+
+    :param layout: :class:`~pvmismatch_batch.SystemLayout` of :func:`shaded_layout`
+    :param bands: band of every cell type of :func:`shaded_layout`
+    :param fractions: :func:`band_fractions`, shape (T, bands)
+    :param poa_direct: direct plane of array irradiance [suns], shape (T,)
+    :param poa_diffuse: diffuse plane of array irradiance [suns], shape (T,)
+    :param temps: cell temperature [K], shape (T,)
+    :param min_suns: timesteps below this irradiance are not solved and return 0
+    :return: ``(Imp, Vmp, Pmp)``, each of shape (T,)
+    """
+    merged = _merge_bands(layout)
+    poa_direct = np.nan_to_num(np.asarray(poa_direct, dtype=float))
+    poa_diffuse = np.nan_to_num(np.asarray(poa_diffuse, dtype=float))
+    temps = np.broadcast_to(np.asarray(temps, dtype=float), poa_direct.shape)
+    # unshaded cells read an extra column of zeros
+    fractions = np.concatenate((fractions, np.zeros((len(fractions), 1))), axis=1)
+    Imp, Vmp, Pmp = np.zeros((3,) + poa_direct.shape)
+    day = poa_direct + poa_diffuse >= min_suns
+    shaded = day & (poa_direct > 0.) & (fractions[:, bands] > 0.).any(axis=1)
+    # timesteps without shade are solved with the bands merged, on a coarser current grid
+    for rows, shade in ((np.flatnonzero(day & ~shaded), False), (np.flatnonzero(shaded), True)):
+        lay = layout if shade else merged
+        for start in range(0, rows.size, chunksize):
+            part = rows[start:start + chunksize]
+            if shade:
+                Ee = poa_diffuse[part, None] + poa_direct[part, None] * (1. - fractions[part][:, bands])
+            else:
+                Ee = np.repeat(poa_diffuse[part, None] + poa_direct[part, None],
+                               lay.cell_suns.size, axis=1)
+            Tcell = np.repeat(temps[part, None], lay.cell_suns.size, axis=1)
+            sol = pb.solve_layout(lay, Ee, Tcell, pvconst=pvconst, npts=npts)
+            Imp[part], Vmp[part], Pmp[part] = sol.Imp, sol.Vmp, sol.Pmp
+    return Imp, Vmp, Pmp
+
+
+def _merge_bands(layout):
+    """The layout with the cell types of all bands merged, cells only differing in parameters."""
+    params, types = np.unique(layout.cell_params, axis=0, return_inverse=True)
+    merge = np.zeros((types.size, len(params)))
+    merge[np.arange(types.size), types.ravel()] = 1.
+    return layout._replace(cell_params=params, cell_suns=np.ones(len(params)),
+                           cell_temps=np.full(len(params), 298.15),
+                           sub_counts=layout.sub_counts @ merge)
+
+
+def run_row_shading_from_poa(pvsys, positions, poa, solar_position, surface_tilt, surface_azimuth,
+                             pitch, mods_high=1, module_height=MODULE_HEIGHT, orientation=PORTRAIT,
+                             temp_cell=None, **kwargs):
+    """
+    DC output of a pvmismatch system under row-to-row shading from a POA
+    irradiance frame.
+
+    For Example, with the PVGIS data of the 45 degree north facing rows::
+
+        dc = run_row_shading_from_poa(pvsys, np.zeros((30, 21), dtype=int), poa_data_2020,
+                                      get_solarposition(location, poa_data_2020.index),
+                                      surface_tilt=45, surface_azimuth=0, pitch=4.)
+
+    :param pvsys: a pvmismatch ``PVsystem``
+    :param positions: module positions, see :func:`shaded_layout`
+    :param poa: frame with ``poa_direct``, ``poa_diffuse`` [W/m^2] (and
+        ``poa_global``, ``temp_air``, ``wind_speed`` if ``temp_cell`` is not given)
+    :param solar_position: frame with ``apparent_zenith`` and ``azimuth`` on the index of ``poa``
+    :param temp_cell: cell temperature [C], defaults to the Faiman model
+    :param kwargs: passed on to :func:`run_row_shading`
+    :return: frame with ``i_mp``, ``v_mp``, ``p_mp`` and the ``shaded_fraction``
+        of the rows on the index of ``poa``
+    """
+    if temp_cell is None:
+        temp_cell = pvlib.temperature.faiman(poa['poa_global'], poa['temp_air'], poa['wind_speed'])
+    fraction = shaded_fraction(solar_position['apparent_zenith'], solar_position['azimuth'],
+                               surface_tilt, surface_azimuth, pitch, mods_high * module_height)
+    layout, bands = shaded_layout(pvsys, positions, mods_high, orientation)
+    nslant = slant_positions(pvsys.pvmods[0][0].cell_pos, orientation)[1]
+    Imp, Vmp, Pmp = run_row_shading(
+        layout, bands, band_fractions(fraction, nslant, mods_high),
+        poa['poa_direct'].to_numpy() / 1000., poa['poa_diffuse'].to_numpy() / 1000.,
+        np.asarray(temp_cell, dtype=float) + 273.15, **kwargs)
+    return pd.DataFrame({'i_mp': Imp, 'v_mp': Vmp, 'p_mp': Pmp, 'shaded_fraction': fraction},
+                        index=poa.index)
@@ -0,0 +1,376 @@
+# prebuilt index of the SAM module and inverter databases
+#
+# pvlib.pvsystem.retrieve_sam parses the bundled CSV libraries on every call.
+# Here each library is parsed once into a directory with one .npy file per
+# parameter, the entry names and a small search catalog (manufacturer,
+# technology, rated power, cell count). The index is tagged with the pvlib
+# version and the source file and rebuilt when either changes. Parameters are
+# memory-mapped, so looking up a module only reads its own values.
+#
+#     cec = open_database('CECMod')
+#     cec.search(manufacturer='Jinko', power=290, cells=72, technology='polySi')
+#     mod = cec['Jinko_Solar_Co___Ltd_JKM290P_72']  # like retrieve_sam('CECMod')[...]
+#
+# Set SAM_INDEX_DIR to move the index.
+
+import difflib
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from weather_store import META_FILE, _replace_dir
+
+INDEX_DIR = os.environ.get(
+    'SAM_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sam_index'))
+INDEX_VERSION = 1  # layout of the index files, bump to force a rebuild
+
+# libraries bundled with pvlib, names as in retrieve_sam
+SOURCES = {
+    'CECMod': 'sam-library-cec-modules-2019-03-05.csv',
+    'SandiaMod': 'sam-library-sandia-modules-2015-6-30.csv',
+    'CECInverter': 'sam-library-cec-inverters-2019-03-05.csv',
+}
+ALIASES = {'sandiainverter': 'CECInverter'}  # retrieve_sam points both at the same file
+
+# catalog fields: (technology, rated power [W], cells in series) parameters
+CATALOG_PARAMS = {
+    'CECMod': ('Technology', 'STC', 'N_s'),
+    'SandiaMod': ('Material', ('Impo', 'Vmpo'), 'Cells_in_Series'),
+    'CECInverter': (None, 'Paco', None),
+}
+
+# pvlib.ivtools cell types to the technology labels of the libraries
+TECHNOLOGIES = {
+    'monosi': ('Mono-c-Si', 'c-Si', 'HIT-Si'),
+    'multisi': ('Multi-c-Si', 'mc-Si', 'EFG mc-Si'),
+    'polysi': ('Multi-c-Si', 'mc-Si', 'EFG mc-Si'),
+    'cis': ('CIS',),
+    'cigs': ('CIGS',),
+    'cdte': ('CdTe',),
+    'amorphous': ('Thin Film', 'a-Si', '2-a-Si', '3-a-Si', 'Si-Film'),
+}
+
+NAMES_FILE = 'names.npy'
+CUTOFF = 0.6  # minimum difflib similarity of fuzzy matches
+CONTAINED_SCORE = 0.9  # name score of a query contained in the entry name
+
+
+def _key(text):
+    """Case and punctuation insensitive form of a name."""
+    return re.sub(r'[^0-9a-z]', '', str(text).lower())
+
+
+def _db_name(name):
+    for db in SOURCES:
+        if db.lower() == name.lower():
+            return db
+    try:
+        return ALIASES[name.lower()]
+    except KeyError:
+        raise KeyError('Invalid name %s. Provide one of %s.'
+                       % (name, list(SOURCES) + list(ALIASES))) from None
+
+
+def source_path(name):
+    """CSV library bundled with pvlib."""
+    return os.path.join(os.path.dirname(pvlib.pvsystem.__file__), 'data', SOURCES[name])
+
+
+def source_version(name):
+    """Version tag of the index of a library, changes with pvlib or the source file."""
+    st = os.stat(source_path(name))
+    return {'format': INDEX_VERSION, 'pvlib': pvlib.__version__, 'source': SOURCES[name],
+            'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def _manufacturer(raw_name, db):
+    """
+    Manufacturer from a display name; inverters are named "Maker: model", for
+    modules the leading words up to the first one with a digit or bracket
+    (the model).
+    """
+    if db == 'CECInverter':
+        return raw_name.split(':', 1)[0].strip()
+    words = raw_name.split()
+    n = 1
+    while n < len(words) and not (words[n].startswith('[') or any(c.isdigit() for c in words[n])):
+        n += 1
+    return ' '.join(words[:n])
+
+
+def _save_array(tmp, fname, values):
+    np.save(os.path.join(tmp, fname), values)
+    return fname
+
+
+def build_index(name, index_dir=INDEX_DIR):
+    """
+    Parse a SAM library and write its index, replacing an existing one.
+
+    :param name: ``'CECMod'``, ``'SandiaMod'`` or ``'CECInverter'``
+    :param index_dir: directory of the indexes
+    :return: path of the index
+    """
+    name = _db_name(name)
+    path = os.path.join(index_dir, name)
+    os.makedirs(index_dir, exist_ok=True)
+    src = source_path(name)
+    with open(src, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    data = pvlib.pvsystem.retrieve_sam(name).T.infer_objects()
+    raw_names = pd.read_csv(src, usecols=[0], skiprows=[1, 2]).iloc[:, 0].astype(str)
+    tmp = tempfile.mkdtemp(prefix='.' + name, dir=index_dir)
+    try:
+        params = []
+        for i, param in enumerate(data.columns):
+            values = data[param]
+            text = not pd.api.types.is_numeric_dtype(values)
+            na = text and bool(values.isna().any())
+            if text:
+                values = np.array(values.astype(object).where(values.notna(), ''), dtype=str)
+            else:
+                values = values.to_numpy()
+            fname = _save_array(tmp, 'par_%03d.npy' % i, values)
+            params.append({'name': param, 'file': fname, 'na': na})
+        _save_array(tmp, NAMES_FILE, np.array(data.index, dtype=str))
+        tech, power, cells = CATALOG_PARAMS[name]
+        nan = np.full(len(data), np.nan)
+        if isinstance(power, tuple):
+            power = data[power[0]].to_numpy(float) * data[power[1]].to_numpy(float)
+        else:
+            power = data[power].to_numpy(float)
+        catalog = {
+            'name': np.array(raw_names, dtype=str),
+            'manufacturer': np.array([_manufacturer(n, name) for n in raw_names], dtype=str),
+            'technology': np.array(data[tech] if tech else [''] * len(data), dtype=str),
+            'power': power,
+            'cells': data[cells].to_numpy(float) if cells else nan,
+        }
+        files = {field: _save_array(tmp, 'cat_%s.npy' % field, values)
+                 for field, values in catalog.items()}
+        meta = {'name': name, 'version': source_version(name), 'sha256': sha256,
+                'nentries': len(data), 'params': params, 'catalog': files}
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+        _replace_dir(tmp, os.path.abspath(path))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+class SAMDatabase(object):
+    """
+    Indexed SAM library, built on first use.
+
+    Indexing by entry name returns the same ``Series`` as the column of
+    ``pvlib.pvsystem.retrieve_sam(name)``; parameters are only read when used.
+
+    :param name: ``'CECMod'``, ``'SandiaMod'`` or ``'CECInverter'``
+    :param index_dir: directory of the indexes
+    """
+
+    def __init__(self, name, index_dir=INDEX_DIR):
+        self.name = _db_name(name)
+        self.path = os.path.join(index_dir, self.name)
+        self.meta = self._read_meta()
+        if self.meta is None or self.meta['version'] != source_version(self.name):
+            build_index(self.name, index_dir)
+            self.meta = self._read_meta()
+        self._params = {p['name']: p for p in self.meta['params']}
+        self._arrays = {}
+        self._columns = None
+        self._positions = None
+        self._catalog = None
+        self._keys = None
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, META_FILE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _load(self, fname):
+        if fname not in self._arrays:
+            self._arrays[fname] = np.load(os.path.join(self.path, fname), mmap_mode='r')
+        return self._arrays[fname]
+
+    @property
+    def params(self):
+        """Parameter names, like the index of ``retrieve_sam``."""
+        return list(self._params)
+
+    @property
+    def columns(self):
+        """Entry names, like the columns of ``retrieve_sam``."""
+        if self._columns is None:
+            self._columns = pd.Index(self._load(NAMES_FILE).tolist())
+        return self._columns
+
+    def __len__(self):
+        return self.meta['nentries']
+
+    def __contains__(self, entry):
+        return entry in self._position()
+
+    def _position(self):
+        if self._positions is None:
+            self._positions = {n: i for i, n in enumerate(self.columns)}
+        return self._positions
+
+    def _values(self, param, idx):
+        """Python values of one parameter, empty strings of optional text back to NaN."""
+        par = self._params[param]
+        values = self._load(par['file'])[idx].astype(object)
+        if par['na']:
+            values[values == ''] = np.nan
+        return values
+
+    def __getitem__(self, entry):
+        if entry not in self:
+            raise KeyError('%s not in %s, see SAMDatabase.search()' % (entry, self.name))
+        i = self._position()[entry]
+        return pd.Series({p: self._values(p, [i])[0] for p in self._params},
+                         dtype=object, name=entry)
+
+    def get(self, entry, default=None):
+        return self[entry] if entry in self else default
+
+    def frame(self, entries=None, params=None):
+        """
+        Parameters of several entries as a frame like ``retrieve_sam``.
+
+        :param entries: entry names, all if None
+        :param params: parameter names, all if None
+        """
+        entries = self.columns if entries is None else pd.Index(entries)
+        params = self.params if params is None else list(params)
+        idx = [self._position()[e] for e in entries]
+        return pd.DataFrame(np.array([self._values(p, idx) for p in params], dtype=object)
+                            .reshape(len(params), len(idx)), index=params, columns=entries)
+
+    def parameter(self, param):
+        """One parameter of every entry, with its numeric dtype."""
+        par = self._params[param]
+        return pd.Series(self._load(par['file']), index=self.columns, name=param, copy=False)
+
+    @property
+    def catalog(self):
+        """Display name, manufacturer, technology, rated power and cells of every entry."""
+        if self._catalog is None:
+            self._catalog = pd.DataFrame(
+                {field: self._load(fname) for field, fname in self.meta['catalog'].items()},
+                index=self.columns)
+        return self._catalog
+
+    def _fuzzy(self, query, field, cutoff):
+        """Catalog values of a field matching a query, by containment or similarity."""
+        values = pd.unique(self.catalog[field])
+        keys = {_key(v): v for v in values}
+        q = _key(query)
+        matches = [v for k, v in keys.items() if q and q in k]
+        matches += [keys[k] for k in difflib.get_close_matches(q, list(keys), n=10, cutoff=cutoff)]
+        return matches
+
+    def _name_keys(self):
+        """Keys of the entry names and of the model part (name without manufacturer)."""
+        if self._keys is None:
+            cat = self.catalog
+            self._keys = pd.DataFrame({
+                'name': [_key(n) for n in self.columns],
+                'model': [_key(n[len(m):]) for n, m in zip(cat['name'], cat['manufacturer'])]},
+                index=self.columns)
+        return self._keys
+
+    def _name_scores(self, q, entries, cutoff):
+        """
+        Similarity of a name key to entries, the best of the whole name and the
+        model only, so a bare model number scores high.
+        """
+        keys = self._name_keys().loc[entries]
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(q)
+        score = np.where(keys['name'].str.contains(q, regex=False), CONTAINED_SCORE, 0.)
+        for i, row in enumerate(zip(keys['name'], keys['model'])):
+            for key in row:
+                matcher.set_seq1(key)
+                best = max(score[i], cutoff)
+                # cheap upper bounds first, like difflib.get_close_matches
+                if matcher.real_quick_ratio() >= best and matcher.quick_ratio() >= best:
+                    score[i] = max(score[i], matcher.ratio())
+        return score
+
+    def search(self, name=None, manufacturer=None, power=None, cells=None, technology=None,
+               power_tol=0.01, cutoff=CUTOFF, limit=None):
+        """
+        Entries matching a spec sheet, best match first.
+
+        For Example::
+
+            cec = open_database('CECMod')
+            hits = cec.search(name='JKM290P-72', manufacturer='jinko', power=290, cells=72)
+            mod = cec[hits.index[0]]
+
+        :param name: model name, fuzzy matched against entry names
+        :param manufacturer: manufacturer, fuzzy matched
+        :param power: rated power [W], or a ``(min, max)`` range
+        :param cells: number of cells in series
+        :param technology: library label (``'Mono-c-Si'``, ``'mc-Si'``, ...) or
+            ``pvlib.ivtools`` cell type (``'monoSi'``, ``'polySi'``, ...)
+        :param power_tol: relative tolerance of a single rated power
+        :param cutoff: minimum similarity of fuzzy matches, 0 to 1
+        :param limit: max number of entries to return
+        :return: catalog rows of the matches, with a ``score`` column if ``name`` is given
+        """
+        cat = self.catalog
+        mask = np.ones(len(cat), dtype=bool)
+        if manufacturer is not None:
+            mask &= cat['manufacturer'].isin(self._fuzzy(manufacturer, 'manufacturer', cutoff))
+        if technology is not None:
+            labels = TECHNOLOGIES.get(technology.lower())
+            if labels is None:
+                labels = self._fuzzy(technology, 'technology', cutoff)
+            mask &= cat['technology'].isin(labels)
+        if cells is not None:
+            mask &= cat['cells'] == cells
+        if power is not None:
+            lo, hi = power if np.ndim(power) else (power * (1 - power_tol), power * (1 + power_tol))
+            mask &= cat['power'].between(lo, hi)
+        hits = cat[mask]
+        if name is not None:
+            hits = hits.assign(score=self._name_scores(_key(name), hits.index, cutoff))
+            hits = hits[hits['score'] >= cutoff].sort_values('score', ascending=False,
+                                                                kind='stable')
+        elif power is not None and np.ndim(power) == 0:
+            hits = hits.iloc[np.argsort(np.abs(hits['power'].to_numpy() - power), kind='stable')]
+        return hits if limit is None else hits.iloc[:limit]
+
+
+_DATABASES = {}
+
+
+def open_database(name, index_dir=INDEX_DIR):
+    """Shared :class:`SAMDatabase` of a library, opened once per process."""
+    key = (_db_name(name), os.path.abspath(index_dir))
+    if key not in _DATABASES:
+        _DATABASES[key] = SAMDatabase(*key)
+    return _DATABASES[key]
+
+
+def retrieve_sam(name):
+    """
+    Indexed stand-in for ``pvlib.pvsystem.retrieve_sam(name)``.
+
+    The result supports ``db[entry]``, ``db.columns`` and ``entry in db`` like
+    the frame, plus :meth:`SAMDatabase.search`; use
+    :meth:`SAMDatabase.frame` for a real frame.
+    """
+    return open_database(name)
@@ -0,0 +1,417 @@
+# single-diode parameters fitted to module spec sheets
+#
+# Fits the CEC model (De Soto's five parameters plus the Adjust factor of
+# Dobos' 6-parameter method) to datasheet values of many modules at once,
+# without the SAM native library behind pvlib.ivtools.sdm.fit_cec_sam:
+#
+# - native: a batched, damped Newton solve of De Soto's five equations for
+#   every spec sheet, started from Batzelis' explicit solution, with an outer
+#   secant iteration on Adjust that matches the Pmp temperature coefficient;
+# - bounded: the shunt resistance capped and Adjust solved together with the
+#   rest, the short circuit equation giving way to the Pmp temperature
+#   coefficient, for the many sheets that have no exact solution (their Rsh
+#   runs off to infinity, SAM's "sanity check failed");
+# - desoto: pvlib's fit_desoto (scipy root);
+# - batzelis: pvlib's explicit fit_desoto_batzelis as the last resort.
+#
+# Every fit is checked against the spec sheet and stored as JSON under the
+# hash of the spec values, so a portfolio is only fitted once.
+#
+# Set SDM_FIT_CACHE_DIR to move the cache.
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pvlib
+from scipy import constants
+
+import pvlib_array_dc as ad
+
+CACHE_DIR = os.environ.get(
+    'SDM_FIT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sdm_fit_cache'))
+FIT_VERSION = 1  # part of the cache key, bump when the fitting changes
+
+# spec sheet values: STC point [V, A], alpha_sc [A/K], beta_voc [V/K],
+# gamma_pmp [%/K] (optional, NaN fits Adjust = 0), cells in series, Tref [C]
+SPEC_FIELDS = ('v_mp', 'i_mp', 'v_oc', 'i_sc', 'alpha_sc', 'beta_voc', 'gamma_pmp',
+               'cells_in_series', 'temp_ref')
+FIT_PARAMS = ('I_L_ref', 'I_o_ref', 'R_s', 'R_sh_ref', 'a_ref', 'Adjust', 'alpha_sc')
+METHODS = ('native', 'bounded', 'desoto', 'batzelis')
+FREE = (0, 1, 2, 3, 4)  # unknowns IL, log I0, Rs, log Rsh, a at a given Adjust
+FREE_BOUNDED = (0, 1, 2, 4, 5)  # Rsh fixed, Adjust unknown
+
+EG_REF = 1.121  # band gap at Tref [eV], CEC default
+DEG_DT = -0.0002677  # band gap temperature dependence [1/K]
+K_EV = constants.value('Boltzmann constant in eV/K')
+DT_VOC = 2.  # temperature step of De Soto's open circuit equation [K]
+DT_PMP = 5.  # half width of the Pmp temperature coefficient difference [K]
+
+TOL = 1e-10  # norm of the residuals of the five equations, relative to i_sc
+MAXITER = 50
+MAX_HALVINGS = 20  # step halvings of the damped Newton iteration
+ADJUST_START = 10.  # second Adjust of the secant iteration, the first is 0
+ADJUST_TOL = 1e-5  # [%/K] match of the Pmp temperature coefficient
+ADJUST_MAXITER = 20
+SPEC_TOL = 1e-3  # max relative deviation of the fitted Pmp and Voc from the sheet
+RSH_MAX = 1e4  # [ohm] shunt resistance cap of the bounded fit
+
+
+def spec_key(spec):
+    """Hash of the spec sheet values of a row."""
+    values = {f: None if pd.isna(spec.get(f)) else float(spec.get(f)) for f in SPEC_FIELDS}
+    text = json.dumps({'version': FIT_VERSION, 'spec': values}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _specs(specs):
+    """Spec sheet frame with every field, ``gamma_pmp`` NaN and Tref 25 C if missing."""
+    specs = pd.DataFrame(specs).copy()
+    if 'gamma_pmp' not in specs:
+        specs['gamma_pmp'] = np.nan
+    if 'temp_ref' not in specs:
+        specs['temp_ref'] = 25.
+    missing = [f for f in SPEC_FIELDS if f not in specs]
+    if missing:
+        raise KeyError('spec sheets are missing %r' % missing)
+    return specs
+
+
+# --- Native batched fit
+
+def _residuals(x, s):
+    """
+    De Soto's five equations (as in pvlib.ivtools.sdm.fit_desoto) for every
+    sheet, relative to ``i_sc``; ``x`` is (IL, log I0, Rs, log Rsh, a, Adjust),
+    shape (N, 6).
+    """
+    IL, I0, Rs, Rsh, a = x[:, 0], np.exp(x[:, 1]), x[:, 2], np.exp(x[:, 3]), x[:, 4]
+    adjust = x[:, 5]
+    Isc, Voc, Imp, Vmp = s['i_sc'], s['v_oc'], s['i_mp'], s['v_mp']
+    Tref = s['temp_ref'] + 273.15
+    Vd = Vmp + Imp * Rs
+    e = I0 / a * np.exp(Vd / a)
+    y = np.empty((len(x), 5))
+    y[:, 0] = Isc - IL + I0 * np.expm1(Isc * Rs / a) + Isc * Rs / Rsh
+    y[:, 1] = -IL + I0 * np.expm1(Voc / a) + Voc / Rsh
+    y[:, 2] = Imp - IL + I0 * np.expm1(Vd / a) + Vd / Rsh
+    y[:, 3] = Imp - Vmp * (e + 1. / Rsh) / (1. + Rs * e + Rs / Rsh)
+    # open circuit at Tref + DT_VOC, temperature coefficients scaled by Adjust
+    T2 = Tref + DT_VOC
+    Voc2 = Voc + DT_VOC * s['beta_voc'] * (1. + adjust / 100.)
+    IL2 = IL + DT_VOC * s['alpha_sc'] * (1. - adjust / 100.)
+    Eg2 = EG_REF * (1. + DEG_DT * DT_VOC)
+    I02 = I0 * (T2 / Tref) ** 3 * np.exp((EG_REF / Tref - Eg2 / T2) / K_EV)
+    y[:, 4] = -IL2 + I02 * np.expm1(Voc2 / (a * T2 / Tref)) + Voc2 / Rsh
+    return y / Isc[:, None]
+
+
+def _residuals_bounded(x, s):
+    """
+    Equations of a sheet with Rsh fixed and Adjust unknown: the curve keeps
+    the spec sheet's maximum power point, Voc and temperature coefficients,
+    the short circuit equation gives way to the Pmp temperature coefficient
+    (like the CEC database entries of these sheets). Sheets without a Pmp
+    temperature coefficient keep all five equations.
+    """
+    y = _residuals(x, s)
+    has_gamma = np.isfinite(s['gamma_pmp'])
+    if has_gamma.any():
+        y[has_gamma, 0] = _gamma(x[has_gamma], {f: v[has_gamma] for f, v in s.items()}) \
+            - s['gamma_pmp'][has_gamma]
+    return y
+
+
+def _newton(fun, x, free):
+    """
+    Damped Newton solve of ``fun(x) = 0`` for the columns ``free`` of ``x``,
+    with a forward difference Jacobian, all sheets at once.
+
+    :return: ``(x, converged)``
+    """
+    r = fun(x)
+    norm = np.sqrt((r ** 2).sum(axis=1))
+    for _ in range(MAXITER):
+        todo = norm >= TOL
+        if not todo.any():
+            break
+        h = 1e-7 * np.maximum(np.abs(x), 1.)
+        J = np.empty(r.shape + (len(free),))
+        for k, j in enumerate(free):
+            xj = x.copy()
+            xj[:, j] += h[:, j]
+            J[:, :, k] = (fun(xj) - r) / h[:, j, None]
+        try:
+            step = np.linalg.solve(J, -r[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = (np.linalg.pinv(J) @ -r[..., None])[..., 0]
+        step[~todo | ~np.isfinite(step).all(axis=1)] = 0.
+        # halve the step of every sheet whose residual does not drop
+        lam = np.ones(len(x))
+        for _ in range(MAX_HALVINGS):
+            xn = x.copy()
+            xn[:, free] += lam[:, None] * step
+            rn = fun(xn)
+            nn = np.sqrt((rn ** 2).sum(axis=1))
+            worse = ~(nn < norm) & todo
+            if not worse.any():
+                break
+            lam[worse] /= 2.
+        better = nn < norm
+        x[better], r[better], norm[better] = xn[better], rn[better], nn[better]
+        if not better[todo].any():
+            break  # stalled
+    return x, norm < TOL
+
+
+def _solve(x, s, bounded, rsh_max):
+    """
+    De Soto's equations at the Adjust of ``x``, started from ``x``.
+
+    Sheets without a solution up to ``rsh_max`` are switched to ``bounded``
+    and solved with :func:`_residuals_bounded`.
+
+    :return: ``(x, converged, bounded)``
+    """
+    exact = np.flatnonzero(~bounded)
+    sub = {f: v[exact] for f, v in s.items()}
+    ok = bounded.copy()
+    x[exact], ok[exact] = _newton(lambda x: _residuals(x, sub), x[exact], FREE)
+    if np.isfinite(rsh_max):
+        # the exact solve of a sheet switched to bounded has diverged, restart it
+        switch = ~bounded & (~ok | (x[:, 3] > np.log(rsh_max)))
+        x[switch] = _initial({f: v[switch] for f, v in s.items()})
+        x[switch, 3] = np.log(rsh_max)
+        bounded = bounded | switch
+        b = np.flatnonzero(bounded)
+        sub = {f: v[b] for f, v in s.items()}
+        x[b], ok[b] = _newton(lambda x: _residuals_bounded(x, sub), x[b], FREE_BOUNDED)
+    return x, ok, bounded
+
+
+def _initial(s):
+    """
+    Batzelis' explicit solution, pvlib's fit_desoto start where it is not
+    finite, and Adjust 0.
+    """
+    with np.errstate(all='ignore'):
+        b = pvlib.ivtools.sdm.fit_desoto_batzelis(
+            s['v_mp'], s['i_mp'], s['v_oc'], s['i_sc'], s['alpha_sc'], s['beta_voc'])
+        n = len(s['v_mp'])
+        x = np.column_stack([b['I_L_ref'], np.log(b['I_o_ref']), b['R_s'],
+                             np.log(b['R_sh_ref']), b['a_ref'], np.zeros(n)])
+        Tref = s['temp_ref'] + 273.15
+        a0 = 1.5 * K_EV * Tref * s['cells_in_series']
+        I00 = s['i_sc'] * np.exp(-s['v_oc'] / a0)
+        Rs0 = (a0 * np.log1p((s['i_sc'] - s['i_mp']) / I00) - s['v_mp']) / s['i_mp']
+        x0 = np.column_stack([s['i_sc'], np.log(I00), Rs0, np.full(n, np.log(100.)), a0,
+                              np.zeros(n)])
+    x[:, 2] = np.maximum(x[:, 2], 0.)
+    bad = ~np.isfinite(x).all(axis=1)
+    x[bad] = x0[bad]
+    return x
+
+
+def _gamma(x, s):
+    """Pmp temperature coefficient [%/K] of fitted parameters, by central difference."""
+    params = _cec_params(x, s)
+    Tref = s['temp_ref']
+    P = [ad.module_mpp(ad.calcparams(1000., Tref + dT, params))[2] for dT in (-DT_PMP, DT_PMP)]
+    Pref = s['v_mp'] * s['i_mp']
+    return 100. * (P[1] - P[0]) / (2. * DT_PMP) / Pref
+
+
+def _cec_params(x, s):
+    return {'alpha_sc': s['alpha_sc'], 'a_ref': x[:, 4], 'I_L_ref': x[:, 0],
+            'I_o_ref': np.exp(x[:, 1]), 'R_sh_ref': np.exp(x[:, 3]), 'R_s': x[:, 2],
+            'Adjust': x[:, 5]}
+
+
+def fit_native(specs, rsh_max=np.inf):
+    """
+    Fit every spec sheet with the batched Newton solver.
+
+    :param specs: frame with :data:`SPEC_FIELDS` columns, one row per module
+    :param rsh_max: cap of the shunt resistance [ohm], sheets without an
+        exact solution below it get Rsh = ``rsh_max`` (see :func:`_solve`)
+    :return: ``(params, converged)``, a frame of :data:`FIT_PARAMS` and a
+        boolean array
+    """
+    specs = _specs(specs)
+    s = {f: specs[f].to_numpy(dtype=float) for f in SPEC_FIELDS}
+    with np.errstate(all='ignore'):
+        x, ok, bounded = _solve(_initial(s), s, np.zeros(len(specs), dtype=bool), rsh_max)
+        # secant iteration on Adjust for the sheets with a Pmp temperature coefficient
+        fit = np.flatnonzero(ok & ~bounded & np.isfinite(s['gamma_pmp']))
+        if fit.size:
+            sub = {f: v[fit] for f, v in s.items()}
+            xs, bs = x[fit], bounded[fit]
+            A0, f0 = xs[:, 5].copy(), _gamma(xs, sub) - sub['gamma_pmp']
+            xs[:, 5] = ADJUST_START
+            for _ in range(ADJUST_MAXITER):
+                xs, ok1, bs = _solve(xs, sub, bs, rsh_max)
+                f1 = _gamma(xs, sub) - sub['gamma_pmp']
+                done = (np.abs(f1) < ADJUST_TOL) | bs
+                if done.all():
+                    break
+                A1 = xs[:, 5].copy()
+                A2 = np.where(done, A1, A1 - f1 * (A1 - A0) / (f1 - f0))
+                A0, f0 = A1, f1
+                xs[:, 5] = np.clip(np.where(np.isfinite(A2), A2, A1), -100., 100.)
+            x[fit] = xs
+            ok[fit] = ok1 & done
+        params = pd.DataFrame(_cec_params(x, s), index=specs.index)
+    return params[list(FIT_PARAMS)], ok
+
+
+# --- Fallbacks
+
+def _fit_desoto(spec):
+    params, _ = pvlib.ivtools.sdm.fit_desoto(
+        spec['v_mp'], spec['i_mp'], spec['v_oc'], spec['i_sc'], spec['alpha_sc'],
+        spec['beta_voc'], spec['cells_in_series'], EgRef=EG_REF, dEgdT=DEG_DT,
+        temp_ref=spec['temp_ref'])
+    return dict(params, Adjust=0.)
+
+
+def _fit_batzelis(spec):
+    params = pvlib.ivtools.sdm.fit_desoto_batzelis(
+        spec['v_mp'], spec['i_mp'], spec['v_oc'], spec['i_sc'], spec['alpha_sc'],
+        spec['beta_voc'])
+    return dict(params, Adjust=0.)
+
+
+FALLBACKS = {'desoto': _fit_desoto, 'batzelis': _fit_batzelis}
+
+
+def check_fit(params, specs):
+    """
+    Relative deviation of the fitted Pmp and Voc from the spec sheets at STC,
+    NaN for unphysical parameters.
+    """
+    specs = _specs(specs)
+    p = {k: params[k].to_numpy(dtype=float) for k in FIT_PARAMS}
+    physical = ((p['I_L_ref'] > 0) & (p['I_o_ref'] > 0) & (p['R_s'] >= 0)
+                & (p['R_sh_ref'] > 0) & (p['a_ref'] > 0)
+                & np.isfinite(np.column_stack(list(p.values()))).all(axis=1))
+    with np.errstate(all='ignore'):
+        sdm = ad.calcparams(1000., specs['temp_ref'].to_numpy(dtype=float), p)
+        _, _, Pmp = ad.module_mpp(sdm)
+        Voc = ad.diode_voltage(0., sdm)
+    dev = np.maximum(np.abs(Pmp / (specs['v_mp'] * specs['i_mp']).to_numpy() - 1.),
+                     np.abs(Voc / specs['v_oc'].to_numpy() - 1.))
+    return np.where(physical, dev, np.nan)
+
+
+class FitCache(object):
+    """
+    Directory of fitted parameters, one JSON file per spec sheet hash.
+
+    :param cache_dir: directory of the cache entries
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def load(self, key):
+        with open(self.path(key)) as f:
+            return json.load(f)
+
+    def save(self, key, entry):
+        """Store an entry, a concurrent reader never sees a partial file."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.' + key, dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, indent=1)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+FIT_CACHE = FitCache()  # shared default cache
+
+
+def fit_specs(specs, cache=None, methods=METHODS, refresh=False):
+    """
+    CEC parameters of many spec sheets, cached by spec sheet hash.
+
+    Sheets are fitted with the native batched solver first; sheets where a
+    method fails, or whose fit misses the sheet's Pmp or Voc by more than
+    :data:`SPEC_TOL`, are passed on to the next method in ``methods``.
+
+    For Example::
+
+        specs = pd.DataFrame({'v_mp': [36.4], 'i_mp': [7.97], 'v_oc': [44.9],
+                              'i_sc': [8.89], 'alpha_sc': [0.0044], 'beta_voc': [-0.18],
+                              'gamma_pmp': [-0.47], 'cells_in_series': [72]})
+        mod = fit_specs(specs).iloc[0]  # use like a retrieve_sam('CECMod') column
+
+    :param specs: frame with :data:`SPEC_FIELDS` columns, one row per module
+        (``gamma_pmp`` [%/K] and ``temp_ref`` are optional)
+    :param cache: :class:`FitCache`, shared cache by default, False to not cache
+    :param methods: fitting methods to try in order, see :data:`METHODS`
+    :param refresh: fit again even if cached
+    :return: frame of :data:`FIT_PARAMS` with ``N_s``, ``method``, ``spec_dev``
+        (max relative deviation of Pmp and Voc) and ``key`` on the index of
+        ``specs``; failed sheets have NaN parameters and ``method`` None
+    """
+    cache = FIT_CACHE if cache is None else cache
+    specs = _specs(specs)
+    n = len(specs)
+    keys = [spec_key(row) for _, row in specs.iterrows()]
+    values = np.full((n, len(FIT_PARAMS)), np.nan)
+    used = np.full(n, None, dtype=object)
+    spec_dev = np.full(n, np.nan)
+    cached = np.zeros(n, dtype=bool)
+    if cache and not refresh:
+        for i, key in enumerate(keys):
+            if key in cache:
+                entry = cache.load(key)
+                values[i] = [entry['params'][k] for k in FIT_PARAMS]
+                used[i], spec_dev[i], cached[i] = entry['method'], entry['spec_dev'], True
+    todo = ~cached
+    for method in methods:
+        if not todo.any():
+            break
+        sub = specs[todo]
+        if method in ('native', 'bounded'):
+            params, _ = fit_native(sub, RSH_MAX if method == 'bounded' else np.inf)
+        else:
+            rows = []
+            for _, spec in sub.iterrows():
+                try:
+                    rows.append(FALLBACKS[method](spec))
+                except Exception:  # scipy root failures, bad sheets
+                    rows.append({})
+            params = pd.DataFrame(rows, columns=list(FIT_PARAMS), dtype=float)
+        dev = check_fit(params, sub)
+        good = dev < SPEC_TOL
+        fitted = np.flatnonzero(todo)[good]
+        values[fitted] = params[list(FIT_PARAMS)].to_numpy(dtype=float)[good]
+        used[fitted], spec_dev[fitted] = method, dev[good]
+        todo[fitted] = False
+    if cache:
+        for i in np.flatnonzero(~cached & (used != None)):  # noqa: E711
+            spec = specs.iloc[i]
+            cache.save(keys[i], {
+                'params': dict(zip(FIT_PARAMS, values[i].tolist())), 'method': used[i],
+                'spec_dev': spec_dev[i],
+                'spec': {f: None if pd.isna(spec[f]) else float(spec[f]) for f in SPEC_FIELDS}})
+    result = pd.DataFrame(values, index=specs.index, columns=list(FIT_PARAMS))
+    result['N_s'] = specs['cells_in_series']
+    result['method'] = used
+    result['spec_dev'] = spec_dev
+    result['key'] = keys
+    return result
@@ -0,0 +1,224 @@
+# on-disk cache of solar position, airmass and clear sky irradiance
+#
+# Solar position (and with it airmass and clear sky irradiance, whose
+# Ineichen model also reads the Linke turbidity file on every call) only
+# depends on the location, the time index and the model, but is recomputed
+# on every script run. Results are stored as weather_store datasets under a
+# key of (latitude, longitude, altitude, tz, kind, model and its arguments)
+# plus a hash of the time index. A request is served from
+#
+# - the entry of exactly its time index, or
+# - any entry of the same key whose time index contains all its timestamps,
+#   e.g. a week or the hours out of a cached multi-year 1-minute window;
+#   only the rows between its first and last timestamp are read,
+#
+# and computed and stored otherwise. Time indexes are compared in UTC, naive
+# timestamps being UTC as in pvlib, so a naive request can be served from a
+# tz-aware entry and the other way round. Set SOLAR_CACHE_DIR to move the
+# cache.
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pvlib
+
+from weather_store import WeatherStore, _index_values
+
+CACHE_DIR = os.environ.get(
+    'SOLAR_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'solar_cache'))
+
+KINDS = ('solarposition', 'airmass', 'clearsky')
+
+
+def _param(value):
+    """JSON value of a model argument, arrays and series by the hash of their values."""
+    if isinstance(value, (pd.Series, pd.DataFrame, np.ndarray)):
+        return 'sha256:' + hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def location_params(location, kind, **kwargs):
+    """
+    Everything that changes a result except the time index.
+
+    :param location: pvlib ``Location``
+    :param kind: one of :data:`KINDS`
+    :param kwargs: model arguments
+    :return: dict of the parameters
+    """
+    return {'latitude': float(location.latitude), 'longitude': float(location.longitude),
+            'altitude': float(location.altitude), 'tz': str(location.tz), 'kind': kind,
+            'kwargs': {k: _param(v) for k, v in sorted(kwargs.items())},
+            'pvlib': pvlib.__version__}
+
+
+def params_key(params):
+    """Hash of canonical parameters."""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def _utc(times):
+    """Timestamps in UTC, naive ones are UTC as in ``pvlib.solarposition``."""
+    return times.tz_localize('UTC') if times.tz is None else times.tz_convert('UTC')
+
+
+def index_key(times):
+    """Hash of a time index."""
+    return hashlib.sha256(_index_values(times).tobytes()).hexdigest()[:16]
+
+
+class SolarCache(object):
+    """
+    Directory of cached solar position, airmass and clear sky results.
+
+    :param cache_dir: directory of the cache entries
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.store = WeatherStore(cache_dir)
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+
+    def entries(self):
+        """Parameters and time windows of every cached result, one row per entry."""
+        rows = []
+        for name in self.store.names():
+            info = self.store.info(name)
+            entry = info['meta']
+            rows.append(dict(entry['params'], name=name, nrows=info['nrows'],
+                             start=entry['start'], end=entry['end'],
+                             created=pd.Timestamp(entry['created'], unit='s')))
+        return pd.DataFrame(rows)
+
+    def _windows(self, key):
+        """Cached entries of a parameter key that may hold a time window."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(name for name in os.listdir(self.cache_dir)
+                      if name.startswith(key + '_') and name in self.store)
+
+    def lookup(self, params, times):
+        """
+        Cached result for a time index, None if not cached.
+
+        :param params: :func:`location_params`
+        :param times: ``DatetimeIndex`` of the request
+        :return: frame on ``times`` or None
+        """
+        key = params_key(params)
+        name = key + '_' + index_key(times)
+        if name in self.store:
+            self.hits += 1
+            data = self.store.read(name)
+            data.index = times  # the same instants, maybe in another timezone
+            return data
+        if not len(times):
+            return None
+        utc = _utc(times)
+        first, last = utc.min(), utc.max()
+        for name in self._windows(key):
+            entry = self.store.meta(name)
+            start, end = _utc(pd.DatetimeIndex([entry['start'], entry['end']]))
+            if start > first or end < last:
+                continue
+            window = self.store.read(name, start=first, end=last)
+            rows = _utc(window.index).get_indexer(utc)
+            if (rows >= 0).all():
+                self.partial_hits += 1
+                data = window.iloc[rows]
+                data.index = times
+                return data
+        return None
+
+    def save(self, params, data):
+        """
+        Store a result, a concurrent reader never sees a partial entry.
+
+        :param params: :func:`location_params`
+        :param data: frame with a ``DatetimeIndex``
+        """
+        name = params_key(params) + '_' + index_key(data.index)
+        self.store.write(name, data, {'params': params, 'start': data.index.min().isoformat(),
+                                      'end': data.index.max().isoformat(),
+                                      'created': time.time()})
+
+    def _get(self, params, times, compute, refresh):
+        times = pd.DatetimeIndex(times)
+        data = None if refresh else self.lookup(params, times)
+        if data is None:
+            self.misses += 1
+            data = compute(times)
+            if times.is_unique:  # a window with duplicates can not be sliced
+                self.save(params, data)
+        return data
+
+    def get_solarposition(self, location, times, refresh=False, **kwargs):
+        """
+        Cached ``location.get_solarposition``.
+
+        :param refresh: compute again even if cached
+        :param kwargs: ``get_solarposition`` arguments (pressure, temperature,
+            method, ...)
+        """
+        params = location_params(location, 'solarposition', **kwargs)
+        return self._get(params, times, lambda t: location.get_solarposition(t, **kwargs),
+                         refresh)
+
+    def get_airmass(self, location, times, model='kastenyoung1989', refresh=False):
+        """
+        Cached ``location.get_airmass``, from the cached solar position.
+        """
+        params = location_params(location, 'airmass', model=model)
+        return self._get(params, times, lambda t: location.get_airmass(
+            t, self.get_solarposition(location, t), model), refresh)
+
+    def get_clearsky(self, location, times, model='ineichen', refresh=False, **kwargs):
+        """
+        Cached ``location.get_clearsky``, from the cached solar position.
+
+        :param kwargs: ``get_clearsky`` arguments (linke_turbidity, ...)
+        """
+        params = location_params(location, 'clearsky', model=model, **kwargs)
+
+        def compute(t):
+            solar_position = self.get_solarposition(
+                location, t, **{k: v for k, v in kwargs.items() if k == 'pressure'})
+            return location.get_clearsky(t, model, solar_position, **kwargs)
+
+        return self._get(params, times, compute, refresh)
+
+
+SOLAR_CACHE = SolarCache()  # shared default cache
+
+
+def get_solarposition(location, times, cache=None, **kwargs):
+    """
+    Cached ``location.get_solarposition``.
+
+    For Example::
+
+        solar_pos = get_solarposition(location, pd.date_range('2020-01-01', '2021-01-01', freq='h'))
+
+    :param cache: :class:`SolarCache`, shared module-level cache by default
+    """
+    cache = SOLAR_CACHE if cache is None else cache
+    return cache.get_solarposition(location, times, **kwargs)
+
+
+def get_airmass(location, times, model='kastenyoung1989', cache=None):
+    """Cached ``location.get_airmass``."""
+    cache = SOLAR_CACHE if cache is None else cache
+    return cache.get_airmass(location, times, model)
+
+
+def get_clearsky(location, times, model='ineichen', cache=None, **kwargs):
+    """Cached ``location.get_clearsky``."""
+    cache = SOLAR_CACHE if cache is None else cache
+    return cache.get_clearsky(location, times, model, **kwargs)
@@ -0,0 +1,22 @@
+# lifetime degradation Monte Carlo of a small plant
+
+import numpy as np
+
+import degradation_mc as dmc
+
+NO_DEGRADATION = {'Isc0_T0': (0., 0.), 'Rs': (0., 0.), 'Rsh': (0., 0.)}
+
+
+def test_perfect_plant_has_no_mismatch():
+    result = dmc.run_sample(0, numberStrs=3, numberMods=6, years=2, rates=NO_DEGRADATION,
+                            isc_tolerance=0.)
+    assert np.all(np.abs(result['mismatch']) < 1e-3)
+    assert np.allclose(result['Pmp_modules'], result['Pmp_nominal'])
+    assert np.allclose(result['Pmp'] / result['Pmp_nominal'], 1., atol=1e-5)
+
+
+def test_degraded_plant_loses_power_and_matching():
+    result = dmc.run_sample(0, numberStrs=3, numberMods=6, years=10)
+    assert result['Pmp'][-1] < result['Pmp'][0] < result['Pmp_nominal']
+    assert np.all(result['Pmp'] <= result['Pmp_modules'])
+    assert result['mismatch'][-1] > result['mismatch'][0] > 0.
@@ -0,0 +1,33 @@
+# bulk PVGIS retrieval against the local stand-in server
+
+import numpy as np
+import pandas as pd
+
+from pvgis_bulk import bulk_get_pvgis_hourly
+from pvgis_cache import PVGISCache, request_params
+from pvgis_fake_server import FakePVGISServer
+
+
+def test_request_params_numeric_years():
+    params = request_params(-30, 24, start=2020.0, end=np.float64(2021.))
+    assert (params['start'], params['end']) == (2020, 2021)
+    assert request_params(-30, 24, start='2019-05-01', end=2019)['start'] == 2019
+
+
+def test_bulk_numeric_table_keeps_years(tmp_path):
+    cache = PVGISCache(str(tmp_path))
+    with FakePVGISServer() as server:
+        table = pd.DataFrame({'latitude': [-30.09, -29.5], 'longitude': [24.14, 24.5],
+                              'start': [2020., 2019.], 'end': [2020., 2019.],
+                              'surface_tilt': [45., 30.]})
+        status = bulk_get_pvgis_hourly(table.assign(url=server.url), cache=cache)
+        queries = [query for _, query in server.requests]
+    assert list(status['status']) == ['fetched', 'fetched']
+    assert any('startyear=2020' in query for query in queries)
+    assert any('startyear=2019' in query for query in queries)
+    for key, year in zip(status['key'], (2020, 2019)):
+        data, _ = cache.load(key)
+        assert set(data.index.year) == {year}
+    # same table again, all rows are served from the cache
+    status = bulk_get_pvgis_hourly(table.assign(url=server.url), cache=cache)
+    assert list(status['status']) == ['cached', 'cached']
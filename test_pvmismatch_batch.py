@@ -0,0 +1,73 @@
+# batched mismatch engine against pvmismatch's PVsystem
+
+import numpy as np
+from pvmismatch import pvcell, pvconstants, pvmodule, pvstring, pvsystem
+
+import pvmismatch_batch as pb
+
+BOTTOM_ROW = {'cells': (11, 12, 35, 36, 59, 60, 83, 84), 'Ee': 0.2}
+
+
+def _assert_matches(pvsys):
+    Imp, Vmp, Pmp = pb.run_mismatch(pvsys, [1.], [pvsys.pvconst.T0])
+    assert abs(Pmp[0] / pvsys.Pmp - 1.) < pb.PMP_TOLERANCE
+
+
+def test_uniform_system():
+    _assert_matches(pvsystem.PVsystem(numberStrs=10, numberMods=10))
+
+
+def test_shaded_system():
+    pvsys = pvsystem.PVsystem(numberStrs=10, numberMods=10)
+    pvsys.setSuns({0: {m: BOTTOM_ROW for m in range(10)}, 1: {0: 0.5}})
+    _assert_matches(pvsys)
+
+
+def test_dark_substrings():
+    pvsys = pvsystem.PVsystem(numberStrs=10, numberMods=10)
+    pvsys.setSuns({0: {m: [(0.001,) * 24, tuple(range(24))] for m in range(5)}})
+    _assert_matches(pvsys)
+
+
+def test_degraded_system():
+    pvconst = pvconstants.PVconstants()
+    good = pvmodule.PVmodule(pvconst=pvconst)
+    degraded = pvmodule.PVmodule(
+        pvcells=[pvcell.PVcell(Rsh=5., pvconst=pvconst) for _ in range(96)], pvconst=pvconst)
+    pvstrs = [pvstring.PVstring(pvmods=[degraded] * 3 + [good] * 7, pvconst=pvconst)]
+    pvstrs += [pvstring.PVstring(pvmods=[good] * 10, pvconst=pvconst) for _ in range(9)]
+    _assert_matches(pvsystem.PVsystem(pvstrs=pvstrs, pvconst=pvconst))
+
+
+def test_irradiance_series_scales_pattern():
+    pvsys = pvsystem.PVsystem(numberStrs=4, numberMods=6)
+    pvsys.setSuns({0: {0: BOTTOM_ROW}})
+    Imp, Vmp, Pmp = pb.run_mismatch(pvsys, [0., 0.4], pvsys.pvconst.T0)
+    assert Pmp[0] == 0.
+    pvsys.setSuns(0.4)
+    pvsys.setSuns({0: {0: dict(BOTTOM_ROW, Ee=0.4 * BOTTOM_ROW['Ee'])}})
+    assert abs(Pmp[1] / pvsys.Pmp - 1.) < pb.PMP_TOLERANCE
+
+
+def test_adaptive_grid_within_mismatch_tolerance():
+    pvsys = pvsystem.PVsystem(numberStrs=30, numberMods=21,
+                              pvmods=pvmodule.PVmodule(cell_pos=pvmodule.STD72))
+    pvsys.setSuns({0: {m: [(0.2,) * 6, (11, 12, 35, 36, 59, 60)] for m in range(5)},
+                   1: {0: [(0.001,) * 24, tuple(range(24))]}, 2: 0.5})
+    layout = pb.layout_from_pvsystem(pvsys)
+    rng = np.random.default_rng(0)
+    Ee = rng.uniform(0.05, 1.1, (50, 1)) * layout.cell_suns
+    Tcell = rng.uniform(273., 340., (50, 1)) * np.ones_like(layout.cell_suns)
+    err = pb.adaptive_error(layout, Ee=Ee, Tcell=Tcell)
+    assert err.mismatch.max() < pb.MISMATCH_TOLERANCE
+    assert np.allclose(err.module_eq, err.mismatch / 100 * 21 * 30)
+
+
+def test_module_pmp_without_mismatch():
+    pvsys = pvsystem.PVsystem(numberStrs=3, numberMods=4)
+    uniform = pb.module_pmp(pb.layout_from_pvsystem(pvsys))
+    module = pvsys.pvstrs[0].pvmods[0]
+    assert abs(uniform[0] / (12 * pb.curve_pmp(module.Imod, module.Vmod)) - 1.) < pb.PMP_TOLERANCE
+    pvsys.setSuns({0: {0: BOTTOM_ROW}})
+    shaded = pb.module_pmp(pb.layout_from_pvsystem(pvsys))
+    assert pvsys.Pmp < shaded[0] < uniform[0]
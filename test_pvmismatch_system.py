@@ -0,0 +1,71 @@
+# MismatchPVsystem against pvmismatch's PVsystem after in-place edits
+
+import numpy as np
+from pvmismatch import pvconstants, pvmodule, pvstring, pvsystem
+
+from pvmismatch_system import MismatchPVsystem
+
+
+def _recalc(pvstr):
+    pvstr.Istring, pvstr.Vstring, pvstr.Pstring = pvstr.calcString()
+
+
+def test_mark_dirty_forgets_modules_changed_in_place():
+    results = []
+    for cls in (pvsystem.PVsystem, MismatchPVsystem):
+        pvsys = cls(numberStrs=3, numberMods=4)
+        pvsys.setSuns({0: {0: 0.5}})
+        pvsys.pvstrs[0].pvmods[0].setSuns(0.2)
+        _recalc(pvsys.pvstrs[0])
+        if cls is MismatchPVsystem:
+            pvsys.markDirty([0])
+        pvsys.update()
+        pvsys.setSuns({1: {0: 0.5}})
+        results.append(pvsys)
+    expected, actual = results
+    assert np.allclose(actual.pvstrs[1].pvmods[0].Ee, expected.pvstrs[1].pvmods[0].Ee)
+    assert np.isclose(actual.pvstrs[1].Pstring.max(), expected.pvstrs[1].Pstring.max())
+    assert np.isclose(actual.Pmp, expected.Pmp)
+
+
+def test_equal_strings_stay_distinct_objects():
+    pvconst = pvconstants.PVconstants()
+    results = []
+    for cls in (pvsystem.PVsystem, MismatchPVsystem):
+        pvstrs = [pvstring.PVstring(numberMods=4, pvconst=pvconst, pvmods=[
+            pvmodule.PVmodule(pvconst=pvconst) for _ in range(4)]) for _ in range(5)]
+        pvsys = cls(pvstrs=pvstrs, pvconst=pvconst)
+        pvsys.pvstrs[2].pvmods[0].setSuns(0.1)
+        _recalc(pvsys.pvstrs[2])
+        if cls is MismatchPVsystem:
+            pvsys.markDirty([2])
+        pvsys.update()
+        results.append(pvsys.Pmp)
+    assert np.isclose(results[1], results[0])
+
+
+def test_scalar_set_suns_keeps_strings_apart():
+    pvconst = pvconstants.PVconstants()
+    pvstrs = [pvstring.PVstring(numberMods=4, pvconst=pvconst, pvmods=[
+        pvmodule.PVmodule(pvconst=pvconst) for _ in range(4)]) for _ in range(3)]
+    pvsys = MismatchPVsystem(pvstrs=pvstrs, pvconst=pvconst)
+    pvsys.setSuns(0.8)
+    assert len(set(map(id, pvsys.pvstrs))) == 3
+    pvsys.pvstrs[1].pvmods[0].setSuns(0.1)
+    assert np.allclose(pvsys.pvstrs[0].pvmods[0].Ee, 0.8)
+
+
+def test_operating_points_mismatch_loss():
+    uniform = MismatchPVsystem(numberStrs=5, numberMods=21)
+    strings, modules = uniform.calcOperatingPoints()
+    assert np.all(strings['mismatch_loss'] >= 0.) and np.all(modules['mismatch_loss'] >= 0.)
+    assert np.all(strings['mismatch_loss'] < 1e-4 * strings['Pmp'])
+    assert np.all(modules['mismatch_loss'] < 1e-4 * modules['Pmp'])
+
+    shaded = MismatchPVsystem(numberStrs=20, numberMods=21)
+    bottom_row = {'cells': (11, 12, 35, 36, 59, 60, 83, 84), 'Ee': 0.1}
+    shaded.setSuns({0: {m: bottom_row for m in range(21)}})
+    strings, modules = shaded.calcOperatingPoints()
+    assert np.all(strings['mismatch_loss'] >= 0.) and np.all(modules['mismatch_loss'] >= 0.)
+    assert strings.loc[0, 'mismatch_loss'] > 0.1 * strings.loc[0, 'Pmp']
+    assert np.all(modules.loc[0, 'mismatch_loss'] > 0.)
@@ -0,0 +1,166 @@
+# memory-mapped weather datasets round trips
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import weather_store as ws
+
+
+def _weather(start='2020-01-01', periods=48, freq='h', tz='Africa/Johannesburg'):
+    index = pd.date_range(start, periods=periods, freq=freq, tz=tz, name='time', unit='ns')
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'poa_global': rng.uniform(0., 1000., periods),
+                         'temp_air': rng.uniform(10., 35., periods).astype(np.float32),
+                         'flag': np.arange(periods)}, index=index)
+
+
+def _assert_equal(result, expected):
+    # columns are np.memmap and the index frequency is not stored
+    pd.testing.assert_frame_equal(result.copy(), expected, check_freq=False)
+
+
+def _leftovers(path):
+    return [name for name in os.listdir(path) if name.startswith('.')]
+
+
+def test_round_trip_tz_aware(tmp_path):
+    data = _weather()
+    path = ws.write_dataset(str(tmp_path / 'poa'), data, meta={'lat': -30.09})
+    result = ws.read_dataset(path)
+    _assert_equal(result, data)
+    assert str(result.index.tz) == 'Africa/Johannesburg'
+    assert ws.read_meta(path) == {'lat': -30.09}
+    pd.testing.assert_index_equal(ws.read_index(path), data.index, exact=False)
+
+
+def test_round_trip_naive(tmp_path):
+    data = _weather(tz=None)
+    path = ws.write_dataset(str(tmp_path / 'poa'), data)
+    _assert_equal(ws.read_dataset(path), data)
+
+
+def test_partial_window(tmp_path):
+    data = _weather()
+    path = ws.write_dataset(str(tmp_path / 'poa'), data)
+    # naive bounds are in the dataset's timezone, both ends inclusive
+    result = ws.read_dataset(path, columns=['temp_air'], start='2020-01-01 06:00',
+                             end='2020-01-01 17:00')
+    _assert_equal(result, data.loc['2020-01-01 06:00':'2020-01-01 17:00',
+                                                   ['temp_air']])
+    # aware bounds in another timezone
+    result = ws.read_dataset(path, start=pd.Timestamp('2020-01-01 04:00', tz='UTC'))
+    _assert_equal(result, data.iloc[6:])
+    assert ws.read_dataset(path, start='2021-01-01').empty
+    with pytest.raises(KeyError):
+        ws.read_dataset(path, columns=['ghi'])
+
+
+def test_iter_dataset(tmp_path):
+    data = _weather()
+    path = ws.write_dataset(str(tmp_path / 'poa'), data)
+    chunks = list(ws.iter_dataset(path, 10, start='2020-01-01 03:00'))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 10, 10, 5]
+    _assert_equal(pd.concat(chunks), data.iloc[3:])
+
+
+def test_chunked_writes(tmp_path):
+    data = _weather(periods=100)
+    path = str(tmp_path / 'results')
+    with ws.DatasetWriter(path, meta={'run': 1}) as writer:
+        for i in range(0, 100, 30):
+            writer.append(data.iloc[i:i + 30])
+    assert writer.nrows == 100
+    _assert_equal(ws.read_dataset(path), data)
+    assert ws.read_meta(path) == {'run': 1}
+    assert _leftovers(str(tmp_path)) == []
+
+
+def test_chunked_write_checks_columns(tmp_path):
+    data = _weather()
+    writer = ws.DatasetWriter(str(tmp_path / 'results'))
+    writer.append(data.iloc[:10])
+    with pytest.raises(ValueError):
+        writer.append(data.iloc[10:20, :2])
+    writer.abort()
+    assert _leftovers(str(tmp_path)) == []
+    with pytest.raises(ValueError):
+        ws.DatasetWriter(str(tmp_path / 'empty')).close()
+
+
+def test_failed_chunked_write_keeps_dataset(tmp_path):
+    data = _weather()
+    path = ws.write_dataset(str(tmp_path / 'results'), data)
+    with pytest.raises(RuntimeError):
+        with ws.DatasetWriter(path) as writer:
+            writer.append(data.iloc[:10] * 2)
+            raise RuntimeError('simulation failed')
+    _assert_equal(ws.read_dataset(path), data)
+    assert _leftovers(str(tmp_path)) == []
+
+
+def test_reads_are_copy_on_write(tmp_path):
+    data = _weather()
+    path = ws.write_dataset(str(tmp_path / 'poa'), data)
+    result = ws.read_dataset(path)
+    values = result['poa_global'].to_numpy()
+    while not isinstance(values, np.memmap):
+        values = values.base
+    assert values.mode == 'c'
+    values[:5] = -2.
+    result.iloc[:10, 0] = -1.
+    result['flag'] += 1
+    assert np.all(result['poa_global'].iloc[:10] == -1.)
+    _assert_equal(ws.read_dataset(path), data)
+
+
+def test_atomic_replace(tmp_path, monkeypatch):
+    path = ws.write_dataset(str(tmp_path / 'poa'), _weather())
+    new = _weather(start='2021-01-01', periods=24)[['poa_global']]
+    ws.write_dataset(path, new, meta={'version': 2})
+    _assert_equal(ws.read_dataset(path), new)
+    assert ws.read_meta(path) == {'version': 2}
+    assert _leftovers(str(tmp_path)) == []
+
+    def fail(index):
+        raise OSError('disk full')
+    monkeypatch.setattr(ws, '_index_values', fail)
+    with pytest.raises(OSError):
+        ws.write_dataset(path, _weather())
+    _assert_equal(ws.read_dataset(path), new)
+    assert _leftovers(str(tmp_path)) == []
+
+
+def test_load_dataset_converts_csv(tmp_path):
+    data = _weather()
+    path = str(tmp_path / 'poa_data_2020_io')
+    data.to_csv(path + '.csv')
+    result = ws.load_dataset(path, columns=['poa_global', 'flag'], start='2020-01-02')
+    assert ws.is_dataset(path)
+    assert ws.read_meta(path) == {'source': path + '.csv'}
+    expected = data.iloc[24:][['poa_global', 'flag']]
+    assert (result.index == expected.index).all()
+    np.testing.assert_allclose(result['poa_global'], expected['poa_global'])
+    np.testing.assert_array_equal(result['flag'], expected['flag'])
+    # the dataset is read from now on, even without the CSV
+    os.remove(path + '.csv')
+    assert len(ws.load_dataset(path)) == len(data)
+
+
+def test_load_dataset_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ws.load_dataset(str(tmp_path / 'poa'))
+
+
+def test_weather_store(tmp_path):
+    store = ws.WeatherStore(str(tmp_path / 'store'))
+    assert store.names() == []
+    store.write('poa', _weather())
+    with store.writer('results') as writer:
+        writer.append(_weather(periods=5))
+    assert store.names() == ['poa', 'results'] and 'poa' in store
+    assert len(store.read('results')) == 5
+    store.remove('results')
+    assert store.names() == ['poa']
@@ -0,0 +1,322 @@
+# memory-mapped weather datasets
+#
+# A dataset is a directory with one .npy file per column, the index as
+# datetime64[ns] (UTC for tz-aware indexes) in index.npy and a meta.json with
+# the column names, dtypes, timezone and free-form metadata. Columns are
+# opened with np.load(mmap_mode='c'), so reading a few columns or a time
+# window of a multi-year 1-minute dataset only touches those bytes instead of
+# re-parsing a text file.
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npy'
+
+
+def _index_values(index):
+    """datetime64[ns] values of an index, tz-aware indexes in UTC."""
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.to_numpy().astype('datetime64[ns]')
+
+
+def write_dataset(path, data, meta=None):
+    """
+    Write a frame with a ``DatetimeIndex`` as a dataset, replacing an existing one.
+
+    The dataset is written next to ``path`` and moved in place, so readers
+    never see a partial dataset.
+
+    :param path: dataset directory
+    :param data: frame with a (tz-aware or naive) ``DatetimeIndex``
+    :param meta: JSON serializable metadata stored with the dataset
+    :return: ``path``
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.' + os.path.basename(path), dir=parent)
+    try:
+        columns = []
+        for i, name in enumerate(data.columns):
+            fname = 'col_%03d.npy' % i
+            np.save(os.path.join(tmp, fname), np.ascontiguousarray(data[name].to_numpy()))
+            columns.append({'name': name, 'file': fname, 'dtype': str(data[name].dtype)})
+        np.save(os.path.join(tmp, INDEX_FILE), _index_values(data.index))
+        tz = None if data.index.tz is None else str(data.index.tz)
+        entry = {'columns': columns, 'index_name': data.index.name, 'tz': tz,
+                 'nrows': len(data), 'meta': meta}
+        with open(os.path.join(tmp, META_FILE), 'w') as f:
+            json.dump(entry, f, indent=1, default=str)
+        _replace_dir(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+class DatasetWriter(object):
+    """
+    Write a dataset chunk by chunk, e.g. the results of a simulation too long
+    to hold in memory.
+
+    Chunks are appended to raw column files in a directory next to ``path``;
+    :meth:`close` turns them into .npy files and moves the dataset in place,
+    replacing an existing one, so readers never see a partial dataset.
+
+    For Example::
+
+        with DatasetWriter('results_1min') as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+
+    :param path: dataset directory
+    :param meta: JSON serializable metadata stored with the dataset
+    """
+
+    def __init__(self, path, meta=None):
+        self.path = os.path.abspath(path)
+        self.meta = meta
+        self.nrows = 0
+        self._columns = None
+        self._tmp = None
+
+    def append(self, data):
+        """Append a frame with the columns, dtypes and timezone of the first one."""
+        if self._columns is None:
+            self._start(data)
+        elif list(data.columns) != [col['name'] for col in self._columns]:
+            raise ValueError('columns %r differ from the first chunk' % list(data.columns))
+        for col in self._columns:
+            values = np.ascontiguousarray(data[col['name']].to_numpy(dtype=col['dtype']))
+            with open(os.path.join(self._tmp, col['file']), 'ab') as f:
+                f.write(values.tobytes())
+        with open(os.path.join(self._tmp, INDEX_FILE), 'ab') as f:
+            f.write(_index_values(data.index).tobytes())
+        self.nrows += len(data)
+
+    def _start(self, data):
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        self._tmp = tempfile.mkdtemp(prefix='.' + os.path.basename(self.path), dir=parent)
+        self._columns = [
+            {'name': name, 'file': 'col_%03d.npy' % i, 'dtype': str(data[name].dtype)}
+            for i, name in enumerate(data.columns)]
+        self._index_name = data.index.name
+        self._tz = None if data.index.tz is None else str(data.index.tz)
+
+    def close(self):
+        """Finish the dataset and move it to ``path``."""
+        if self._columns is None:
+            raise ValueError('no data written to %s' % self.path)
+        files = [(col['file'], col['dtype']) for col in self._columns]
+        for fname, dtype in files + [(INDEX_FILE, 'datetime64[ns]')]:
+            _add_npy_header(os.path.join(self._tmp, fname), np.dtype(dtype), self.nrows)
+        entry = {'columns': self._columns, 'index_name': self._index_name, 'tz': self._tz,
+                 'nrows': self.nrows, 'meta': self.meta}
+        with open(os.path.join(self._tmp, META_FILE), 'w') as f:
+            json.dump(entry, f, indent=1, default=str)
+        _replace_dir(self._tmp, self.path)
+        self._tmp = None
+        return self.path
+
+    def abort(self):
+        """Drop everything written so far, an existing dataset is kept."""
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _add_npy_header(fname, dtype, nrows):
+    """Turn a raw column file into a .npy file of ``nrows`` values."""
+    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+              'shape': (nrows,)}
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as out:
+        np.lib.format.write_array_header_1_0(out, header)
+        if os.path.exists(fname):
+            with open(fname, 'rb') as f:
+                shutil.copyfileobj(f, out)
+    os.replace(tmp, fname)
+
+
+def _replace_dir(tmp, path):
+    """Move a finished directory to ``path``, swapping out an existing one."""
+    if os.path.isdir(path):
+        parent = os.path.dirname(path)
+        old = tempfile.mkdtemp(prefix='.' + os.path.basename(path), dir=parent)
+        os.replace(path, os.path.join(old, 'old'))
+        os.replace(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, path)
+
+
+def is_dataset(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def read_info(path):
+    """Column names, dtypes, timezone, number of rows and metadata of a dataset."""
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def read_meta(path):
+    """Metadata stored with :func:`write_dataset`."""
+    return read_info(path)['meta']
+
+
+def read_index(path):
+    """``DatetimeIndex`` of a dataset."""
+    info = read_info(path)
+    return _make_index(np.load(os.path.join(path, INDEX_FILE)), info)
+
+
+def _make_index(values, info):
+    index = pd.DatetimeIndex(values, name=info['index_name'])
+    if info['tz'] is not None:
+        index = index.tz_localize('UTC').tz_convert(info['tz'])
+    return index
+
+
+def _index_value(timestamp, info):
+    """datetime64[ns] value of a timestamp in the stored (UTC or naive) time scale."""
+    timestamp = pd.Timestamp(timestamp)
+    if info['tz'] is not None:
+        if timestamp.tz is None:
+            timestamp = timestamp.tz_localize(info['tz'])
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return np.datetime64(timestamp.as_unit('ns').to_datetime64())
+
+
+def read_dataset(path, columns=None, start=None, end=None):
+    """
+    Open a dataset, reading only the requested columns and rows.
+
+    Columns are memory-mapped copy-on-write: nothing is read before it is
+    used, and changes to the frame never reach the files.
+
+    For Example::
+
+        poa = read_dataset('poa_data_2020_io', columns=['poa_global', 'temp_air'],
+                           start='2020-01-01', end='2020-01-07 23:00')
+
+    :param path: dataset directory
+    :param columns: column names to read, all if None
+    :param start: first timestamp to read (inclusive), naive timestamps are in
+        the dataset's timezone
+    :param end: last timestamp to read (inclusive)
+    :return: frame with the dataset's index
+    """
+    info = read_info(path)
+    values = np.load(os.path.join(path, INDEX_FILE), mmap_mode='r')
+    lo = 0 if start is None else np.searchsorted(values, _index_value(start, info), 'left')
+    hi = len(values) if end is None else np.searchsorted(values, _index_value(end, info), 'right')
+    files = {col['name']: col['file'] for col in info['columns']}
+    if columns is None:
+        columns = list(files)
+    missing = [name for name in columns if name not in files]
+    if missing:
+        raise KeyError('columns not in dataset %s: %r' % (path, missing))
+    return pd.DataFrame(
+        {name: np.load(os.path.join(path, files[name]), mmap_mode='c')[lo:hi]
+         for name in columns},
+        index=_make_index(values[lo:hi], info), columns=columns, copy=False)
+
+
+def load_dataset(path, columns=None, start=None, end=None, csv=None):
+    """
+    :func:`read_dataset`, converting the CSV file it replaces on first use.
+
+    Scripts used to write their weather as CSV files (``poa_data_2020_io.csv``,
+    ``pvlib_kalkbult.csv``), an existing one is turned into a dataset instead
+    of having to be downloaded again.
+
+    :param csv: CSV file with the timestamps in the first column, defaults to
+        ``path`` + ``'.csv'``
+    :return: frame with the dataset's index
+    """
+    if not is_dataset(path):
+        csv = path + '.csv' if csv is None else csv
+        if not os.path.isfile(csv):
+            raise FileNotFoundError('neither dataset %s nor %s exists' % (path, csv))
+        data = pd.read_csv(csv, index_col=0)
+        data.index = pd.to_datetime(data.index)
+        write_dataset(path, data, {'source': os.path.abspath(csv)})
+    return read_dataset(path, columns, start, end)
+
+
+def iter_dataset(path, chunksize, columns=None, start=None, end=None):
+    """
+    Read a dataset in chunks of ``chunksize`` rows, see :func:`read_dataset`.
+
+    :return: generator of memory-mapped frames
+    """
+    info = read_info(path)
+    values = np.load(os.path.join(path, INDEX_FILE), mmap_mode='r')
+    lo = 0 if start is None else np.searchsorted(values, _index_value(start, info), 'left')
+    hi = len(values) if end is None else np.searchsorted(values, _index_value(end, info), 'right')
+    data = read_dataset(path, columns)
+    for i in range(lo, hi, chunksize):
+        yield data.iloc[i:min(i + chunksize, hi)]
+
+
+class WeatherStore(object):
+    """
+    Directory of named datasets.
+
+    :param root: directory holding the datasets
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def __contains__(self, name):
+        return is_dataset(self.path(name))
+
+    def names(self):
+        """Names of all datasets in the store."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if not name.startswith('.') and name in self)
+
+    def write(self, name, data, meta=None):
+        return write_dataset(self.path(name), data, meta)
+
+    def writer(self, name, meta=None):
+        return DatasetWriter(self.path(name), meta)
+
+    def read(self, name, columns=None, start=None, end=None):
+        return read_dataset(self.path(name), columns, start, end)
+
+    def iter(self, name, chunksize, columns=None, start=None, end=None):
+        return iter_dataset(self.path(name), chunksize, columns, start, end)
+
+    def info(self, name):
+        return read_info(self.path(name))
+
+    def meta(self, name):
+        return read_meta(self.path(name))
+
+    def remove(self, name):
+        shutil.rmtree(self.path(name))